@@ -0,0 +1,257 @@
+"""
+Assinaturas de alerta por push (WebSocket /ws/alerts). O cliente registra
+locais; o servidor mantém o risco horário de cada local e só manda deltas.
+
+A cada ALERTS_POLL_S a thread do hub lê, para cada local assinado, as três
+entradas do risco (frame de clima da célula, seed, amostra de solo) dos
+caches — o primeiro snapshot de um local novo pode buscar clima, e uma célula
+vencida é renovada em prioridade BACKGROUND — e compara impressões digitais baratas com as da última rodada. Só quando alguma mudou
+roda de novo a previsão + build_hourly_risk; next_critical_hour, que depende só
+do relógio, é reavaliado sobre o risco guardado. Locais são compartilhados
+entre assinantes (chave = lat/lon arredondados), então mil painéis no mesmo
+lugar custam um cálculo e mensagens pequenas. Um assinante lento que perde um
+delta (fila cheia) deixa de receber deltas e ganha snapshots novos de todos os
+seus locais assim que a fila esvazia.
+
+Protocolo (JSON):
+  -> {"op": "subscribe", "locations": [{"id": "casa", "lat": 39.7, "lon": -105.0}]}
+  -> {"op": "unsubscribe", "ids": ["casa"]}
+  <- {"type": "snapshot", "id": ..., "risk": ..., "next_critical_hour": ..., "hourly_risk": [...], "ground": {...}}
+  <- {"type": "delta", "id": ..., "changes": {...}, "hourly_risk": {"set": {hora: risco}, "removed": [hora]}}
+  <- {"type": "error", "id": ..., "detail": ...}
+"""
+from __future__ import annotations
+import asyncio
+import hashlib
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+
+from upstream import BACKGROUND, request_context
+
+ALERTS_POLL_S = float(os.getenv("ALERTS_POLL_S", "60"))
+ALERTS_MAX_LOCATIONS = int(os.getenv("ALERTS_MAX_LOCATIONS", "20"))
+# subscribers lentos: acima disso as mensagens são descartadas e o assinante é ressincronizado com snapshots
+ALERTS_QUEUE_MAX = int(os.getenv("ALERTS_QUEUE_MAX", "256"))
+
+LocKey = Tuple[float, float]
+
+def loc_key(lat: float, lon: float) -> LocKey:
+    return (round(lat, 2), round(lon, 2))
+
+def frame_fingerprint(df: Optional[pd.DataFrame]) -> str:
+    if df is None or df.empty:
+        return ""
+    return hashlib.sha1(pd.util.hash_pandas_object(df, index=False).values.tobytes()).hexdigest()[:16]
+
+def ground_fingerprint(g: Optional[Dict[str, Any]]) -> str:
+    if not g:
+        return ""
+    return f"{g.get('station')}|{g.get('aqi')}|{g.get('time_local')}"
+
+class Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=ALERTS_QUEUE_MAX)
+        # id do cliente -> local
+        self.ids: Dict[str, LocKey] = {}
+        self.dropped = 0
+        # perdeu um delta: os próximos não se aplicam mais, precisa de snapshot
+        self.dirty = False
+
+    def push(self, msg: Dict[str, Any]) -> None:
+        """Pode ser chamado de qualquer thread."""
+        def put():
+            if self.dirty and msg.get("type") == "delta":
+                self.dropped += 1
+                return
+            try:
+                self.queue.put_nowait(msg)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                self.dirty = True
+        self.loop.call_soon_threadsafe(put)
+
+class _Location:
+    def __init__(self, lat: float, lon: float):
+        self.lat = lat
+        self.lon = lon
+        self.fp: Tuple[str, str, str] = ("", "", "")
+        self.state: Optional[Dict[str, Any]] = None
+        self.subs: Set[Tuple[Subscriber, str]] = set()
+        self.lock = threading.Lock()
+
+class AlertHub:
+    def __init__(
+        self,
+        inputs: Callable[[float, float, bool], Tuple[Optional[pd.DataFrame], float, Optional[Dict[str, Any]]]],
+        compute: Callable[[float, float, pd.DataFrame, float, Optional[Dict[str, Any]]], Dict[str, Any]],
+        next_critical: Callable[[List[Dict[str, Any]]], Optional[str]],
+        poll_s: float = ALERTS_POLL_S,
+    ):
+        """
+        inputs(lat, lon, fetch) -> (frame de clima | None, seed, amostra de solo | None), dos caches
+        (célula vencida renovada em BACKGROUND); com fetch=True (primeiro snapshot de um local) o clima pode ser buscado se a célula não estiver no cache.
+        compute(lat, lon, wx, seed, ground) -> {"risk", "ratio_peak_over_seed", "hourly_risk", "ground", "validation"}.
+        """
+        self.inputs = inputs
+        self.compute = compute
+        self.next_critical = next_critical
+        self.poll_s = poll_s
+        self._locs: Dict[LocKey, _Location] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.recomputes = 0
+        self.unchanged = 0
+        self.messages = 0
+        self.errors = 0
+        self.resyncs = 0
+
+    # --- assinaturas ---
+
+    def subscribe(self, sub: Subscriber, client_id: str, lat: float, lon: float) -> Dict[str, Any]:
+        """Registra e devolve o snapshot (calcula na hora se o local é novo; bloqueante)."""
+        if client_id in sub.ids:
+            self.unsubscribe(sub, [client_id])
+        if len(sub.ids) >= ALERTS_MAX_LOCATIONS:
+            raise ValueError(f"at most {ALERTS_MAX_LOCATIONS} locations per connection")
+        key = loc_key(lat, lon)
+        with self._lock:
+            loc = self._locs.get(key)
+            if loc is None:
+                loc = self._locs[key] = _Location(key[0], key[1])
+            loc.subs.add((sub, client_id))
+        sub.ids[client_id] = key
+        if loc.state is None:
+            self._refresh(loc, notify=False, fetch=True)
+        if loc.state is None:
+            raise RuntimeError("upstream error (weather)")
+        return {"type": "snapshot", "id": client_id, "lat": lat, "lon": lon, **loc.state}
+
+    def unsubscribe(self, sub: Subscriber, client_ids: List[str]) -> None:
+        with self._lock:
+            for cid in client_ids:
+                key = sub.ids.pop(cid, None)
+                loc = self._locs.get(key) if key else None
+                if loc is None:
+                    continue
+                loc.subs.discard((sub, cid))
+                if not loc.subs:
+                    self._locs.pop(key, None)
+
+    def drop(self, sub: Subscriber) -> None:
+        self.unsubscribe(sub, list(sub.ids))
+
+    def resync(self, sub: Subscriber) -> List[Dict[str, Any]]:
+        """Snapshots do estado atual de cada local do assinante (sem recalcular); limpa `dirty`."""
+        with self._lock:
+            items = [(cid, self._locs.get(key)) for cid, key in sub.ids.items()]
+        sub.dirty = False
+        self.resyncs += 1
+        return [{"type": "snapshot", "id": cid, "lat": loc.lat, "lon": loc.lon, **loc.state}
+                for cid, loc in items if loc is not None and loc.state is not None]
+
+    # --- recomputação incremental ---
+
+    def _refresh(self, loc: _Location, notify: bool = True, fetch: bool = False) -> None:
+        with loc.lock:
+            try:
+                wx, seed, ground = self.inputs(loc.lat, loc.lon, fetch)
+            except Exception as e:
+                self.errors += 1
+                print(f"[WARN] alerts: entradas ({loc.lat},{loc.lon}) -> {type(e).__name__}: {e}")
+                return
+            prev = loc.state
+            if wx is None and prev is None:
+                self.errors += 1
+                return
+            # célula fora do cache de clima: sem como recalcular, fica o estado atual
+            fp = loc.fp if wx is None else (frame_fingerprint(wx), f"{seed:.6e}", ground_fingerprint(ground))
+            if prev is not None and fp == loc.fp:
+                self.unchanged += 1
+                # só o relógio andou: reavalia a próxima hora crítica sobre o risco já calculado
+                nxt = self.next_critical(prev["hourly_risk"])
+                if nxt != prev["next_critical_hour"]:
+                    loc.state = {**prev, "next_critical_hour": nxt}
+                    if notify:
+                        self._notify(loc, {"changes": {"next_critical_hour": nxt}})
+                return
+            try:
+                out = self.compute(loc.lat, loc.lon, wx, seed, ground)
+            except Exception as e:
+                self.errors += 1
+                print(f"[WARN] alerts: recomputação ({loc.lat},{loc.lon}) -> {type(e).__name__}: {e}")
+                return
+            self.recomputes += 1
+            state = {**out, "next_critical_hour": self.next_critical(out["hourly_risk"])}
+            loc.fp = fp
+            loc.state = state
+            if notify and prev is not None:
+                delta = diff_states(prev, state)
+                if delta:
+                    self._notify(loc, delta)
+
+    def _notify(self, loc: _Location, delta: Dict[str, Any]) -> None:
+        with self._lock:
+            subs = list(loc.subs)
+        for sub, cid in subs:
+            sub.push({"type": "delta", "id": cid, **delta})
+            self.messages += 1
+
+    def tick(self) -> None:
+        with self._lock:
+            locs = list(self._locs.values())
+        for loc in locs:
+            if self._stop.is_set():
+                return
+            self._refresh(loc)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.poll_s):
+            try:
+                with request_context(priority=BACKGROUND):
+                    self.tick()
+            except Exception as e:
+                print(f"[WARN] alerts tick -> {type(e).__name__}: {e}")
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="alerts-hub", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            n_locs = len(self._locs)
+            n_subs = sum(len(l.subs) for l in self._locs.values())
+        return {
+            "locations": n_locs,
+            "subscriptions": n_subs,
+            "recomputes": self.recomputes,
+            "unchanged": self.unchanged,
+            "messages": self.messages,
+            "resyncs": self.resyncs,
+            "errors": self.errors,
+        }
+
+def diff_states(prev: Dict[str, Any], cur: Dict[str, Any]) -> Dict[str, Any]:
+    """Delta entre dois estados de um local; {} se nada visível mudou."""
+    changes = {k: cur.get(k) for k in ("risk", "ratio_peak_over_seed", "next_critical_hour", "ground", "validation")
+               if cur.get(k) != prev.get(k)}
+    old = {r["datetime_utc"]: r["risk"] for r in prev.get("hourly_risk") or []}
+    new = {r["datetime_utc"]: r["risk"] for r in cur.get("hourly_risk") or []}
+    set_ = {t: r for t, r in new.items() if old.get(t) != r}
+    removed = [t for t in old if t not in new]
+    out: Dict[str, Any] = {}
+    if changes:
+        out["changes"] = changes
+    if set_ or removed:
+        out["hourly_risk"] = {"set": set_, "removed": removed}
+    return out
@@ -4,23 +4,23 @@ from dotenv import load_dotenv
 load_dotenv(dotenv_path=Path(__file__).parent / ".env")
 
 from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import json
 import time
 import os
+import threading
+from contextlib import asynccontextmanager
 from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from datetime import datetime, timedelta, timezone
-from io import BytesIO
 
 import numpy as np
 import pandas as pd
-import xarray as xr
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
 
-from fastapi import FastAPI, Query, HTTPException
+from fastapi import FastAPI, Query, HTTPException, Header, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
-from pydantic import BaseModel, Field
+from fastapi.responses import Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, ValidationError
 
 from nasa_tempo import (
     fetch_tempo_no2_by_time_bbox,
@@ -28,11 +28,46 @@ from nasa_tempo import (
     COLL_L3_NRT_NO2,
     COLL_L2_NRT_NO2,
 )
-from weather_openweather import fetch_forecast, forecast_to_df, to_hourly
-from forecast import forecast_no2_24h
+from weather_openweather import fetch_forecast, forecast_to_hourly
+from forecast import RISK_HIGH_RATIO, RISK_LABELS, ensemble_np, forecast_no2_24h, meteo_factor_np, multi_species_np, risk_level_np
 from aqicn_client import fetch_nearest as aqicn_fetch
+from ground_stations import GroundLayer
+from weather_cache import WEATHER_CACHE_MAX_CELLS, WeatherGridCache, cell_of
+from mosaic import MosaicCache
+from history import HistoryStore
+from alerts import AlertHub, Subscriber
+from render_pool import RenderError, RenderPool, RenderTimeout
+from grid_product import GRID_BBOX, FIELDS as GRID_FIELDS, GridJob, GridStore, build_grid_product, fetch_tempo_window
+from upstream import (
+    SCHEDULER,
+    BACKGROUND,
+    BATCH,
+    UpstreamDropped,
+    UpstreamUnavailable,
+    remaining_s,
+    request_context,
+    submit_in_context,
+)
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    if AQICN_SNAPSHOT_ENABLED:
+        GROUND.start()
+    if GRID_PRODUCT_ENABLED:
+        GRID_JOB.start()
+    if HISTORY_ENABLED:
+        HISTORY.start()
+    ALERTS.start()
+    RENDER.start()
+    yield
+    RENDER.stop()
+    ALERTS.stop()
+    GROUND.stop()
+    GRID_JOB.stop()
+    if HISTORY_ENABLED:
+        HISTORY.stop()
 
-app = FastAPI(title="TEMPO + Weather Forecast API", version="0.6.0")
+app = FastAPI(title="TEMPO + Weather Forecast API", version="0.6.0", lifespan=_lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -56,9 +91,45 @@ CACHE_TTL_SECONDS = 30 * 60
 OVERLAY_CACHE: Dict[str, tuple[float, bytes]] = {}
 OVERLAY_CACHE_TTL = 10 * 60
 
+# itens de /states/summary por (estado, skip_nasa), mesmo TTL do _CACHE
+SUMMARY_CACHE: Dict[tuple[str, bool], tuple[float, Dict[str, Any]]] = {}
+
 TEMPO_TIMEOUT_S = float(os.getenv("TEMPO_TIMEOUT_S", "8"))
 OPENWEATHER_TIMEOUT_S = float(os.getenv("OPENWEATHER_TIMEOUT_S", "8"))
 NO2_SEED_FALLBACK = float(os.getenv("NO2_SEED_FALLBACK", "3.0e15"))
+# prazo total de um /forecast; o cliente pode pedir menos via X-Request-Timeout-Ms
+FORECAST_DEADLINE_S = float(os.getenv("FORECAST_DEADLINE_S", str(max(TEMPO_TIMEOUT_S, OPENWEATHER_TIMEOUT_S) + 2)))
+
+# snapshot AQICN em memória; enquanto não estiver pronto/fresco cai no /feed/geo: ao vivo
+AQICN_SNAPSHOT_ENABLED = os.getenv("AQICN_SNAPSHOT_ENABLED", "1") not in ("0", "false", "False")
+GROUND = GroundLayer()
+
+# clima horário compartilhado por célula de grade (WEATHER_GRID, ver weather_cache.py)
+WX_CACHE = WeatherGridCache()
+
+# último seed TEMPO (não fallback) calculado por célula de clima; o hub de alertas lê daqui sem ir ao Harmony
+_SEEDS: Dict[str, float] = {}
+_SEEDS_LOCK = threading.Lock()
+
+# composição de todos os granules da janela (seed e overlay), ver mosaic.py
+MOSAICS = MosaicCache(DATA_DIR / "mosaics")
+
+# produto em grade CONUS (grid_product.py); o build periódico custa ~centenas de
+# chamadas OpenWeather por hora, então só liga com GRID_PRODUCT_ENABLED=1 (ou cron no CLI)
+GRID_PRODUCT_ENABLED = os.getenv("GRID_PRODUCT_ENABLED", "0") not in ("0", "false", "False")
+GRID = GridStore(DATA_DIR / "grid" / "conus_latest.npz")
+
+# histórico Parquet de cada previsão calculada (history.py), gravado em lote fora do request
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "1") not in ("0", "false", "False")
+HISTORY = HistoryStore(DATA_DIR / "history")
+
+# PNGs (overlay, camadas da grade) num pool de processos, arrays via .npy em tmpfs (render_pool.py)
+RENDER = RenderPool()
+
+# ensemble probabilístico do NO2 (forecast.ensemble_np); 0 desliga. Semente fixa: mesma entrada, mesmo payload
+ENSEMBLE_MEMBERS = int(os.getenv("ENSEMBLE_MEMBERS", "100"))
+ENSEMBLE_RNG_SEED = int(os.getenv("ENSEMBLE_RNG_SEED", "0"))
+ENSEMBLE_QUANTILES = (0.1, 0.5, 0.9)
 
 class ForecastPoint(BaseModel):
     datetime_utc: str
@@ -102,8 +173,15 @@ class ForecastPayload(BaseModel):
     tempo: Dict[str, Any]
     ground: GroundSample | None = None
     alerts: Dict[str, Any] | None = None
+    ensemble: Dict[str, Any] | None = None
     validation: Dict[str, Any] | None = None
 
+class AlertLocation(BaseModel):
+    """Item de `locations` no subscribe do /ws/alerts."""
+    id: str | int | None = None
+    lat: float = Field(..., ge=-90, le=90)
+    lon: float = Field(..., ge=-180, le=180)
+
 def _round_key(lat: float, lon: float, digits: int = 4) -> tuple[float, float]:
     return (round(lat, digits), round(lon, digits))
 
@@ -123,6 +201,33 @@ def _compute_risk(no2_seed: float, fc_no2: pd.DataFrame) -> tuple[str, float]:
         return ("moderate", ratio)
     return ("low", ratio)
 
+def _aqi_bucket(aqi_val) -> str:
+    try:
+        v = float(aqi_val) if aqi_val is not None and str(aqi_val).strip() != "" else None
+    except Exception:
+        return "unknown"
+    if v is None:
+        return "unknown"
+    if v >= 151:
+        return "high"
+    if v >= 101:
+        return "moderate"
+    return "low"
+
+def _ground_override(risk_label: str, aqi_val) -> str:
+    """AQI de solo >= 151 (insalubre) força "high", qualquer que seja a previsão."""
+    return "high" if _aqi_bucket(aqi_val) == "high" else risk_label
+
+def _concordance(g_bucket: str, model_bucket: str) -> str:
+    if g_bucket == "unknown":
+        return "unknown"
+    if g_bucket == model_bucket:
+        return "agree"
+    order = {"low": 0, "moderate": 1, "high": 2}
+    if order.get(g_bucket, 1) > order.get(model_bucket, 1):
+        return "underpredict"
+    return "overpredict"
+
 def _fmt_iso(dt: datetime) -> str:
     return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
@@ -148,110 +253,163 @@ def _join_forecast_weather(fc_no2: pd.DataFrame, wx_hourly: pd.DataFrame) -> pd.
     )
     return m
 
-def _meteo_factor(row: pd.Series) -> float:
-    f = 1.0
-    ws = row.get("wind_speed", None)
-    if isinstance(ws, (int, float)):
-        if ws >= 12:
-            f *= 0.80
-        elif ws >= 8:
-            f *= 0.90
-        elif ws <= 2:
-            f *= 1.05
-    cl = row.get("clouds", None)
-    if isinstance(cl, (int, float)):
-        if cl >= 80:
-            f *= 0.95
-        elif cl <= 20:
-            f *= 1.05
-    r = row.get("rain_1h_est", None)
-    if isinstance(r, (int, float)) and r > 0:
-        f *= 0.85
-    return float(max(0.6, min(1.4, f)))
-
 def adjust_no2_with_meteo(fc_no2: pd.DataFrame, wx_hourly: pd.DataFrame) -> pd.DataFrame:
     m = _join_forecast_weather(fc_no2, wx_hourly)
-    m["adj_factor"] = m.apply(_meteo_factor, axis=1)
+    m["adj_factor"] = meteo_factor_np(
+        pd.to_numeric(m["wind_speed"], errors="coerce"),
+        pd.to_numeric(m["clouds"], errors="coerce"),
+        pd.to_numeric(m["rain_1h_est"], errors="coerce"),
+    )
     m["no2_forecast"] = (m["no2_forecast"] * m["adj_factor"]).astype(float)
     return m[["datetime_utc", "no2_forecast"]]
 
+def build_ensemble(fc_base: pd.DataFrame, wx_hourly: pd.DataFrame, no2_seed: float,
+                   members: int = ENSEMBLE_MEMBERS) -> Optional[Dict[str, Any]]:
+    """
+    Quantis horários do NO2, P(hora "high") e a distribuição do rótulo de risco
+    entre os membros. fc_base é a saída de forecast_no2_24h (antes do ajuste meteorológico).
+    """
+    if members <= 1 or fc_base.empty or not no2_seed or no2_seed <= 0:
+        return None
+    m = _join_forecast_weather(fc_base, wx_hourly)
+    col = lambda c: pd.to_numeric(m[c], errors="coerce").to_numpy(dtype=float)
+    rng = np.random.default_rng(ENSEMBLE_RNG_SEED)
+    ens, seed_k = ensemble_np(col("no2_forecast"), col("wind_speed"), col("clouds"), col("rain_1h_est"), members, rng)
+    qs = np.quantile(ens, ENSEMBLE_QUANTILES, axis=0)
+    # limiares relativos ao seed de cada membro: a incerteza do seed abre os quantis
+    # de NO2, mas não inventa espalhamento no risco (que é razão pico/seed)
+    member_seed = no2_seed * seed_k
+    p_high = (ens >= RISK_HIGH_RATIO * member_seed).mean(axis=0)
+    peak = ens.max(axis=1)
+    levels = risk_level_np(peak, member_seed[:, 0])
+    # colunar (uma lista por campo, alinhada com "forecast"): bem menor que um dict por hora
+    hourly: Dict[str, Any] = {"datetime_utc": m["datetime_utc"].dt.strftime("%Y-%m-%dT%H:%M:%SZ").tolist()}
+    for k, q in enumerate(ENSEMBLE_QUANTILES):
+        hourly[f"no2_p{int(round(q * 100)):02d}"] = qs[k].tolist()
+    hourly["p_high"] = np.round(p_high, 4).tolist()
+    ratio_q = np.quantile(peak / member_seed[:, 0], ENSEMBLE_QUANTILES)
+    return {
+        "members": members,
+        "quantiles": list(ENSEMBLE_QUANTILES),
+        "hourly": hourly,
+        "risk_probabilities": {lab: round(float((levels == k).mean()), 4) for k, lab in enumerate(RISK_LABELS)},
+        "ratio_peak_over_seed": {f"p{int(round(q * 100)):02d}": float(v) for q, v in zip(ENSEMBLE_QUANTILES, ratio_q)},
+    }
+
 def build_hourly_risk(no2_seed: float, fc_no2: pd.DataFrame) -> List[Dict[str, Any]]:
-    rows: List[Dict[str, Any]] = []
-    hi = 1.2 * no2_seed
-    md = 1.0 * no2_seed
-    for _, r in fc_no2.iterrows():
-        v = float(r["no2_forecast"])
-        if v >= hi:
-            rk = "high"
-        elif v >= md:
-            rk = "moderate"
-        else:
-            rk = "low"
-        rows.append({"datetime_utc": pd.to_datetime(r["datetime_utc"], utc=True).strftime("%Y-%m-%dT%H:%M:%SZ"), "risk": rk})
-    return rows
+    levels = risk_level_np(fc_no2["no2_forecast"].astype(float).to_numpy(), no2_seed)
+    times = pd.to_datetime(fc_no2["datetime_utc"], utc=True).dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+    return [{"datetime_utc": t, "risk": RISK_LABELS[k]} for t, k in zip(times, levels)]
 
-def next_critical_hour(hourly_risk: List[Dict[str, Any]]) -> Optional[str]:
-    now = pd.Timestamp.now(tz="UTC")
+def next_critical_hour(hourly_risk: List[Dict[str, Any]], now: Optional[pd.Timestamp] = None) -> Optional[str]:
+    # now: referência da rodada; replays em lote passam a emissão, não o relógio
+    now = pd.Timestamp.now(tz="UTC") if now is None else pd.Timestamp(now)
+    now = now.tz_localize("UTC") if now.tz is None else now.tz_convert("UTC")
     for r in hourly_risk:
+        # só horas "high" interessam: evita parsear a série inteira
+        if r["risk"] != "high":
+            continue
         t = pd.to_datetime(r["datetime_utc"], utc=True)
         if getattr(t, "tz", None) is None:
             t = t.tz_localize("UTC")
         else:
             t = t.tz_convert("UTC")
-        if t >= now and r["risk"] == "high":
+        if t >= now:
             return t.strftime("%Y-%m-%dT%H:%M:%SZ")
     return None
 
-def _open_no2_dataset(nc_path: str) -> tuple[xr.Dataset, str]:
-    ds = None
-    last_err = None
+def _render_grid_png(lon: np.ndarray, lat: np.ndarray, z: np.ndarray, bbox: Tuple[float, float, float, float],
+                     cmap: Any = "plasma", vmin: Optional[float] = None, vmax: Optional[float] = None) -> bytes:
+    """PNG transparente do campo numa grade regular (mosaico, produto em grade), no pool de render."""
+    return RENDER.render(lon, lat, z, bbox, cmap=cmap, vmin=vmin, vmax=vmax)
+
+def _seed_from_granules(files: List[str], bbox: Tuple[float, float, float, float], prefer_l3: bool) -> tuple[float, Optional[Dict[str, Any]]]:
+    """Seed = média do mosaico de todos os granules no bbox; sem cobertura no bbox, média do primeiro granule."""
+    coll = COLL_L3_NRT_NO2 if prefer_l3 else COLL_L2_NRT_NO2
     try:
-        ds = xr.open_dataset(nc_path, engine="netcdf4", group="product")
+        mos = MOSAICS.get(files, bbox, coll)
+        seed = mos.seed()
+        if np.isfinite(seed):
+            return seed, mos.info()
     except Exception as e:
-        last_err = e
-    if ds is None:
+        print(f"[WARN] mosaic seed -> {type(e).__name__}: {e}")
+    return compute_no2_seed(files[0]), None
+
+def _build_grid() -> Dict[str, Any]:
+    files, coll = fetch_tempo_window(DATA_DIR, GRID_BBOX)
+    return build_grid_product(
+        GRID.path,
+        lambda a, b: WX_CACHE.get(a, b, _fetch_weather_hourly),
+        files,
+        seed_fallback=NO2_SEED_FALLBACK,
+        collection=coll,
+        mosaics=MOSAICS,
+    )
+
+GRID_JOB = GridJob(_build_grid, GRID)
+
+def _remember_seed(lat: float, lon: float, seed: float) -> None:
+    key = cell_of(lat, lon, WX_CACHE.grid)[0]
+    with _SEEDS_LOCK:
+        _SEEDS.pop(key, None)
+        _SEEDS[key] = float(seed)
+        while len(_SEEDS) > WEATHER_CACHE_MAX_CELLS:
+            _SEEDS.pop(next(iter(_SEEDS)))
+
+def _known_seed(lat: float, lon: float) -> Optional[float]:
+    with _SEEDS_LOCK:
+        return _SEEDS.get(cell_of(lat, lon, WX_CACHE.grid)[0])
+
+def _alert_inputs(lat: float, lon: float, fetch: bool = False) -> tuple[Optional[pd.DataFrame], float, Optional[Dict[str, Any]]]:
+    """
+    Entradas do risco de um local assinado, dos caches: célula de clima, seed da
+    grade ou do último /forecast da célula, snapshot AQICN. fetch=True (primeiro
+    snapshot) busca o clima se a célula ainda não existe. Célula vencida é renovada
+    em BACKGROUND; se o upstream falhar, segue o frame vencido.
+    """
+    wx = WX_CACHE.peek(lat, lon)
+    if wx is None and fetch:
+        wx = WX_CACHE.get(lat, lon, _fetch_weather_hourly)
+    elif wx is not None and not WX_CACHE.is_fresh(lat, lon):
+        # local só com assinantes de alerta: sem /forecast mantendo a célula, o tick é quem a renova
         try:
-            ds = xr.open_dataset(nc_path, engine="h5netcdf", group="product")
+            with request_context(priority=BACKGROUND, deadline_s=OPENWEATHER_TIMEOUT_S):
+                wx = WX_CACHE.get(lat, lon, _fetch_weather_hourly)
         except Exception as e:
-            last_err = e
-    if ds is None:
-        raise RuntimeError(f"failed to open {nc_path}: {last_err}")
-    for cand in ["vertical_column_troposphere", "vertical_column", "no2", "NO2"]:
-        if cand in ds.data_vars:
-            return ds, cand
-    raise RuntimeError("NO2 variable not found")
-
-def _open_geo(nc_path: str) -> tuple[np.ndarray, np.ndarray]:
-    geo = None
-    try:
-        geo = xr.open_dataset(nc_path, engine="netcdf4", group="geolocation")
-    except Exception:
-        try:
-            geo = xr.open_dataset(nc_path, engine="h5netcdf", group="geolocation")
-        except Exception:
-            geo = None
-    if geo is None or ("latitude" not in geo) or ("longitude" not in geo):
-        raise RuntimeError("geolocation not found")
-    return geo["longitude"].values, geo["latitude"].values
-
-def _render_no2_overlay_png(nc_path: str, bbox: Tuple[float, float, float, float]) -> bytes:
-    ds, vname = _open_no2_dataset(nc_path)
-    lon, lat = _open_geo(nc_path)
-    z = ds[vname].values.astype(float)
-    z = np.where(np.isfinite(z), z, np.nan)
-    fig, ax = plt.subplots(figsize=(7.2, 4.2), dpi=150)
-    ax.set_xlim([bbox[0], bbox[2]])
-    ax.set_ylim([bbox[1], bbox[3]])
-    ax.set_xticks([])
-    ax.set_yticks([])
-    ax.set_facecolor((0, 0, 0, 0))
-    ax.pcolormesh(lon, lat, z, shading="auto", cmap="plasma")
-    for spine in ax.spines.values():
-        spine.set_visible(False)
-    buf = BytesIO()
-    plt.savefig(buf, format="png", bbox_inches="tight", pad_inches=0, transparent=True)
-    plt.close(fig)
-    return buf.getvalue()
+            print(f"[WARN] alerts: clima vencido ({lat},{lon}) -> {type(e).__name__}: {e}")
+    seed = None
+    prod = GRID.current()
+    if prod is not None:
+        p = prod.point(lat, lon)
+        seed = p["no2_seed"] if p else None
+    if seed is None:
+        seed = _known_seed(lat, lon)
+    # o alerta só usa AQI/estação: sem feed da estação (que iria ao AQICN)
+    ground = GROUND.nearest(lat, lon, pollutants=False) if GROUND.is_fresh() else None
+    return wx, float(seed or NO2_SEED_FALLBACK), ground
+
+def _alert_compute(lat: float, lon: float, wx: pd.DataFrame, seed: float, ground: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if wx.empty:
+        raise RuntimeError("empty weather")
+    fc_no2 = adjust_no2_with_meteo(forecast_no2_24h(wx, seed), wx)
+    risk_label, ratio = _compute_risk(seed, fc_no2)
+    model_bucket_raw = risk_label
+    aqi = ground.get("aqi") if ground else None
+    if ground:
+        risk_label = _ground_override(risk_label, aqi)
+    g_bucket = _aqi_bucket(aqi) if ground else "unknown"
+    return {
+        "risk": risk_label,
+        "ratio_peak_over_seed": ratio,
+        "no2_seed": seed,
+        "hourly_risk": build_hourly_risk(seed, fc_no2),
+        "ground": {k: ground.get(k) for k in ("aqi", "station", "time_local")} if ground else None,
+        "validation": {"ground_bucket": g_bucket, "model_bucket": risk_label, "model_bucket_raw": model_bucket_raw,
+                       "concordance": _concordance(g_bucket, risk_label)},
+    }
+
+# push de alertas (alerts.py): recalcula um local só quando clima/seed/solo mudam
+ALERTS = AlertHub(_alert_inputs, _alert_compute, lambda hr: next_critical_hour(hr))
 
 def _safe_fill(s, val):
     return s.fillna(val) if hasattr(s, "fillna") else s
@@ -269,15 +427,13 @@ def build_multi_species_forecast(fc_no2: pd.DataFrame, wx_hourly: pd.DataFrame)
             m[col] = default
         m[col] = _safe_fill(pd.to_numeric(m[col], errors="coerce"), default)
     no2 = pd.to_numeric(m["no2_forecast"], errors="coerce").fillna(0.0)
-    tnorm = ((m["temp"] + 5.0) / 30.0).clip(0.3, 1.6)
-    clr = ((100.0 - m["clouds"]) / 60.0).clip(0.5, 1.5)
-    calm = (6.0 - m["wind_speed"]).clip(0.0, 6.0)
-    m["o3_forecast"] = (0.06 * no2 * tnorm * clr).astype(float)
-    m["hcho_forecast"] = (0.03 * no2 * clr).astype(float)
-    m["ai"] = (0.4 + 0.07 * calm + 0.005 * m["clouds"]).clip(0.0, 5.0).astype(float)
-    m["pm25_forecast"] = (6.0 + 0.9 * m["ai"] + 0.15 * calm).clip(0.0, 200.0).astype(float)
+    for col, arr in multi_species_np(no2, m["temp"], m["clouds"], m["wind_speed"]).items():
+        m[col] = arr
     return m[["datetime_utc", "no2_forecast", "o3_forecast", "hcho_forecast", "ai", "pm25_forecast"]]
 
+def _fetch_weather_hourly(lat: float, lon: float) -> pd.DataFrame:
+    return forecast_to_hourly(fetch_forecast(lat, lon, units="metric"))
+
 def _fetch_tempo_fast(lat: float, lon: float, start: Optional[str], end: Optional[str], bbox: Optional[str]):
     now = datetime.now(timezone.utc)
     s_iso = start or _fmt_iso(now - timedelta(hours=4))
@@ -305,17 +461,126 @@ def _fetch_tempo_robust(lat: float, lon: float, start: Optional[str], end: Optio
             attempts.append((s, e, bb))
     for s_iso, e_iso, bb2 in attempts:
         for prefer_l3 in (True, False):
+            if remaining_s(float("inf")) <= 0:
+                raise RuntimeError("No matching granules (robust, deadline)")
             try:
                 files = fetch_tempo_no2_by_time_bbox(DATA_DIR, s_iso, e_iso, bb2, prefer_l3=prefer_l3)
                 if files:
                     return files, s_iso, e_iso, bb2, prefer_l3
+            except (UpstreamUnavailable, UpstreamDropped):
+                # Harmony fora (breaker aberto) ou sem prazo: outras janelas também não vão dar certo
+                raise
             except Exception:
                 pass
     raise RuntimeError("No matching granules (robust)")
 
+def _assemble_payload(
+    lat: float,
+    lon: float,
+    wx_hourly: pd.DataFrame,
+    no2_seed: float,
+    g: Optional[Dict[str, Any]],
+    *,
+    files: List[str],
+    start_iso: str,
+    end_iso: str,
+    bbox_tuple: Tuple[float, float, float, float],
+    prefer_used: bool,
+    mosaic_info: Optional[Dict[str, Any]],
+    fallback_used: bool,
+    mode: str,
+    issued: Optional[pd.Timestamp] = None,
+) -> Dict[str, Any]:
+    """Pipeline do /forecast a partir das entradas já obtidas (clima horário, seed, amostra de solo); sem I/O.
+
+    issued: instante de referência para next_critical_hour (default: agora).
+    """
+    if wx_hourly.empty:
+        raise RuntimeError("empty weather")
+    fc_base = forecast_no2_24h(wx_hourly, no2_seed)
+    fc_no2 = adjust_no2_with_meteo(fc_base, wx_hourly)
+    ensemble = build_ensemble(fc_base, wx_hourly, no2_seed)
+    fc_multi = build_multi_species_forecast(fc_no2, wx_hourly)
+    risk_label, ratio = _compute_risk(no2_seed, fc_no2)
+    hourly_risk = build_hourly_risk(no2_seed, fc_no2)
+    nexth = next_critical_hour(hourly_risk, issued)
+    coll_used = COLL_L3_NRT_NO2 if prefer_used else COLL_L2_NRT_NO2
+    # risco do modelo antes do ajuste pelo solo: é o que a verificação de skill compara com o AQI
+    model_bucket_raw = risk_label
+    ground: GroundSample | None = None
+    try:
+        ground = GroundSample(**g) if g else None
+        if ground:
+            risk_label = _ground_override(risk_label, ground.aqi)
+    except Exception:
+        ground = None
+    g_bucket = _aqi_bucket(ground.aqi) if ground else "unknown"
+    model_bucket = risk_label
+    concordance = _concordance(g_bucket, model_bucket)
+
+    try:
+        peak_idx = fc_multi["no2_forecast"].astype(float).idxmax()
+        peak_row = fc_multi.loc[peak_idx]
+        peak_time_iso = pd.to_datetime(peak_row["datetime_utc"], utc=True).strftime("%Y-%m-%dT%H:%M:%SZ")
+        peak_val = float(peak_row["no2_forecast"])
+    except Exception:
+        peak_time_iso = None
+        peak_val = None
+
+    payload: Dict[str, Any] = {
+        "lat": lat,
+        "lon": lon,
+        "no2_seed": float(no2_seed),
+        "risk": risk_label,
+        "ratio_peak_over_seed": ratio,
+        "forecast": _df_to_records_iso(fc_multi),
+        "weather": _df_to_records_iso(wx_hourly),
+        "tempo": {
+            "collection_id": coll_used,
+            "temporal_used": {"start": start_iso, "end": end_iso},
+            "bbox_used": {
+                "minLon": bbox_tuple[0], "minLat": bbox_tuple[1],
+                "maxLon": bbox_tuple[2], "maxLat": bbox_tuple[3]
+            },
+            "granules": [Path(p).name for p in files],
+            "mosaic": mosaic_info,
+            "mode": mode,
+            "timeout_s": TEMPO_TIMEOUT_S,
+            "fallback_used": fallback_used,
+            "seed_units": "molecules/cm^2",
+            "species_units": {
+                "no2_forecast": "molecules/cm^2",
+                "o3_forecast": "ppbv (proxy)",
+                "hcho_forecast": "ppbv (proxy)",
+                "ai": "index",
+                "pm25_forecast": "µg/m³ (proxy)"
+            },
+            "nowcast_peak": {
+                "datetime_utc": peak_time_iso,
+                "no2_forecast": peak_val
+            },
+            "forecast_window_h": int(len(fc_multi)),
+            "sources": {
+                "satellite": "NASA TEMPO",
+                "weather": "OpenWeather",
+                "ground": "AQICN"
+            }
+        },
+        "ground": ground,
+        "alerts": {"hourly_risk": hourly_risk, "next_critical_hour": nexth},
+        "ensemble": ensemble,
+        "validation": {
+            "ground_bucket": g_bucket,
+            "model_bucket": model_bucket,
+            "model_bucket_raw": model_bucket_raw,
+            "concordance": concordance
+        },
+    }
+    return payload
+
 @app.get("/health")
 def health():
-    return {"ok": True, "service": "tempo-weather-api", "version": "0.6.0"}
+    return {"ok": True, "service": "tempo-weather-api", "version": "0.6.0", "ground_snapshot": GROUND.stats()}
 
 @app.get("/forecast", response_model=ForecastPayload)
 def forecast(
@@ -327,7 +592,24 @@ def forecast(
     mode: str = Query("auto"),
     require_nasa: bool = Query(False),
     skip_nasa: bool = Query(False),
+    x_request_timeout_ms: Optional[int] = Header(None),
 ):
+    budget = FORECAST_DEADLINE_S
+    if x_request_timeout_ms and x_request_timeout_ms > 0:
+        budget = min(budget, x_request_timeout_ms / 1000.0)
+    with request_context(deadline_s=budget):
+        return _forecast(lat, lon, start, end, bbox, mode, require_nasa, skip_nasa)
+
+def _forecast(
+    lat: float,
+    lon: float,
+    start: Optional[str],
+    end: Optional[str],
+    bbox: Optional[str],
+    mode: str,
+    require_nasa: bool,
+    skip_nasa: bool,
+) -> Dict[str, Any]:
     key = _round_key(lat, lon)
     ts, cached = _CACHE.get(key, (0.0, None))
     if mode == "cache" and cached:
@@ -335,24 +617,29 @@ def forecast(
     if cached and (time.time() - ts) < CACHE_TTL_SECONDS and mode == "auto" and not (start or end or bbox or skip_nasa or require_nasa):
         return cached
     try:
-        with ThreadPoolExecutor(max_workers=2) as ex:
-            wx_future = ex.submit(lambda: to_hourly(forecast_to_df(fetch_forecast(lat, lon, units="metric"))))
+        ex = ThreadPoolExecutor(max_workers=2)
+        try:
+            # o que ainda estiver na fila do agendador quando o resultado deixar de ser esperado é descartado
+            with request_context(deadline_s=OPENWEATHER_TIMEOUT_S):
+                wx_future = submit_in_context(ex, WX_CACHE.get, lat, lon, _fetch_weather_hourly)
             if skip_nasa:
                 tempo_future = None
             else:
-                tempo_future = ex.submit(_fetch_tempo_fast if mode == "fast" else _fetch_tempo_robust, lat, lon, start, end, bbox)
+                with request_context(deadline_s=TEMPO_TIMEOUT_S):
+                    tempo_future = submit_in_context(ex, _fetch_tempo_fast if mode == "fast" else _fetch_tempo_robust, lat, lon, start, end, bbox)
             try:
-                wx_hourly = wx_future.result(timeout=OPENWEATHER_TIMEOUT_S)
+                wx_hourly = wx_future.result(timeout=remaining_s(OPENWEATHER_TIMEOUT_S))
             except (FuturesTimeout, Exception):
                 raise HTTPException(status_code=503, detail="OpenWeather timeout/erro")
             if skip_nasa:
                 files, start_iso, end_iso, bbox_tuple, prefer_used = [], start or "", end or "", _bbox_default(lat, lon), True
                 no2_seed = NO2_SEED_FALLBACK
+                mosaic_info = None
                 fallback_used = True
             else:
                 try:
-                    files, start_iso, end_iso, bbox_tuple, prefer_used = tempo_future.result(timeout=TEMPO_TIMEOUT_S)
-                    no2_seed = compute_no2_seed(files[0])
+                    files, start_iso, end_iso, bbox_tuple, prefer_used = tempo_future.result(timeout=remaining_s(TEMPO_TIMEOUT_S))
+                    no2_seed, mosaic_info = _seed_from_granules(files, bbox_tuple, prefer_used)
                     fallback_used = False
                 except (FuturesTimeout, Exception):
                     no2_seed = NO2_SEED_FALLBACK
@@ -361,114 +648,35 @@ def forecast(
                     bbox_tuple = _bbox_default(lat, lon)
                     prefer_used = True
                     files = []
+                    mosaic_info = None
                     fallback_used = True
+        finally:
+            # não espera tarefas que estouraram o tempo: elas caem sozinhas no prazo do contexto
+            ex.shutdown(wait=False)
         if require_nasa and fallback_used:
             raise HTTPException(status_code=424, detail="NASA TEMPO ausente nesta janela/bbox (fallback em uso).")
         if wx_hourly.empty:
             raise RuntimeError("empty weather")
-        fc_no2 = forecast_no2_24h(wx_hourly, no2_seed)
-        fc_no2 = adjust_no2_with_meteo(fc_no2, wx_hourly)
-        fc_multi = build_multi_species_forecast(fc_no2, wx_hourly)
-        risk_label, ratio = _compute_risk(no2_seed, fc_no2)
-        hourly_risk = build_hourly_risk(no2_seed, fc_no2)
-        nexth = next_critical_hour(hourly_risk)
-        coll_used = COLL_L3_NRT_NO2 if prefer_used else COLL_L2_NRT_NO2
-        ground: GroundSample | None = None
-        try:
-            g = aqicn_fetch(lat, lon)
-            ground = GroundSample(**g)
-            if isinstance(ground.aqi, (int, float, str)) and str(ground.aqi).strip() != "":
-                try:
-                    aqi_num = float(ground.aqi)
-                    if aqi_num >= 151 and risk_label != "high":
-                        risk_label = "high"
-                except Exception:
-                    pass
-        except Exception:
-            ground = None
-        def _aqi_bucket(aqi_val) -> str:
-            try:
-                v = float(aqi_val) if aqi_val is not None and str(aqi_val).strip() != "" else None
-            except Exception:
-                return "unknown"
-            if v is None:
-                return "unknown"
-            if v >= 151:
-                return "high"
-            if v >= 101:
-                return "moderate"
-            return "low"
-        g_bucket = _aqi_bucket(ground.aqi) if ground else "unknown"
-        model_bucket = risk_label
-        concordance = "unknown"
-        if g_bucket != "unknown":
-            if g_bucket == model_bucket:
-                concordance = "agree"
-            else:
-                order = {"low": 0, "moderate": 1, "high": 2}
-                if order.get(g_bucket, 1) > order.get(model_bucket, 1):
-                    concordance = "underpredict"
-                else:
-                    concordance = "overpredict"
-
         try:
-            peak_idx = fc_multi["no2_forecast"].astype(float).idxmax()
-            peak_row = fc_multi.loc[peak_idx]
-            peak_time_iso = pd.to_datetime(peak_row["datetime_utc"], utc=True).strftime("%Y-%m-%dT%H:%M:%SZ")
-            peak_val = float(peak_row["no2_forecast"])
+            # poluentes da estação só se o feed já estiver em cache (senão chegam em background);
+            # snapshot sem estação até AQICN_SNAPSHOT_MAX_KM (ou vencido): /feed/geo: ao vivo
+            g = GROUND.nearest(lat, lon) if GROUND.is_fresh() else None
+            if g is None:
+                g = aqicn_fetch(lat, lon)
         except Exception:
-            peak_time_iso = None
-            peak_val = None
-
-        payload: Dict[str, Any] = {
-            "lat": lat,
-            "lon": lon,
-            "no2_seed": float(no2_seed),
-            "risk": risk_label,
-            "ratio_peak_over_seed": ratio,
-            "forecast": _df_to_records_iso(fc_multi),
-            "weather": _df_to_records_iso(wx_hourly),
-            "tempo": {
-                "collection_id": coll_used,
-                "temporal_used": {"start": start_iso, "end": end_iso},
-                "bbox_used": {
-                    "minLon": bbox_tuple[0], "minLat": bbox_tuple[1],
-                    "maxLon": bbox_tuple[2], "maxLat": bbox_tuple[3]
-                },
-                "granules": [Path(p).name for p in files],
-                "mode": mode,
-                "timeout_s": TEMPO_TIMEOUT_S,
-                "fallback_used": fallback_used,
-                "seed_units": "molecules/cm^2",
-                "species_units": {
-                    "no2_forecast": "molecules/cm^2",
-                    "o3_forecast": "ppbv (proxy)",
-                    "hcho_forecast": "ppbv (proxy)",
-                    "ai": "index",
-                    "pm25_forecast": "µg/m³ (proxy)"
-                },
-                "nowcast_peak": {
-                    "datetime_utc": peak_time_iso,
-                    "no2_forecast": peak_val
-                },
-                "forecast_window_h": int(len(fc_multi)),
-                "sources": {
-                    "satellite": "NASA TEMPO",
-                    "weather": "OpenWeather",
-                    "ground": "AQICN"
-                }
-            },
-            "ground": ground,
-            "alerts": {"hourly_risk": hourly_risk, "next_critical_hour": nexth},
-            "validation": {
-                "ground_bucket": g_bucket,
-                "model_bucket": model_bucket,
-                "concordance": concordance
-            },
-        }
+            g = None
+        payload = _assemble_payload(
+            lat, lon, wx_hourly, no2_seed, g,
+            files=files, start_iso=start_iso, end_iso=end_iso, bbox_tuple=bbox_tuple,
+            prefer_used=prefer_used, mosaic_info=mosaic_info, fallback_used=fallback_used, mode=mode,
+        )
 
         if mode in ("auto", "cache") and not (start or end or bbox or skip_nasa or require_nasa):
             _CACHE[key] = (time.time(), payload)
+        if not fallback_used:
+            _remember_seed(lat, lon, no2_seed)
+        if HISTORY_ENABLED:
+            HISTORY.record(payload)
         return payload
     except HTTPException:
         raise
@@ -476,6 +684,36 @@ def forecast(
         print(f"[ERROR] /forecast lat={lat} lon={lon} -> {type(e).__name__}: {e}")
         raise HTTPException(status_code=503, detail="Upstream error (NASA/Weather).")
 
+@app.get("/stats/upstream")
+def upstream_stats():
+    return SCHEDULER.stats()
+
+@app.get("/stats/render")
+def render_stats():
+    return RENDER.stats()
+
+@app.get("/stats/mosaic")
+def mosaic_stats():
+    return MOSAICS.stats()
+
+@app.get("/stats/history")
+def history_stats():
+    return HISTORY.stats()
+
+@app.get("/stats/alerts")
+def alerts_stats():
+    return ALERTS.stats()
+
+@app.get("/stats/weather_cache")
+def weather_cache_stats():
+    return WX_CACHE.stats()
+
+@app.get("/ground/nearest")
+def ground_nearest(lat: float = Query(...), lon: float = Query(...), k: int = Query(1, ge=1, le=50)):
+    if not GROUND.is_fresh():
+        raise HTTPException(status_code=503, detail="AQICN snapshot indisponível")
+    return {"items": GROUND.k_nearest(lat, lon, k=k), "snapshot": GROUND.stats()}
+
 @app.get("/tempo/latest_overlay.png")
 def tempo_overlay(bbox: str = Query("-125,24,-66,50"), prefer_l3: bool = True, hours: int = 8):
     try:
@@ -501,9 +739,17 @@ def tempo_overlay(bbox: str = Query("-125,24,-66,50"), prefer_l3: bool = True, h
             files = []
         if files:
             try:
-                png = _render_no2_overlay_png(files[0], bb)
-            except Exception:
+                mos = MOSAICS.get(files, bb, COLL_L3_NRT_NO2 if p else COLL_L2_NRT_NO2)
+            except Exception as e:
+                print(f"[WARN] overlay mosaic -> {type(e).__name__}: {e}")
                 continue
+            # falha do pool de render não melhora com a outra coleção
+            try:
+                png = _render_grid_png(mos.lon, mos.lat, mos.values, bb)
+            except RenderTimeout:
+                raise HTTPException(status_code=503, detail="overlay render timed out")
+            except RenderError as e:
+                raise HTTPException(status_code=503, detail=f"overlay render failed: {e}")
             OVERLAY_CACHE[cache_key] = (time.time(), png)
             return Response(content=png, media_type="image/png")
     raise HTTPException(status_code=404, detail="no TEMPO granule for window/bbox")
@@ -564,13 +810,15 @@ US_STATES_CENTROIDS = [
 def _safe_forecast_point(lat: float, lon: float, skip_nasa: bool) -> dict[str, Any]:
     try:
         bbox = f"{lon-1.5},{lat-1.2},{lon+1.5},{lat+1.2}"
-        payload = forecast(
-            lat=lat, lon=lon,
-            start=None, end=None, bbox=bbox,
-            mode="fast",
-            require_nasa=False,
-            skip_nasa=skip_nasa
-        )
+        # mapa em lote: cede a vez (e a reserva de cota) para os /forecast interativos
+        with request_context(priority=BATCH, deadline_s=FORECAST_DEADLINE_S):
+            payload = _forecast(
+                lat=lat, lon=lon,
+                start=None, end=None, bbox=bbox,
+                mode="fast",
+                require_nasa=False,
+                skip_nasa=skip_nasa
+            )
         if isinstance(payload, dict):
             return payload
         return payload.dict()
@@ -584,24 +832,199 @@ def _safe_forecast_point(lat: float, lon: float, skip_nasa: bool) -> dict[str, A
             "updated_utc": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
         }
 
-@app.get("/states/summary")
-def states_summary(skip_nasa: bool = Query(True)):
-    from concurrent.futures import ThreadPoolExecutor, as_completed
-    results: list[dict[str, Any]] = []
-    with ThreadPoolExecutor(max_workers=8) as ex:
+def _summary_item(name: str, lat: float, lon: float, item: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "state": name,
+        "lat": lat,
+        "lon": lon,
+        "risk": item.get("risk", "unknown"),
+        "no2_seed": item.get("no2_seed"),
+        "updated_utc": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+    }
+
+def _summary_cached(skip_nasa: bool) -> Tuple[List[Dict[str, Any]], List[Tuple[str, float, float]]]:
+    """(itens ainda no TTL, estados que precisam ser recalculados)."""
+    now = time.time()
+    hits, todo = [], []
+    for name, lat, lon in US_STATES_CENTROIDS:
+        ts, item = SUMMARY_CACHE.get((name, skip_nasa), (0.0, None))
+        if item is not None and (now - ts) < CACHE_TTL_SECONDS:
+            hits.append(item)
+        else:
+            todo.append((name, lat, lon))
+    return hits, todo
+
+def _summary_iter(skip_nasa: bool):
+    """Itens do resumo na ordem em que ficam prontos: cache primeiro, depois cada estado ao terminar."""
+    from concurrent.futures import as_completed
+    hits, todo = _summary_cached(skip_nasa)
+    yield from hits
+    if not todo:
+        return
+    ex = ThreadPoolExecutor(max_workers=8)
+    try:
         futs = {
             ex.submit(_safe_forecast_point, lat, lon, skip_nasa): (name, lat, lon)
-            for name, lat, lon in US_STATES_CENTROIDS
+            for name, lat, lon in todo
         }
         for fut in as_completed(futs):
             name, lat, lon = futs[fut]
-            item = fut.result()
-            results.append({
-                "state": name,
-                "lat": lat,
-                "lon": lon,
-                "risk": item.get("risk", "unknown"),
-                "no2_seed": item.get("no2_seed"),
-                "updated_utc": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
-            })
-    return {"items": results}
+            item = _summary_item(name, lat, lon, fut.result())
+            # "unknown" é falha transitória: não segura no cache
+            if item["risk"] != "unknown":
+                SUMMARY_CACHE[(name, skip_nasa)] = (time.time(), item)
+            yield item
+    finally:
+        # cliente desconectou no meio do stream: não calcula o resto
+        ex.shutdown(wait=False, cancel_futures=True)
+
+@app.get("/states/summary")
+def states_summary(skip_nasa: bool = Query(True)):
+    return {"items": list(_summary_iter(skip_nasa))}
+
+@app.get("/states/summary/stream")
+def states_summary_stream(skip_nasa: bool = Query(True)):
+    """Mesmo conteúdo de /states/summary em NDJSON, um estado por linha assim que fica pronto."""
+    def lines():
+        for item in _summary_iter(skip_nasa):
+            yield json.dumps(item) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"})
+
+def _grid_or_503():
+    prod = GRID.current()
+    if prod is None:
+        raise HTTPException(status_code=503, detail="grid product not built yet")
+    return prod
+
+@app.get("/grid/point")
+def grid_point(lat: float = Query(...), lon: float = Query(...)):
+    out = _grid_or_503().point(lat, lon)
+    if out is None:
+        raise HTTPException(status_code=404, detail="point outside grid bbox")
+    return out
+
+@app.get("/grid/states")
+def grid_states():
+    prod = _grid_or_503()
+    return {"items": prod.states(US_STATES_CENTROIDS), "grid": prod.meta}
+
+_GRID_CMAPS: Dict[str, Any] = {"risk": ["#10b981", "#f59e0b", "#ef4444"]}
+
+@app.get("/grid/layer.png")
+def grid_layer(field: str = Query("no2"), hour: int = Query(0, ge=0)):
+    prod = _grid_or_503()
+    if field not in GRID_FIELDS and field != "seed":
+        raise HTTPException(status_code=400, detail=f"field must be one of {', '.join(GRID_FIELDS + ('seed',))}")
+    if hour >= prod.times.size:
+        raise HTTPException(status_code=400, detail=f"hour must be < {prod.times.size}")
+    key = (field, 0 if field == "seed" else hour)
+    png = prod.png.get(key)
+    if png is None:
+        if field == "risk":
+            vmin, vmax = 0.0, 2.0
+        else:
+            # escala fixa no build inteiro: as horas ficam comparáveis entre si
+            vmin, vmax = (float(v) for v in np.nanpercentile(prod.seed if field == "seed" else prod.fields[field], [2, 98]))
+        try:
+            png = _render_grid_png(prod.lon, prod.lat, prod.layer(field, hour), prod.bbox,
+                                   cmap=_GRID_CMAPS.get(field, "plasma"), vmin=vmin, vmax=vmax)
+        except RenderTimeout:
+            raise HTTPException(status_code=503, detail="layer render timed out")
+        except RenderError as e:
+            raise HTTPException(status_code=503, detail=f"layer render failed: {e}")
+        prod.png[key] = png
+    return Response(content=png, media_type="image/png")
+
+def _parse_time_range(start: Optional[str], end: Optional[str]) -> tuple[Optional[datetime], Optional[datetime]]:
+    try:
+        s = pd.Timestamp(start).to_pydatetime() if start else None
+        e = pd.Timestamp(end).to_pydatetime() if end else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid start/end")
+    return (s if s is None or s.tzinfo else s.replace(tzinfo=timezone.utc),
+            e if e is None or e.tzinfo else e.replace(tzinfo=timezone.utc))
+
+def _parse_bbox_param(bbox: Optional[str]) -> Optional[Tuple[float, float, float, float]]:
+    if not bbox:
+        return None
+    try:
+        return _parse_bbox(bbox)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid bbox")
+
+@app.get("/history/forecasts")
+def history_forecasts(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    bbox: Optional[str] = None,
+    hourly: bool = False,
+    limit: int = Query(1000, ge=1, le=50000),
+):
+    s, e = _parse_time_range(start, end)
+    df = HISTORY.query("forecast_hours" if hourly else "forecasts", s, e, _parse_bbox_param(bbox))
+    df = df.sort_values("ts_utc").tail(limit)
+    for c in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[c]):
+            df[c] = df[c].dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+    return {"count": int(len(df)), "items": json.loads(df.to_json(orient="records"))}
+
+@app.get("/history/skill")
+def history_skill(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    bbox: Optional[str] = None,
+    group_by: str = Query("none", pattern="^(none|day|cell)$"),
+    cell_deg: float = Query(1.0, gt=0),
+):
+    s, e = _parse_time_range(start, end)
+    return HISTORY.skill(s, e, _parse_bbox_param(bbox), group_by=group_by, cell_deg=cell_deg)
+
+@app.websocket("/ws/alerts")
+async def ws_alerts(ws: WebSocket):
+    await ws.accept()
+    sub = Subscriber(asyncio.get_running_loop())
+
+    async def pump():
+        while True:
+            await ws.send_json(await sub.queue.get())
+            # perdeu deltas com a fila cheia: fila vazia de novo, manda o estado inteiro
+            if sub.dirty and sub.queue.empty():
+                for snap in ALERTS.resync(sub):
+                    sub.queue.put_nowait(snap)
+
+    sender = asyncio.create_task(pump())
+    try:
+        while True:
+            msg = await ws.receive_json()
+            op = msg.get("op") if isinstance(msg, dict) else None
+            if op == "subscribe":
+                locations = msg.get("locations")
+                if not isinstance(locations, list):
+                    sub.push({"type": "error", "id": None, "detail": "locations must be a list"})
+                    continue
+                for raw in locations:
+                    try:
+                        loc = AlertLocation.model_validate(raw)
+                    except ValidationError as e:
+                        rid = raw.get("id") if isinstance(raw, dict) else None
+                        detail = "; ".join(f"{'.'.join(map(str, err['loc'])) or 'location'}: {err['msg']}" for err in e.errors())
+                        sub.push({"type": "error", "id": None if rid is None else str(rid), "detail": f"invalid location ({detail})"})
+                        continue
+                    cid = str(loc.id if loc.id is not None else f"{loc.lat},{loc.lon}")
+                    try:
+                        snap = await run_in_threadpool(ALERTS.subscribe, sub, cid, loc.lat, loc.lon)
+                    except Exception as e:
+                        ALERTS.unsubscribe(sub, [cid])
+                        sub.push({"type": "error", "id": cid, "detail": str(e) or type(e).__name__})
+                        continue
+                    sub.push(snap)
+            elif op == "unsubscribe":
+                ALERTS.unsubscribe(sub, [str(i) for i in msg.get("ids") or []])
+            else:
+                sub.push({"type": "error", "id": None, "detail": "op must be subscribe or unsubscribe"})
+    except (WebSocketDisconnect, RuntimeError, ValueError):
+        pass
+    finally:
+        ALERTS.drop(sub)
+        sender.cancel()
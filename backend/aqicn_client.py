@@ -1,17 +1,19 @@
 from __future__ import annotations
 import os, requests, datetime as dt
+from upstream import SCHEDULER
 
 AQICN_TOKEN = os.getenv("AQICN_TOKEN", "")
+AQICN_TIMEOUT_S = float(os.getenv("AQICN_TIMEOUT_S", "8"))
+AQICN_BASE_URL = os.getenv("AQICN_BASE_URL", "https://api.waqi.info").rstrip("/")
 
 class AQICNError(Exception): pass
 
-def fetch_nearest(lat: float, lon: float) -> dict:
-    if not AQICN_TOKEN:
-        raise AQICNError("AQICN_TOKEN ausente no ambiente")
-    url = f"https://api.waqi.info/feed/geo:{lat:.4f};{lon:.4f}/?token={AQICN_TOKEN}"
-    r = requests.get(url, timeout=8)
+def _get_json(url: str, timeout: float) -> dict:
+    r = requests.get(url, timeout=timeout)
     r.raise_for_status()
-    js = r.json()
+    return r.json()
+
+def _feed_sample(js: dict) -> dict:
     if js.get("status") != "ok" or not js.get("data"):
         raise AQICNError(f"Resposta inválida: {js}")
     d = js["data"]
@@ -31,3 +33,42 @@ def fetch_nearest(lat: float, lon: float) -> dict:
         "attribution": "Powered by AQICN.org",
         "fetched_utc": dt.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
     }
+
+def fetch_nearest(lat: float, lon: float) -> dict:
+    if not AQICN_TOKEN:
+        raise AQICNError("AQICN_TOKEN ausente no ambiente")
+    url = f"{AQICN_BASE_URL}/feed/geo:{lat:.4f};{lon:.4f}/?token={AQICN_TOKEN}"
+    js = SCHEDULER.fetch("aqicn", lambda timeout: _get_json(url, timeout), AQICN_TIMEOUT_S)
+    return _feed_sample(js)
+
+def fetch_station(uid) -> dict:
+    """Feed completo de uma estação (/feed/@uid), com os poluentes individuais (iaqi)."""
+    if not AQICN_TOKEN:
+        raise AQICNError("AQICN_TOKEN ausente no ambiente")
+    url = f"{AQICN_BASE_URL}/feed/@{uid}/?token={AQICN_TOKEN}"
+    js = SCHEDULER.fetch("aqicn", lambda timeout: _get_json(url, timeout), AQICN_TIMEOUT_S)
+    return _feed_sample(js)
+
+def parse_bounds_station(st: dict) -> dict:
+    try:
+        aqi = int(st.get("aqi"))
+    except (TypeError, ValueError):
+        aqi = None
+    return {
+        "uid": st.get("uid"),
+        "lat": float(st["lat"]),
+        "lon": float(st["lon"]),
+        "aqi": aqi,
+        "station": (st.get("station") or {}).get("name"),
+        "time_local": (st.get("station") or {}).get("time"),
+    }
+
+def fetch_bounds(lat0: float, lon0: float, lat1: float, lon1: float) -> list[dict]:
+    """Todas as estações dentro do retângulo, via /map/bounds (só o AQI agregado de cada uma)."""
+    if not AQICN_TOKEN:
+        raise AQICNError("AQICN_TOKEN ausente no ambiente")
+    url = f"{AQICN_BASE_URL}/map/bounds/?latlng={lat0:.4f},{lon0:.4f},{lat1:.4f},{lon1:.4f}&token={AQICN_TOKEN}"
+    js = SCHEDULER.fetch("aqicn", lambda timeout: _get_json(url, timeout), AQICN_TIMEOUT_S)
+    if js.get("status") != "ok" or not isinstance(js.get("data"), list):
+        raise AQICNError(f"Resposta inválida: {js}")
+    return [parse_bounds_station(st) for st in js["data"]]
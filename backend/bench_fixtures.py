@@ -0,0 +1,145 @@
+from __future__ import annotations
+import json
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+WEATHER_CSV = Path(__file__).parent / "weather_hourly_denver.csv"
+
+DENVER = (39.7392, -104.9903)
+
+# dimensões de um granule TEMPO L2 NO2 (mirror_step x xtrack)
+L2_SHAPE = (131, 2048)
+
+def load_owm_forecast(name: str = "owm_forecast_denver.json") -> Dict[str, Any]:
+    with open(FIXTURES_DIR / name, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def load_aqicn_feed(name: str = "aqicn_feed_denver.json") -> Dict[str, Any]:
+    with open(FIXTURES_DIR / name, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def load_aqicn_bounds(name: str = "aqicn_bounds_conus.json") -> Dict[str, Any]:
+    with open(FIXTURES_DIR / name, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def load_weather_csv(path: Path = WEATHER_CSV) -> pd.DataFrame:
+    df = pd.read_csv(path)
+    df["datetime_utc"] = pd.to_datetime(df["datetime_utc"], utc=True)
+    return df
+
+def aqicn_feed_to_sample(js: Dict[str, Any]) -> Dict[str, Any]:
+    """Mesmo formato devolvido por aqicn_client.fetch_nearest, a partir do JSON gravado."""
+    d = js["data"]
+    iaqi = d.get("iaqi", {}) or {}
+    def g(key):
+        v = iaqi.get(key)
+        return None if v is None else v.get("v")
+    return {
+        "aqi": d.get("aqi"),
+        "no2": g("no2"),
+        "o3": g("o3"),
+        "pm25": g("pm25"),
+        "pm10": g("pm10"),
+        "time_local": d.get("time", {}).get("s"),
+        "station": d.get("city", {}).get("name"),
+        "station_geo": d.get("city", {}).get("geo"),
+        "attribution": "Powered by AQICN.org",
+        "fetched_utc": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+    }
+
+def write_synthetic_tempo_granule(
+    path: Path,
+    bbox: Tuple[float, float, float, float],
+    shape: Tuple[int, int] = L2_SHAPE,
+    seed: int = 0,
+    start: Optional[datetime] = None,
+    missing_frac: float = 0.15,
+) -> Path:
+    """
+    Escreve um NetCDF com o layout do TEMPO NO2 L2: grupo 'product' com
+    vertical_column_troposphere (mirror_step, xtrack) e grupo 'geolocation'
+    com latitude/longitude 2D. Valores na faixa típica (~1e15–2e16 molec/cm²),
+    com uma fração de pixels NaN simulando nuvem/qualidade.
+    """
+    rng = np.random.default_rng(seed)
+    ny, nx = shape
+    lon0, lat0, lon1, lat1 = bbox
+    # varredura levemente inclinada, como um swath real
+    yy, xx = np.meshgrid(np.linspace(0.0, 1.0, ny), np.linspace(0.0, 1.0, nx), indexing="ij")
+    lat = (lat0 + (lat1 - lat0) * yy + 0.05 * (lat1 - lat0) * xx).astype(np.float32)
+    lon = (lon0 + (lon1 - lon0) * xx - 0.03 * (lon1 - lon0) * yy).astype(np.float32)
+    plume = np.exp(-(((yy - 0.5) / 0.2) ** 2 + ((xx - 0.5) / 0.1) ** 2))
+    no2 = (3.0e15 + 1.2e16 * plume) * rng.lognormal(0.0, 0.25, size=shape)
+    no2[rng.random(shape) < missing_frac] = np.nan
+    t0 = start or datetime.now(timezone.utc)
+    t0 = t0.replace(tzinfo=None)
+    times = np.array([t0 + timedelta(seconds=float(i) * 2.8) for i in range(ny)], dtype="datetime64[ns]")
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        path.unlink()
+    xr.Dataset(attrs={"title": "synthetic TEMPO NO2 L2", "time_coverage_start": t0.isoformat() + "Z"}).to_netcdf(
+        path, mode="w", engine="netcdf4"
+    )
+    product = xr.Dataset({
+        "vertical_column_troposphere": (("mirror_step", "xtrack"), no2.astype(np.float64),
+                                        {"units": "molecules/cm^2"}),
+    })
+    product.to_netcdf(path, mode="a", group="product", engine="netcdf4")
+    geo = xr.Dataset({
+        "latitude": (("mirror_step", "xtrack"), lat),
+        "longitude": (("mirror_step", "xtrack"), lon),
+        "time": (("mirror_step",), times),
+    })
+    geo.to_netcdf(path, mode="a", group="geolocation", engine="netcdf4")
+    return path
+
+def write_synthetic_granules(
+    out_dir: Path,
+    bbox: Tuple[float, float, float, float],
+    n: int = 3,
+    shape: Tuple[int, int] = L2_SHAPE,
+) -> List[str]:
+    """Gera n granules consecutivos (~1h de intervalo) para a mesma bbox."""
+    now = datetime.now(timezone.utc)
+    files = []
+    for i in range(n):
+        t = now - timedelta(hours=n - i)
+        p = Path(out_dir) / f"TEMPO_NO2_L2_SYNTH_{t:%Y%m%dT%H%M%S}Z_G{i:02d}.nc"
+        files.append(str(write_synthetic_tempo_granule(p, bbox, shape=shape, seed=i, start=t)))
+    return files
+
+@contextmanager
+def offline_upstreams(granules: List[str]) -> Iterator[None]:
+    """
+    Troca as chamadas externas de app.py por respostas gravadas
+    (OpenWeather/AQICN) e granules locais (TEMPO), restaurando no final.
+    """
+    import app as app_mod
+
+    owm = load_owm_forecast()
+    ground = aqicn_feed_to_sample(load_aqicn_feed())
+    patches = {
+        "fetch_forecast": lambda lat, lon, units="metric": owm,
+        "aqicn_fetch": lambda lat, lon: dict(ground),
+        "fetch_tempo_no2_by_time_bbox": lambda out_dir, s, e, bbox, prefer_l3=True, auth=None: list(granules),
+    }
+    saved = {k: getattr(app_mod, k) for k in patches}
+    saved_station = app_mod.GROUND.fetch_station
+    try:
+        for k, v in patches.items():
+            setattr(app_mod, k, v)
+        app_mod.GROUND.fetch_station = lambda uid: dict(ground)
+        yield
+    finally:
+        for k, v in saved.items():
+            setattr(app_mod, k, v)
+        app_mod.GROUND.fetch_station = saved_station
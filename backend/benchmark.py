@@ -0,0 +1,189 @@
+"""
+Benchmarks offline do pipeline (sem rede): OpenWeather/AQICN gravados em
+fixtures/, o CSV de Denver e granules TEMPO sintéticos.
+
+    python benchmark.py                      # roda tudo, grava bench_results/<commit>.json
+    python benchmark.py --only forecast      # filtra por substring do nome
+    python benchmark.py --compare bench_results/abc1234.json
+"""
+from __future__ import annotations
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import bench_fixtures as fx
+
+RESULTS_DIR = Path(__file__).parent / "bench_results"
+
+def _git_rev() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=Path(__file__).parent, timeout=5)
+        return out.stdout.strip() or "unknown"
+    except Exception:
+        return "unknown"
+
+def percentile(xs: List[float], q: float) -> float:
+    """Percentil com interpolação linear (q em [0, 1]); nan para lista vazia. Usado também pelo loadtest."""
+    s = sorted(xs)
+    if not s:
+        return float("nan")
+    k = (len(s) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+def timeit(fn: Callable[[], Any], repeat: int, warmup: int = 1) -> Dict[str, Any]:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return {
+        "repeat": repeat,
+        "min_s": min(samples),
+        "median_s": statistics.median(samples),
+        "mean_s": statistics.fmean(samples),
+        "p95_s": percentile(samples, 0.95),
+        "stdev_s": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+def build_cases(work: Path, granule_shape: tuple[int, int], n_granules: int) -> Dict[str, Callable[[], Any]]:
+    import app as app_mod
+    from weather_openweather import forecast_to_df, forecast_to_hourly, stack_hourly, to_hourly
+    from forecast import forecast_no2_24h
+    from nasa_tempo import compute_no2_seed
+    from aqicn_client import parse_bounds_station
+    from mosaic import MosaicCache, build_mosaic
+    from history import HistoryStore
+    from grid_product import build_grid_product
+    from fastapi.testclient import TestClient
+
+    lat, lon = fx.DENVER
+    bb = app_mod._bbox_default(lat, lon)
+    # caches em disco da execução ficam no diretório temporário, não em ./tempo_data
+    app_mod.MOSAICS = MosaicCache(work / "mosaics")
+    app_mod.HISTORY = HistoryStore(work / "history")
+    granules = fx.write_synthetic_granules(work, bb, n=n_granules, shape=granule_shape)
+
+    owm = fx.load_owm_forecast()
+    df3 = forecast_to_df(owm)
+    wx = fx.load_weather_csv()
+    seed = 3.0e15
+    fc = forecast_no2_24h(wx, seed)
+    fc_adj = app_mod.adjust_no2_with_meteo(fc, wx)
+
+    stations = [parse_bounds_station(st) for st in fx.load_aqicn_bounds()["data"]]
+    app_mod.GROUND.load_stations(stations)
+
+    mos = build_mosaic(granules, bb)
+
+    client = TestClient(app_mod.app)
+
+    def forecast_e2e(cached: bool):
+        def run():
+            if not cached:
+                app_mod._CACHE.clear()
+                app_mod.WX_CACHE.clear()
+                app_mod.MOSAICS.clear(disk=True)
+            with fx.offline_upstreams(granules):
+                r = client.get("/forecast", params={"lat": lat, "lon": lon})
+            if r.status_code != 200:
+                raise RuntimeError(f"/forecast -> {r.status_code}: {r.text[:200]}")
+        return run
+
+    return {
+        "weather.forecast_to_df": lambda: forecast_to_df(owm),
+        "weather.to_hourly": lambda: to_hourly(df3),
+        "weather.forecast_to_df+to_hourly": lambda: to_hourly(forecast_to_df(owm)),
+        "weather.forecast_to_hourly": lambda: forecast_to_hourly(owm),
+        "weather.stack_hourly[100 locs]": lambda: stack_hourly([owm] * 100),
+        "forecast.forecast_no2_24h": lambda: forecast_no2_24h(wx, seed),
+        "app.adjust_no2_with_meteo": lambda: app_mod.adjust_no2_with_meteo(fc, wx),
+        "app.build_multi_species_forecast": lambda: app_mod.build_multi_species_forecast(fc_adj, wx),
+        "app.build_ensemble[100]": lambda: app_mod.build_ensemble(fc, wx, seed, members=100),
+        "tempo.compute_no2_seed": lambda: compute_no2_seed(granules[0]),
+        "weather_cache.get[hit]": lambda: app_mod.WX_CACHE.get(lat, lon, lambda a, b: wx),
+        "ground.load_stations": lambda: app_mod.GROUND.load_stations(stations),
+        "ground.nearest": lambda: app_mod.GROUND.nearest(lat, lon, pollutants=False),
+        "ground.k_nearest[k=10]": lambda: app_mod.GROUND.k_nearest(lat, lon, k=10),
+        "mosaic.build[latest]": lambda: build_mosaic(granules, bb, method="latest"),
+        "mosaic.build[mean]": lambda: build_mosaic(granules, bb, method="mean"),
+        "grid.build[conus 0.25]": lambda: build_grid_product(work / "grid.npz", lambda a, b: wx, granules, seed),
+        "app._render_grid_png[mosaic]": lambda: app_mod._render_grid_png(mos.lon, mos.lat, mos.values, bb),
+        "e2e./forecast[miss]": forecast_e2e(cached=False),
+        "e2e./forecast[hit]": forecast_e2e(cached=True),
+    }
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> int:
+    """Imprime a razão median(atual)/median(base) e devolve o nº de regressões."""
+    regressions = 0
+    base = baseline.get("results", {})
+    print(f"\n{'case':40s} {'base ms':>10s} {'now ms':>10s} {'ratio':>7s}")
+    for name, res in current["results"].items():
+        if name not in base:
+            print(f"{name:40s} {'-':>10s} {res['median_s'] * 1e3:10.2f} {'new':>7s}")
+            continue
+        b = base[name]["median_s"]
+        ratio = res["median_s"] / b if b > 0 else float("inf")
+        flag = ""
+        if ratio > 1.0 + threshold:
+            regressions += 1
+            flag = "  REGRESSION"
+        print(f"{name:40s} {b * 1e3:10.2f} {res['median_s'] * 1e3:10.2f} {ratio:7.2f}{flag}")
+    return regressions
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmarks offline do pipeline TEMPO + Weather")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--only", default="", help="roda só casos cujo nome contém este texto")
+    ap.add_argument("--granule-shape", default=f"{fx.L2_SHAPE[0]}x{fx.L2_SHAPE[1]}", help="mirror_step x xtrack")
+    ap.add_argument("--granules", type=int, default=3)
+    ap.add_argument("--out", default=None, help="arquivo JSON de saída (padrão bench_results/<commit>.json)")
+    ap.add_argument("--compare", default=None, help="JSON de uma execução anterior para comparar")
+    ap.add_argument("--threshold", type=float, default=0.10, help="piora relativa tolerada no --compare")
+    args = ap.parse_args(argv)
+
+    ny, nx = (int(x) for x in args.granule_shape.lower().split("x"))
+    rev = _git_rev()
+    with tempfile.TemporaryDirectory(prefix="tempo_bench_") as tmp:
+        cases = build_cases(Path(tmp), (ny, nx), args.granules)
+        results: Dict[str, Any] = {}
+        for name, fn in cases.items():
+            if args.only and args.only not in name:
+                continue
+            repeat = max(3, args.repeat // 4) if (name.startswith("e2e") or "render" in name) else args.repeat
+            res = timeit(fn, repeat=repeat)
+            results[name] = res
+            print(f"{name:40s} median {res['median_s'] * 1e3:9.2f} ms  p95 {res['p95_s'] * 1e3:9.2f} ms  (n={repeat})")
+
+    report = {
+        "commit": rev,
+        "created_utc": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "params": {"granule_shape": [ny, nx], "granules": args.granules, "repeat": args.repeat},
+        "results": results,
+    }
+    out = Path(args.out) if args.out else RESULTS_DIR / f"{rev}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"\nresultados: {out}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
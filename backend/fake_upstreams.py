@@ -0,0 +1,299 @@
+"""
+Servidores locais que imitam OpenWeather, AQICN e Harmony para testes de carga
+sem gastar cota nem bater na NASA. Um único processo atende os três, cada um
+sob seu prefixo:
+
+    python fake_upstreams.py --port 8900 --latency-ms owm=120,aqicn=80,harmony=600 --error-rate owm=0.02
+
+e a API é apontada para ele via ambiente:
+
+    OPENWEATHER_BASE_URL=http://127.0.0.1:8900/owm
+    AQICN_BASE_URL=http://127.0.0.1:8900/aqicn
+    HARMONY_BASE_URL=http://127.0.0.1:8900/harmony
+"""
+from __future__ import annotations
+import argparse
+import copy
+import hashlib
+import json
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import bench_fixtures as fx
+
+PROVIDERS = ("owm", "aqicn", "harmony")
+
+@dataclass
+class ProviderProfile:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 500
+
+@dataclass
+class FakeConfig:
+    profiles: Dict[str, ProviderProfile] = field(default_factory=lambda: {p: ProviderProfile() for p in PROVIDERS})
+    owm_payload: Optional[Path] = None
+    aqicn_payload: Optional[Path] = None
+    aqicn_bounds_payload: Optional[Path] = None
+    harmony_job_s: float = 0.0
+    granules_per_job: int = 1
+    granule_shape: Tuple[int, int] = fx.L2_SHAPE
+
+class FakeState:
+    def __init__(self, cfg: FakeConfig, work_dir: Path):
+        self.cfg = cfg
+        self.work_dir = work_dir
+        self.owm = _load_json(cfg.owm_payload) if cfg.owm_payload else fx.load_owm_forecast()
+        self.aqicn = _load_json(cfg.aqicn_payload) if cfg.aqicn_payload else fx.load_aqicn_feed()
+        self.aqicn_bounds = _load_json(cfg.aqicn_bounds_payload) if cfg.aqicn_bounds_payload else fx.load_aqicn_bounds()
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        self.counts: Dict[str, int] = {p: 0 for p in PROVIDERS}
+
+    def owm_forecast(self, lat: float, lon: float) -> Dict[str, Any]:
+        # desloca os horários gravados para começarem "agora", mantendo o passo de 3h
+        js = copy.deepcopy(self.owm)
+        items = js.get("list", [])
+        if items:
+            now = int(time.time()) // 10800 * 10800
+            shift = now - int(items[0]["dt"])
+            for it in items:
+                it["dt"] = int(it["dt"]) + shift
+                it["dt_txt"] = datetime.fromtimestamp(it["dt"], timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        js.setdefault("city", {})["coord"] = {"lat": lat, "lon": lon}
+        return js
+
+    def aqicn_feed(self, lat: float, lon: float) -> Dict[str, Any]:
+        js = copy.deepcopy(self.aqicn)
+        d = js.get("data", {})
+        d.setdefault("city", {})["geo"] = [lat + 0.01, lon - 0.01]
+        return js
+
+    def aqicn_station(self, uid: str) -> Dict[str, Any]:
+        js = copy.deepcopy(self.aqicn)
+        st = next((st for st in self.aqicn_bounds.get("data", []) if str(st.get("uid")) == uid), None)
+        if st is None:
+            return {"status": "error", "data": "Unknown station"}
+        d = js.get("data", {})
+        d["idx"] = st["uid"]
+        d.setdefault("city", {}).update(name=(st.get("station") or {}).get("name"), geo=[float(st["lat"]), float(st["lon"])])
+        return js
+
+    def aqicn_map_bounds(self, lat0: float, lon0: float, lat1: float, lon1: float) -> Dict[str, Any]:
+        la0, la1 = sorted((lat0, lat1))
+        lo0, lo1 = sorted((lon0, lon1))
+        data = [st for st in self.aqicn_bounds.get("data", [])
+                if la0 <= float(st["lat"]) <= la1 and lo0 <= float(st["lon"]) <= lo1]
+        return {"status": "ok", "data": data}
+
+    def harmony_submit(self, coll_id: str, bbox: Tuple[float, float, float, float], base: str) -> Dict[str, Any]:
+        job_id = uuid.uuid4().hex
+        key = hashlib.sha1(f"{coll_id}|{bbox}".encode()).hexdigest()[:12]
+        names = []
+        for i in range(self.cfg.granules_per_job):
+            name = f"TEMPO_NO2_FAKE_{key}_G{i:02d}.nc"
+            path = self.work_dir / name
+            with self.lock:
+                if not path.exists():
+                    fx.write_synthetic_tempo_granule(path, bbox, shape=self.cfg.granule_shape, seed=i)
+            names.append(name)
+        job = {
+            "jobID": job_id,
+            "status": "running" if self.cfg.harmony_job_s > 0 else "successful",
+            "progress": 0,
+            "created": time.time(),
+            "links": [{"href": f"{base}/files/{n}", "rel": "data", "type": "application/x-netcdf4"} for n in names],
+        }
+        with self.lock:
+            self.jobs[job_id] = job
+        return self._job_view(job)
+
+    def harmony_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        if job["status"] == "running" and time.time() - job["created"] >= self.cfg.harmony_job_s:
+            job["status"] = "successful"
+            job["progress"] = 100
+        return self._job_view(job)
+
+    @staticmethod
+    def _job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+        view = {k: v for k, v in job.items() if k != "created"}
+        if job["status"] != "successful":
+            view["links"] = []
+        return view
+
+def _load_json(path: Path) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+_BBOX_RE = {
+    "lon": re.compile(r"lon\(([-\d.]+):([-\d.]+)\)"),
+    "lat": re.compile(r"lat\(([-\d.]+):([-\d.]+)\)"),
+}
+
+def _subset_bbox(subsets) -> Tuple[float, float, float, float]:
+    lon0, lat0, lon1, lat1 = -125.0, 24.0, -66.0, 50.0
+    for s in subsets:
+        m = _BBOX_RE["lon"].match(s)
+        if m:
+            lon0, lon1 = float(m.group(1)), float(m.group(2))
+        m = _BBOX_RE["lat"].match(s)
+        if m:
+            lat0, lat1 = float(m.group(1)), float(m.group(2))
+    return (lon0, lat0, lon1, lat1)
+
+def make_handler(state: FakeState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _send(self, status: int, body: bytes, ctype: str = "application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _json(self, status: int, obj: Any):
+            self._send(status, json.dumps(obj).encode())
+
+        def _simulate(self, provider: str) -> bool:
+            prof = state.cfg.profiles[provider]
+            with state.lock:
+                state.counts[provider] += 1
+            delay = max(0.0, random.gauss(prof.latency_ms, prof.jitter_ms)) if prof.jitter_ms else prof.latency_ms
+            if delay:
+                time.sleep(delay / 1000.0)
+            if prof.error_rate and random.random() < prof.error_rate:
+                self._json(prof.error_status, {"error": "injected failure", "provider": provider})
+                return False
+            return True
+
+        def do_GET(self):
+            u = urlparse(self.path)
+            q = parse_qs(u.query)
+            parts = u.path.strip("/").split("/", 1)
+            provider, rest = parts[0], (parts[1] if len(parts) > 1 else "")
+            if provider == "_stats":
+                with state.lock:
+                    return self._json(200, {"requests": dict(state.counts), "jobs": len(state.jobs)})
+            if provider not in PROVIDERS:
+                return self._json(404, {"error": "unknown provider"})
+            # downloads não contam latência de API, só o envio do arquivo
+            if provider == "harmony" and rest.startswith("files/"):
+                path = state.work_dir / Path(rest).name
+                if not path.exists():
+                    return self._json(404, {"error": "not found"})
+                return self._send(200, path.read_bytes(), "application/x-netcdf4")
+            if not self._simulate(provider):
+                return
+            if provider == "owm" and rest == "data/2.5/forecast":
+                lat = float(q.get("lat", ["0"])[0])
+                lon = float(q.get("lon", ["0"])[0])
+                return self._json(200, state.owm_forecast(lat, lon))
+            if provider == "aqicn" and rest.startswith("feed/geo:"):
+                m = re.match(r"feed/geo:([-\d.]+);([-\d.]+)", rest)
+                if not m:
+                    return self._json(200, {"status": "error", "data": "Invalid geo"})
+                return self._json(200, state.aqicn_feed(float(m.group(1)), float(m.group(2))))
+            if provider == "aqicn" and rest.startswith("feed/@"):
+                return self._json(200, state.aqicn_station(rest[len("feed/@"):].rstrip("/")))
+            if provider == "aqicn" and rest.rstrip("/") == "map/bounds":
+                try:
+                    lat0, lon0, lat1, lon1 = (float(x) for x in q.get("latlng", [""])[0].split(","))
+                except ValueError:
+                    return self._json(200, {"status": "error", "data": "Invalid latlng"})
+                return self._json(200, state.aqicn_map_bounds(lat0, lon0, lat1, lon1))
+            if provider == "harmony" and rest.endswith("coverage/rangeset"):
+                coll_id = rest.split("/", 1)[0]
+                base = f"http://{self.headers.get('Host')}/harmony"
+                return self._json(200, state.harmony_submit(coll_id, _subset_bbox(q.get("subset", [])), base))
+            if provider == "harmony" and rest.startswith("jobs/"):
+                job = state.harmony_job(rest.split("/", 1)[1])
+                return self._json(200, job) if job else self._json(404, {"error": "job not found"})
+            return self._json(404, {"error": "not found"})
+
+    return Handler
+
+def _parse_kv(s: str, cast=float) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for part in filter(None, (p.strip() for p in s.split(","))):
+        k, v = part.split("=", 1)
+        if k not in PROVIDERS:
+            raise SystemExit(f"provedor desconhecido: {k} (use {', '.join(PROVIDERS)})")
+        out[k] = cast(v)
+    return out
+
+def serve(cfg: FakeConfig, host: str = "127.0.0.1", port: int = 8900, work_dir: Optional[Path] = None) -> ThreadingHTTPServer:
+    """Sobe o servidor em thread daemon e devolve-o (use .shutdown() para parar)."""
+    work = Path(work_dir or tempfile.mkdtemp(prefix="fake_harmony_"))
+    work.mkdir(parents=True, exist_ok=True)
+    srv = ThreadingHTTPServer((host, port), make_handler(FakeState(cfg, work)))
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="Fakes locais de OpenWeather, AQICN e Harmony")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8900)
+    ap.add_argument("--latency-ms", default="", help="ex.: owm=120,aqicn=80,harmony=600")
+    ap.add_argument("--jitter-ms", default="", help="desvio padrão da latência, mesmo formato")
+    ap.add_argument("--error-rate", default="", help="fração de respostas com erro, ex.: owm=0.02")
+    ap.add_argument("--error-status", default="", help="status HTTP do erro injetado, ex.: aqicn=429")
+    ap.add_argument("--owm-payload", type=Path, default=None, help="JSON de /data/2.5/forecast a servir")
+    ap.add_argument("--aqicn-payload", type=Path, default=None, help="JSON de /feed/geo: a servir")
+    ap.add_argument("--aqicn-bounds-payload", type=Path, default=None, help="JSON de /map/bounds a servir")
+    ap.add_argument("--harmony-job-s", type=float, default=0.0, help="tempo até o job ficar 'successful'")
+    ap.add_argument("--granules-per-job", type=int, default=1)
+    ap.add_argument("--granule-shape", default=f"{fx.L2_SHAPE[0]}x{fx.L2_SHAPE[1]}")
+    ap.add_argument("--work-dir", type=Path, default=None, help="onde guardar os granules sintéticos")
+    args = ap.parse_args(argv)
+
+    cfg = FakeConfig(
+        owm_payload=args.owm_payload,
+        aqicn_payload=args.aqicn_payload,
+        aqicn_bounds_payload=args.aqicn_bounds_payload,
+        harmony_job_s=args.harmony_job_s,
+        granules_per_job=args.granules_per_job,
+        granule_shape=tuple(int(x) for x in args.granule_shape.lower().split("x")),
+    )
+    for k, v in _parse_kv(args.latency_ms).items():
+        cfg.profiles[k].latency_ms = v
+    for k, v in _parse_kv(args.jitter_ms).items():
+        cfg.profiles[k].jitter_ms = v
+    for k, v in _parse_kv(args.error_rate).items():
+        cfg.profiles[k].error_rate = v
+    for k, v in _parse_kv(args.error_status, int).items():
+        cfg.profiles[k].error_status = v
+
+    srv = serve(cfg, args.host, args.port, args.work_dir)
+    base = f"http://{args.host}:{args.port}"
+    print(f"OPENWEATHER_BASE_URL={base}/owm")
+    print(f"AQICN_BASE_URL={base}/aqicn")
+    print(f"HARMONY_BASE_URL={base}/harmony")
+    print(f"(contadores em {base}/_stats)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,6 @@
+from typing import Tuple
+
+import numpy as np
 import pandas as pd
 from sklearn.linear_model import LinearRegression
 
@@ -25,3 +28,78 @@ def forecast_no2_24h(weather_hourly: pd.DataFrame, no2_seed: float) -> pd.DataFr
     # suavização leve
     wx["no2_forecast"] = pd.Series(pred).rolling(3, min_periods=1).mean()
     return wx[["datetime_utc","no2_forecast"]]
+
+# razão previsão/seed a partir da qual a hora é "high" / "moderate"
+RISK_HIGH_RATIO = 1.2
+RISK_MODERATE_RATIO = 1.0
+RISK_LABELS = ("low", "moderate", "high")
+
+def meteo_factor_np(wind_speed, clouds, rain_1h) -> np.ndarray:
+    """
+    Fator meteorológico do NO2 (vento dispersa, nuvem/sol, chuva lava) sobre
+    arrays de qualquer shape. NaN = variável ausente, não ajusta.
+    """
+    ws = np.asarray(wind_speed, dtype=float)
+    cl = np.asarray(clouds, dtype=float)
+    r = np.asarray(rain_1h, dtype=float)
+    f = np.where(ws >= 12, 0.80, np.where(ws >= 8, 0.90, np.where(ws <= 2, 1.05, 1.0)))
+    f = f * np.where(cl >= 80, 0.95, np.where(cl <= 20, 1.05, 1.0))
+    f = f * np.where(r > 0, 0.85, 1.0)
+    return np.clip(f, 0.6, 1.4)
+
+def multi_species_np(no2, temp, clouds, wind_speed) -> dict:
+    """Proxies O3/HCHO/AI/PM2.5 a partir do NO2 e do clima (arrays já sem NaN)."""
+    no2 = np.asarray(no2, dtype=float)
+    temp = np.asarray(temp, dtype=float)
+    clouds = np.asarray(clouds, dtype=float)
+    wind_speed = np.asarray(wind_speed, dtype=float)
+    tnorm = np.clip((temp + 5.0) / 30.0, 0.3, 1.6)
+    clr = np.clip((100.0 - clouds) / 60.0, 0.5, 1.5)
+    calm = np.clip(6.0 - wind_speed, 0.0, 6.0)
+    ai = np.clip(0.4 + 0.07 * calm + 0.005 * clouds, 0.0, 5.0)
+    return {
+        "o3_forecast": 0.06 * no2 * tnorm * clr,
+        "hcho_forecast": 0.03 * no2 * clr,
+        "ai": ai,
+        "pm25_forecast": np.clip(6.0 + 0.9 * ai + 0.15 * calm, 0.0, 200.0),
+    }
+
+def risk_level_np(no2, seed) -> np.ndarray:
+    """0/1/2 (índices de RISK_LABELS) por hora, comparando a previsão com o seed."""
+    no2 = np.asarray(no2, dtype=float)
+    seed = np.asarray(seed, dtype=float)
+    return np.where(no2 >= RISK_HIGH_RATIO * seed, 2, np.where(no2 >= RISK_MODERATE_RATIO * seed, 1, 0)).astype(np.uint8)
+
+# ensemble: desvios das perturbações na hora 0 (crescem com sqrt(1 + lead / ENSEMBLE_GROWTH_H))
+ENSEMBLE_WIND_SIGMA = 0.25   # log do vento
+ENSEMBLE_CLOUD_SD = 15.0     # pontos percentuais de nuvem
+ENSEMBLE_RAIN_FLIP = 0.10    # chance de trocar chuva/seco numa hora
+ENSEMBLE_SEED_SIGMA = 0.20   # log do seed (incerteza da coluna TEMPO)
+ENSEMBLE_GROWTH_H = 24.0
+
+def ensemble_np(base_no2, wind_speed, clouds, rain_1h, members: int,
+                rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    NO2 de `members` membros (members × horas) numa passada só: a curva base
+    (forecast_no2_24h, antes do ajuste meteorológico) × seed perturbado ×
+    meteo_factor_np do clima perturbado. Cada perturbação do clima tem uma
+    parte fixa por membro e um ruído horário. NaN no clima continua NaN (fator 1).
+    Devolve também o fator do seed de cada membro (members × 1): o risco de um
+    membro é relativo ao seed dele, então os limiares também se multiplicam por ele.
+    """
+    base = np.asarray(base_no2, dtype=float)[None, :]
+    hours = base.shape[1]
+    growth = np.sqrt(1.0 + np.arange(hours) / ENSEMBLE_GROWTH_H)[None, :]
+
+    def noise() -> np.ndarray:
+        # variância 1 na hora 0: (1 + 0.5²) normalizado
+        return (rng.standard_normal((members, 1)) + 0.5 * rng.standard_normal((members, hours))) * (growth / np.sqrt(1.25))
+
+    ws = np.asarray(wind_speed, dtype=float)[None, :] * np.exp(ENSEMBLE_WIND_SIGMA * noise())
+    cl = np.clip(np.asarray(clouds, dtype=float)[None, :] + ENSEMBLE_CLOUD_SD * noise(), 0.0, 100.0)
+    r = np.broadcast_to(np.asarray(rain_1h, dtype=float)[None, :], (members, hours))
+    flip = rng.random((members, hours)) < ENSEMBLE_RAIN_FLIP * growth
+    r = np.where(flip & np.isfinite(r), np.where(r > 0, 0.0, 0.1), r)
+    # lognormal com média 1
+    seed_k = np.exp(ENSEMBLE_SEED_SIGMA * rng.standard_normal((members, 1)) - 0.5 * ENSEMBLE_SEED_SIGMA ** 2)
+    return base * seed_k * meteo_factor_np(ws, cl, r), seed_k
@@ -0,0 +1,429 @@
+"""
+Produto em grade CONUS: NO2/O3/PM2.5 (proxies) e risco horário para cada
+célula de uma grade lat/lon regular, num único job vetorizado, gravado como
+arrays (tempo × lat × lon) num .npz. Os endpoints /grid/* só leem esse arquivo.
+
+Entradas do job:
+  - seed por célula: mosaico TEMPO do bbox inteiro (o mesmo composite do
+    overlay, ver mosaic.py) reamostrado para a grade; células sem cobertura
+    recebem a média do domínio;
+  - clima: frames horários do OpenWeather numa grade de nós mais grossa
+    (GRID_WEATHER_RES_DEG) interpolados bilinearmente para a grade.
+
+O baseline de forecast_no2_24h é calibrado num alvo constante (o seed) e por
+isso devolve a própria persistência do seed; aqui ele entra direto como seed ×
+fator meteorológico, sem ajustar uma regressão por célula.
+
+    python grid_product.py              # um build com os upstreams reais
+"""
+from __future__ import annotations
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from forecast import RISK_HIGH_RATIO, RISK_LABELS, RISK_MODERATE_RATIO, meteo_factor_np, multi_species_np, risk_level_np
+from mosaic import Mosaic, MosaicCache, build_mosaic, grid_res
+from upstream import BACKGROUND, request_context, submit_in_context
+from weather_openweather import interp_hours
+
+def _parse_bbox(s: str) -> Tuple[float, float, float, float]:
+    v = [float(x) for x in s.split(",")]
+    if len(v) != 4:
+        raise ValueError(f"bbox inválido: {s}")
+    return (v[0], v[1], v[2], v[3])
+
+GRID_BBOX = _parse_bbox(os.getenv("GRID_BBOX", "-125,24,-66,50"))
+GRID_RES_DEG = float(os.getenv("GRID_RES_DEG", "0.25"))
+GRID_WEATHER_RES_DEG = float(os.getenv("GRID_WEATHER_RES_DEG", "2.0"))
+GRID_HOURS = int(os.getenv("GRID_HOURS", "48"))
+GRID_TEMPO_HOURS = int(os.getenv("GRID_TEMPO_HOURS", "8"))
+GRID_REFRESH_S = float(os.getenv("GRID_REFRESH_S", "3600"))
+# fração mínima de nós de clima que precisa responder para publicar o build
+GRID_MIN_WEATHER_NODES = float(os.getenv("GRID_MIN_WEATHER_NODES", "0.5"))
+
+FIELDS = ("no2", "o3", "pm25", "risk")
+_WX_FIELDS = ("temp", "wind_speed", "clouds", "rain_1h_est")
+# mesmos defaults de app.build_multi_species_forecast
+_WX_DEFAULTS = {"temp": 20.0, "wind_speed": 3.0, "clouds": 40.0, "rain_1h_est": 0.0}
+
+def _axis(lo: float, hi: float, res: float) -> np.ndarray:
+    n = max(1, int(math.ceil((hi - lo) / res - 1e-9)))
+    return lo + (np.arange(n) + 0.5) * res
+
+def _regrid_mean(mos: Mosaic, lat: np.ndarray, lon: np.ndarray, res: float) -> np.ndarray:
+    """Média das células do mosaico (mais fino) que caem em cada célula da grade."""
+    ny, nx = lat.size, lon.size
+    fy, fx = np.meshgrid(mos.lat, mos.lon, indexing="ij")
+    iy = np.floor((fy - (lat[0] - res / 2)) / res)
+    ix = np.floor((fx - (lon[0] - res / 2)) / res)
+    v = mos.values.astype(float)
+    ok = np.isfinite(v) & (iy >= 0) & (iy < ny) & (ix >= 0) & (ix < nx)
+    idx = (iy[ok] * nx + ix[ok]).astype(np.int64)
+    s = np.bincount(idx, weights=v[ok], minlength=ny * nx)
+    n = np.bincount(idx, minlength=ny * nx)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(n > 0, s / n, np.nan).reshape(ny, nx)
+
+def _bilinear(nodes_lat: np.ndarray, nodes_lon: np.ndarray, a: np.ndarray,
+              lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """
+    Interpola a[node_y, node_x, ...] para (lat, lon, ...), ignorando nós NaN
+    (peso renormalizado); NaN só onde os 4 vizinhos faltam.
+    """
+    def frac(targets, nodes):
+        f = np.interp(targets, nodes, np.arange(nodes.size, dtype=float))
+        i0 = np.clip(np.floor(f).astype(int), 0, max(nodes.size - 2, 0))
+        i1 = np.minimum(i0 + 1, nodes.size - 1)
+        return i0, i1, f - i0
+    y0, y1, wy = frac(lat, nodes_lat)
+    x0, x1, wx = frac(lon, nodes_lon)
+    extra = (1,) * (a.ndim - 2)
+    wy = wy.reshape((-1, 1) + extra)
+    wx = wx.reshape((1, -1) + extra)
+    ok = np.isfinite(a)
+    v = np.where(ok, a, 0.0)
+    m = ok.astype(float)
+    num = np.zeros((lat.size, lon.size) + a.shape[2:])
+    den = np.zeros_like(num)
+    for yi, wyy in ((y0, 1 - wy), (y1, wy)):
+        for xi, wxx in ((x0, 1 - wx), (x1, wx)):
+            w = wyy * wxx
+            num += v[yi][:, xi] * w
+            den += m[yi][:, xi] * w
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(den > 0, num / den, np.nan)
+
+def _frame_to_hours(df: pd.DataFrame, times: np.ndarray) -> np.ndarray:
+    """(len(times), len(_WX_FIELDS)) a partir de um frame horário; bordas repetem o valor mais próximo."""
+    if df is None or df.empty:
+        return np.full((times.size, len(_WX_FIELDS)), np.nan)
+    t = pd.to_datetime(df["datetime_utc"], utc=True).dt.as_unit("s").astype("int64").to_numpy()
+    X = df.reindex(columns=list(_WX_FIELDS)).apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    return interp_hours(t, X, times, clamp=True)
+
+def _fetch_weather_nodes(
+    nodes_lat: np.ndarray, nodes_lon: np.ndarray, times: np.ndarray,
+    fetch_hourly: Callable[[float, float], pd.DataFrame], workers: int,
+) -> Tuple[np.ndarray, int]:
+    wx = np.full((nodes_lat.size, nodes_lon.size, times.size, len(_WX_FIELDS)), np.nan)
+    jobs = [(i, j) for i in range(nodes_lat.size) for j in range(nodes_lon.size)]
+    ok = 0
+    with request_context(priority=BACKGROUND):
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            futs = {submit_in_context(ex, fetch_hourly, float(nodes_lat[i]), float(nodes_lon[j])): (i, j) for i, j in jobs}
+            for fut, (i, j) in futs.items():
+                try:
+                    wx[i, j] = _frame_to_hours(fut.result(), times)
+                    ok += 1
+                except Exception as e:
+                    print(f"[WARN] grid: clima ({nodes_lat[i]:.2f},{nodes_lon[j]:.2f}) -> {type(e).__name__}: {e}")
+    return wx, ok
+
+def build_grid_product(
+    out_path: Path,
+    fetch_hourly: Callable[[float, float], pd.DataFrame],
+    tempo_files: Sequence[str],
+    seed_fallback: float,
+    collection: str = "",
+    mosaics: Optional[MosaicCache] = None,
+    bbox: Tuple[float, float, float, float] = GRID_BBOX,
+    res: float = GRID_RES_DEG,
+    weather_res: float = GRID_WEATHER_RES_DEG,
+    hours: int = GRID_HOURS,
+    workers: int = 8,
+    start: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """Roda o job inteiro e grava out_path de forma atômica; devolve o meta do build."""
+    t_job = time.time()
+    lat = _axis(bbox[1], bbox[3], res)
+    lon = _axis(bbox[0], bbox[2], res)
+    t0 = (start or datetime.now(timezone.utc)).replace(minute=0, second=0, microsecond=0)
+    times = int(t0.timestamp()) + 3600 * np.arange(hours, dtype=np.int64)
+
+    # seed por célula a partir do composite TEMPO
+    seed = np.full((lat.size, lon.size), np.nan)
+    granules = 0
+    if tempo_files:
+        try:
+            mos = (mosaics.get(tempo_files, bbox, collection) if mosaics is not None
+                   else build_mosaic(tempo_files, bbox, res=grid_res(bbox)))
+            seed = _regrid_mean(mos, lat, lon, res)
+            granules = mos.granules
+        except Exception as e:
+            print(f"[WARN] grid: mosaico TEMPO -> {type(e).__name__}: {e}")
+    observed = np.isfinite(seed)
+    domain = float(np.nanmean(seed)) if observed.any() else seed_fallback
+    seed = np.where(observed, seed, domain)
+
+    # clima nos nós grossos -> grade
+    nodes_lat = _axis(bbox[1], bbox[3], weather_res)
+    nodes_lon = _axis(bbox[0], bbox[2], weather_res)
+    wx_nodes, ok_nodes = _fetch_weather_nodes(nodes_lat, nodes_lon, times, fetch_hourly, workers)
+    if ok_nodes < GRID_MIN_WEATHER_NODES * nodes_lat.size * nodes_lon.size:
+        raise RuntimeError(f"clima em só {ok_nodes}/{nodes_lat.size * nodes_lon.size} nós")
+    wx = _bilinear(nodes_lat, nodes_lon, wx_nodes, lat, lon)          # (lat, lon, tempo, campo)
+    wx = np.moveaxis(wx, 2, 0)                                        # (tempo, lat, lon, campo)
+    f = {name: wx[..., j] for j, name in enumerate(_WX_FIELDS)}
+    factor = meteo_factor_np(f["wind_speed"], f["clouds"], f["rain_1h_est"])
+    for name, default in _WX_DEFAULTS.items():
+        f[name] = np.where(np.isfinite(f[name]), f[name], default)
+
+    no2 = seed[None, :, :] * factor
+    species = multi_species_np(no2, f["temp"], f["clouds"], f["wind_speed"])
+    risk = risk_level_np(no2, seed[None, :, :])
+
+    meta = {
+        "created_utc": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "bbox": list(bbox),
+        "res_deg": res,
+        "weather_res_deg": weather_res,
+        "weather_nodes": int(nodes_lat.size * nodes_lon.size),
+        "weather_nodes_ok": ok_nodes,
+        "collection_id": collection,
+        "granules": granules,
+        "seed_coverage": round(float(observed.mean()), 4),
+        "tempo_fallback": not observed.any(),
+        "build_s": None,
+    }
+    arrays = {
+        "times": times,
+        "lat": lat.astype(np.float32),
+        "lon": lon.astype(np.float32),
+        "seed": seed.astype(np.float32),
+        "seed_observed": observed,
+        "no2": no2.astype(np.float32),
+        "o3": species["o3_forecast"].astype(np.float32),
+        "pm25": species["pm25_forecast"].astype(np.float32),
+        "risk": risk,
+    }
+    meta["build_s"] = round(time.time() - t_job, 2)
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_suffix(".tmp.npz")
+    np.savez_compressed(tmp, meta=np.array(json.dumps(meta)), **arrays)
+    os.replace(tmp, out_path)
+    return meta
+
+def _risk_label(ratio: float) -> str:
+    if not np.isfinite(ratio):
+        return "unknown"
+    if ratio >= RISK_HIGH_RATIO:
+        return "high"
+    if ratio >= RISK_MODERATE_RATIO:
+        return "moderate"
+    return "low"
+
+def _iso(ts: int) -> str:
+    return datetime.fromtimestamp(int(ts), timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+class GridProduct:
+    """Um build carregado em memória; só indexação, sem recomputar o modelo."""
+
+    def __init__(self, path: Path):
+        with np.load(path) as npz:
+            self.meta: Dict[str, Any] = json.loads(str(npz["meta"]))
+            self.times = npz["times"]
+            self.lat = npz["lat"].astype(float)
+            self.lon = npz["lon"].astype(float)
+            self.seed = npz["seed"]
+            self.seed_observed = npz["seed_observed"]
+            self.fields = {k: npz[k] for k in FIELDS}
+        self.res = float(self.meta["res_deg"])
+        # razão de pico por célula (o que _compute_risk faz para um ponto)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.peak_ratio = self.fields["no2"].max(axis=0) / self.seed
+        self._states: Optional[List[Dict[str, Any]]] = None
+        self.png: Dict[Tuple[str, int], bytes] = {}
+
+    @property
+    def bbox(self) -> Tuple[float, float, float, float]:
+        b = self.meta["bbox"]
+        return (b[0], b[1], b[2], b[3])
+
+    def _index(self, lat: float, lon: float) -> Optional[Tuple[int, int]]:
+        b = self.bbox
+        if not (b[1] <= lat <= b[3] and b[0] <= lon <= b[2]):
+            return None
+        iy = min(int((lat - b[1]) / self.res), self.lat.size - 1)
+        ix = min(int((lon - b[0]) / self.res), self.lon.size - 1)
+        return iy, ix
+
+    def point(self, lat: float, lon: float) -> Optional[Dict[str, Any]]:
+        ij = self._index(lat, lon)
+        if ij is None:
+            return None
+        iy, ix = ij
+        no2, o3, pm25, risk = (self.fields[k][:, iy, ix] for k in FIELDS)
+        ratio = float(self.peak_ratio[iy, ix])
+        return {
+            "lat": float(self.lat[iy]),
+            "lon": float(self.lon[ix]),
+            "no2_seed": float(self.seed[iy, ix]),
+            "seed_observed": bool(self.seed_observed[iy, ix]),
+            "risk": _risk_label(ratio),
+            "ratio_peak_over_seed": ratio,
+            "forecast": [
+                {"datetime_utc": _iso(t), "no2_forecast": float(a), "o3_forecast": float(b),
+                 "pm25_forecast": float(c), "risk": RISK_LABELS[int(r)]}
+                for t, a, b, c, r in zip(self.times, no2, o3, pm25, risk)
+            ],
+            "grid": self.meta,
+        }
+
+    def states(self, centroids: Sequence[Tuple[str, float, float]]) -> List[Dict[str, Any]]:
+        """
+        Agregado por estado sobre as células da mesma caixa que o /states/summary
+        usa em volta do centróide (±1.5° lon, ±1.2° lat); sem polígonos de estado.
+        """
+        if self._states is not None:
+            return self._states
+        out = []
+        for name, clat, clon in centroids:
+            ys = (self.lat >= clat - 1.2) & (self.lat <= clat + 1.2)
+            xs = (self.lon >= clon - 1.5) & (self.lon <= clon + 1.5)
+            n = int(ys.sum() * xs.sum())
+            if n == 0:
+                ratio = pm25 = o3 = float("nan")
+            else:
+                box = np.ix_(ys, xs)
+                ratio = float(np.nanmean(self.peak_ratio[box]))
+                pm25 = float(self.fields["pm25"][:, ys][:, :, xs].max(axis=0).mean())
+                o3 = float(self.fields["o3"][:, ys][:, :, xs].max(axis=0).mean())
+            out.append({
+                "state": name,
+                "lat": clat,
+                "lon": clon,
+                "risk": _risk_label(ratio),
+                "ratio_peak_over_seed": None if n == 0 else ratio,
+                "pm25_peak": None if n == 0 else pm25,
+                "o3_peak": None if n == 0 else o3,
+                "cells": n,
+                "updated_utc": self.meta["created_utc"],
+            })
+        self._states = out
+        return out
+
+    def layer(self, field: str, hour: int) -> np.ndarray:
+        if field == "seed":
+            return self.seed
+        return self.fields[field][hour]
+
+class GridStore:
+    """Recarrega o .npz quando ele muda em disco (build no processo ou por cron)."""
+
+    def __init__(self, path: Path, check_s: float = 30.0):
+        self.path = Path(path)
+        self.check_s = check_s
+        self._product: Optional[GridProduct] = None
+        self._mtime = 0.0
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[GridProduct]:
+        now = time.time()
+        if now - self._checked < self.check_s and self._product is not None:
+            return self._product
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = self.path.stat().st_mtime
+            except FileNotFoundError:
+                return self._product
+            if mtime != self._mtime:
+                try:
+                    self._product = GridProduct(self.path)
+                    self._mtime = mtime
+                except Exception as e:
+                    print(f"[WARN] grid: falha ao carregar {self.path.name} -> {e}")
+            return self._product
+
+    def invalidate(self) -> None:
+        self._checked = 0.0
+
+class GridJob:
+    """Rebuild periódico em thread, no molde do GroundLayer."""
+
+    def __init__(self, build: Callable[[], Dict[str, Any]], store: GridStore, refresh_s: float = GRID_REFRESH_S):
+        self.build = build
+        self.store = store
+        self.refresh_s = refresh_s
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_meta: Optional[Dict[str, Any]] = None
+        self.last_error: Optional[str] = None
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.last_meta = self.build()
+                self.last_error = None
+                self.store.invalidate()
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"[WARN] grid build -> {self.last_error}")
+            self._stop.wait(self.refresh_s)
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="grid-product", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+def fetch_tempo_window(data_dir: Path, bbox: Tuple[float, float, float, float], hours: int = GRID_TEMPO_HOURS) -> Tuple[List[str], str]:
+    """Granules das últimas `hours` horas no bbox (L3, senão L2) e a coleção usada."""
+    from nasa_tempo import COLL_L2_NRT_NO2, COLL_L3_NRT_NO2, fetch_tempo_no2_by_time_bbox
+    now = datetime.now(timezone.utc)
+    s = (now - timedelta(hours=hours)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    e = (now + timedelta(minutes=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    for prefer_l3, coll in ((True, COLL_L3_NRT_NO2), (False, COLL_L2_NRT_NO2)):
+        try:
+            with request_context(priority=BACKGROUND):
+                files = fetch_tempo_no2_by_time_bbox(data_dir, s, e, bbox, prefer_l3=prefer_l3)
+        except Exception as ex:
+            print(f"[WARN] grid: TEMPO ({coll}) -> {type(ex).__name__}: {ex}")
+            files = []
+        if files:
+            return files, coll
+    return [], ""
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from dotenv import load_dotenv
+    load_dotenv(Path(__file__).parent / ".env")
+    from weather_openweather import fetch_forecast, forecast_to_hourly
+
+    ap = argparse.ArgumentParser(description="Gera o produto em grade CONUS (.npz)")
+    ap.add_argument("--data-dir", default="./tempo_data")
+    ap.add_argument("--out", default=None, help="padrão <data-dir>/grid/conus_latest.npz")
+    ap.add_argument("--skip-nasa", action="store_true", help="seed = NO2_SEED_FALLBACK em toda a grade")
+    args = ap.parse_args(argv)
+
+    data_dir = Path(args.data_dir)
+    out = Path(args.out) if args.out else data_dir / "grid" / "conus_latest.npz"
+    files, coll = ([], "") if args.skip_nasa else fetch_tempo_window(data_dir, GRID_BBOX)
+    meta = build_grid_product(
+        out,
+        lambda a, b: forecast_to_hourly(fetch_forecast(a, b, units="metric")),
+        files,
+        seed_fallback=float(os.getenv("NO2_SEED_FALLBACK", "3.0e15")),
+        collection=coll,
+    )
+    print(json.dumps(meta, indent=2))
+    print(f"grade: {out}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
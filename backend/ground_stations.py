@@ -0,0 +1,252 @@
+"""
+Camada de observações em solo: baixa periodicamente todas as estações AQICN
+das regiões configuradas (endpoint /map/bounds, uma chamada por região) e
+responde "estação mais próxima" / "k mais próximas" localmente via BallTree
+(distância haversine), sem uma chamada /feed/geo: por request.
+
+Uma região que falha mantém as estações da última busca boa (até
+AQICN_SNAPSHOT_MAX_AGE_S); as demais entram no snapshot normalmente.
+
+O /map/bounds só traz o AQI agregado. Os poluentes individuais (no2, o3,
+pm25, pm10) da estação escolhida vêm de um /feed/@uid buscado em background
+na primeira vez que ela é pedida e guardado até a estação publicar uma nova
+leitura (time_local muda); o request nunca espera por ele.
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sklearn.neighbors import BallTree
+
+from aqicn_client import fetch_bounds, fetch_station
+from upstream import BACKGROUND, request_context
+
+EARTH_RADIUS_KM = 6371.0
+
+# (lat0, lon0, lat1, lon1): CONUS em faixas + Alasca + Havaí
+DEFAULT_REGIONS: List[Tuple[float, float, float, float]] = [
+    (24.0, -125.0, 37.0, -110.0), (37.0, -125.0, 50.0, -110.0),
+    (24.0, -110.0, 37.0, -95.0), (37.0, -110.0, 50.0, -95.0),
+    (24.0, -95.0, 37.0, -80.0), (37.0, -95.0, 50.0, -80.0),
+    (24.0, -80.0, 37.0, -66.0), (37.0, -80.0, 50.0, -66.0),
+    (51.0, -170.0, 72.0, -129.0),
+    (18.5, -161.0, 22.5, -154.0),
+]
+
+SNAPSHOT_REFRESH_S = float(os.getenv("AQICN_SNAPSHOT_REFRESH_S", "600"))
+SNAPSHOT_MAX_AGE_S = float(os.getenv("AQICN_SNAPSHOT_MAX_AGE_S", "1800"))
+SNAPSHOT_MAX_KM = float(os.getenv("AQICN_SNAPSHOT_MAX_KM", "75"))
+# feeds de estação guardados (poluentes individuais) e espera antes de tentar de novo uma que falhou
+STATION_FEED_CACHE_MAX = int(os.getenv("AQICN_STATION_FEED_CACHE_MAX", "2000"))
+STATION_FEED_RETRY_S = float(os.getenv("AQICN_STATION_FEED_RETRY_S", "60"))
+STATION_FEED_WORKERS = int(os.getenv("AQICN_STATION_FEED_WORKERS", "2"))
+
+POLLUTANTS = ("no2", "o3", "pm25", "pm10")
+
+def _parse_regions(s: str) -> List[Tuple[float, float, float, float]]:
+    regions = []
+    for part in filter(None, (p.strip() for p in s.split(";"))):
+        v = [float(x) for x in part.split(",")]
+        if len(v) != 4:
+            raise ValueError(f"região inválida: {part}")
+        regions.append((v[0], v[1], v[2], v[3]))
+    return regions
+
+def _fetch_region(region: Tuple[float, float, float, float]) -> List[Dict[str, Any]]:
+    with request_context(priority=BACKGROUND):
+        return fetch_bounds(*region)
+
+class _Snapshot:
+    def __init__(self, stations: List[Dict[str, Any]], fetched_at: float):
+        self.stations = stations
+        self.fetched_at = fetched_at
+        self.tree: Optional[BallTree] = None
+        if stations:
+            coords = np.radians(np.array([[s["lat"], s["lon"]] for s in stations], dtype=float))
+            self.tree = BallTree(coords, metric="haversine")
+
+class GroundLayer:
+    def __init__(
+        self,
+        regions: Optional[Sequence[Tuple[float, float, float, float]]] = None,
+        refresh_s: float = SNAPSHOT_REFRESH_S,
+        max_age_s: float = SNAPSHOT_MAX_AGE_S,
+        max_km: float = SNAPSHOT_MAX_KM,
+    ):
+        env_regions = os.getenv("AQICN_SNAPSHOT_REGIONS")
+        self.regions = list(regions or (_parse_regions(env_regions) if env_regions else DEFAULT_REGIONS))
+        self.refresh_s = refresh_s
+        self.max_age_s = max_age_s
+        self.max_km = max_km
+        self._snap = _Snapshot([], 0.0)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_error: Optional[str] = None
+        # índice da região -> (instante da última busca boa, estações)
+        self._regions: Dict[int, Tuple[float, List[Dict[str, Any]]]] = {}
+        self.regions_failed = 0
+        self.region_failures = 0
+        # uid -> (time_local da leitura, instante do fetch, poluentes | None se falhou)
+        self.fetch_station = fetch_station
+        self._feeds: Dict[Any, Tuple[Any, float, Optional[Dict[str, Any]]]] = {}
+        self._feeds_lock = threading.Lock()
+        self._feeds_pending: set = set()
+        self._feed_pool = ThreadPoolExecutor(max_workers=STATION_FEED_WORKERS, thread_name_prefix="aqicn-feed")
+        self.feed_fetches = 0
+        self.feed_errors = 0
+
+    def load_stations(self, stations: List[Dict[str, Any]], fetched_at: Optional[float] = None) -> None:
+        """Troca o snapshot inteiro de uma vez (leitores nunca veem um índice pela metade)."""
+        # a mesma estação pode aparecer em duas regiões vizinhas
+        seen: Dict[Any, Dict[str, Any]] = {}
+        for s in stations:
+            seen[s.get("uid") or (s["lat"], s["lon"])] = s
+        self._snap = _Snapshot(list(seen.values()), time.time() if fetched_at is None else fetched_at)
+
+    def refresh(self) -> int:
+        """
+        Busca todas as regiões. Região que falha fica com as estações da última
+        busca boa (descartadas depois de max_age_s); só se todas falharem o
+        snapshot não é trocado.
+        """
+        now = time.time()
+        errors: List[str] = []
+        with ThreadPoolExecutor(max_workers=4) as ex:
+            futs = {ex.submit(_fetch_region, r): i for i, r in enumerate(self.regions)}
+            for fut in as_completed(futs):
+                i = futs[fut]
+                try:
+                    self._regions[i] = (now, fut.result())
+                except Exception as e:
+                    errors.append(f"{self.regions[i]}: {type(e).__name__}: {e}")
+        self.regions_failed = len(errors)
+        self.region_failures += len(errors)
+        self.last_error = "; ".join(errors) or None
+        if len(errors) == len(self.regions):
+            raise RuntimeError(f"todas as {len(errors)} regiões falharam ({errors[0]})")
+        for i, (t, _) in list(self._regions.items()):
+            if now - t >= self.max_age_s:
+                del self._regions[i]
+        self.load_stations([s for _, part in self._regions.values() for s in part], fetched_at=now)
+        if errors:
+            print(f"[WARN] AQICN snapshot: {len(errors)}/{len(self.regions)} regiões falharam -> {self.last_error}")
+        return len(self._snap.stations)
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"[WARN] AQICN snapshot -> {self.last_error}")
+            self._stop.wait(self.refresh_s)
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="aqicn-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def is_fresh(self) -> bool:
+        snap = self._snap
+        return snap.tree is not None and (time.time() - snap.fetched_at) < self.max_age_s
+
+    def k_nearest(self, lat: float, lon: float, k: int = 5, max_km: Optional[float] = None) -> List[Dict[str, Any]]:
+        snap = self._snap
+        if snap.tree is None:
+            return []
+        k = max(1, min(k, len(snap.stations)))
+        dist, idx = snap.tree.query(np.radians([[lat, lon]]), k=k)
+        limit = self.max_km if max_km is None else max_km
+        out = []
+        for d, i in zip(dist[0], idx[0]):
+            km = float(d * EARTH_RADIUS_KM)
+            if km > limit:
+                break
+            out.append({**snap.stations[int(i)], "distance_km": km})
+        return out
+
+    def _pollutants(self, st: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Poluentes da leitura atual se o feed já está em cache; senão agenda o fetch em background e devolve None."""
+        uid = st.get("uid")
+        if uid is None:
+            return None
+        now = time.time()
+        with self._feeds_lock:
+            ent = self._feeds.get(uid)
+            if ent is not None and ent[0] == st.get("time_local") and (ent[2] is not None or now - ent[1] < STATION_FEED_RETRY_S):
+                return ent[2]
+            if uid in self._feeds_pending:
+                return None
+            self._feeds_pending.add(uid)
+        self._feed_pool.submit(self._fetch_feed, uid, st.get("time_local"))
+        return None
+
+    def _fetch_feed(self, uid: Any, time_local: Any) -> None:
+        try:
+            with self._feeds_lock:
+                self.feed_fetches += 1
+            with request_context(priority=BACKGROUND):
+                feed = self.fetch_station(uid)
+            vals: Optional[Dict[str, Any]] = {k: feed.get(k) for k in POLLUTANTS}
+        except Exception as e:
+            with self._feeds_lock:
+                self.feed_errors += 1
+            print(f"[WARN] AQICN feed @{uid} -> {type(e).__name__}: {e}")
+            vals = None
+        with self._feeds_lock:
+            self._feeds_pending.discard(uid)
+            self._feeds.pop(uid, None)
+            self._feeds[uid] = (time_local, time.time(), vals)
+            while len(self._feeds) > STATION_FEED_CACHE_MAX:
+                self._feeds.pop(next(iter(self._feeds)))
+
+    def nearest(self, lat: float, lon: float, pollutants: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Amostra no formato de aqicn_client.fetch_nearest, ou None se o snapshot
+        estiver vencido/vazio ou não houver estação até max_km. Com pollutants=True
+        os poluentes individuais vêm do feed da estação se ele já estiver em cache
+        (senão é buscado em background para os próximos pedidos); com False, antes
+        do feed chegar ou se ele falhar, ficam None. Nunca espera pelo AQICN.
+        """
+        if not self.is_fresh():
+            return None
+        near = self.k_nearest(lat, lon, k=1)
+        if not near:
+            return None
+        s = near[0]
+        vals = (self._pollutants(s) if pollutants else None) or {}
+        return {
+            "aqi": s.get("aqi"),
+            **{k: vals.get(k) for k in POLLUTANTS},
+            "time_local": s.get("time_local"),
+            "station": s.get("station"),
+            "station_geo": [s["lat"], s["lon"]],
+            "attribution": "Powered by AQICN.org",
+            "fetched_utc": datetime.fromtimestamp(self._snap.fetched_at, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        snap = self._snap
+        return {
+            "stations": len(snap.stations),
+            "regions": len(self.regions),
+            "regions_failed": self.regions_failed,
+            "region_failures": self.region_failures,
+            "age_s": (time.time() - snap.fetched_at) if snap.fetched_at else None,
+            "fresh": self.is_fresh(),
+            "station_feeds": len(self._feeds),
+            "station_feed_pending": len(self._feeds_pending),
+            "station_feed_fetches": self.feed_fetches,
+            "station_feed_errors": self.feed_errors,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,398 @@
+"""
+Histórico colunar das previsões: cada /forecast calculado (não os servidos do
+cache) vira uma linha em `forecasts` (seed, risco, AQI de solo, concordância)
+e N linhas em `forecast_hours` (série horária). Parquet particionado por dia
+(hive, date=YYYY-MM-DD) sob tempo_data/history.
+
+A gravação sai do caminho do request: record() só enfileira o payload e uma
+thread grava em lote a cada HISTORY_FLUSH_S ou HISTORY_BATCH payloads.
+As consultas usam filtros do pyarrow.dataset: a partição elimina dias fora do
+intervalo e as estatísticas dos row groups podam ts/lat/lon.
+
+    python history.py compact --before 2026-10-01   # junta as partes de cada dia
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as pds
+import pyarrow.parquet as pq
+
+HISTORY_FLUSH_S = float(os.getenv("HISTORY_FLUSH_S", "60"))
+HISTORY_BATCH = int(os.getenv("HISTORY_BATCH", "2000"))
+# acima disso os payloads mais antigos na fila são descartados (disco lento/cheio)
+HISTORY_MAX_PENDING = int(os.getenv("HISTORY_MAX_PENDING", "50000"))
+
+_TS = pa.timestamp("us", tz="UTC")
+# arquivos ocultos (prefixo ".") ficam fora da descoberta do dataset
+_COMPACT_MANIFEST = ".compact.json"
+
+FORECASTS_SCHEMA = pa.schema([
+    ("ts_utc", _TS),
+    ("lat", pa.float64()),
+    ("lon", pa.float64()),
+    ("no2_seed", pa.float64()),
+    ("fallback_used", pa.bool_()),
+    ("collection_id", pa.string()),
+    ("granules", pa.int32()),
+    ("risk", pa.string()),
+    ("ratio_peak_over_seed", pa.float64()),
+    ("next_critical_hour", _TS),
+    ("ground_aqi", pa.float64()),
+    ("ground_station", pa.string()),
+    ("ground_lat", pa.float64()),
+    ("ground_lon", pa.float64()),
+    ("ground_bucket", pa.string()),
+    ("model_bucket", pa.string()),
+    # risco do modelo antes do ajuste pelo AQI de solo (model_bucket já vem ajustado)
+    ("model_bucket_raw", pa.string()),
+    ("concordance", pa.string()),
+])
+
+HOURS_SCHEMA = pa.schema([
+    ("ts_utc", _TS),
+    ("lat", pa.float64()),
+    ("lon", pa.float64()),
+    ("valid_utc", _TS),
+    ("lead_h", pa.int16()),
+    ("no2_forecast", pa.float64()),
+    ("o3_forecast", pa.float64()),
+    ("pm25_forecast", pa.float64()),
+    ("risk", pa.string()),
+])
+
+TABLES = {"forecasts": FORECASTS_SCHEMA, "forecast_hours": HOURS_SCHEMA}
+_PARTITIONING = pds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+
+def _ts(s: Any) -> Optional[pd.Timestamp]:
+    if s is None or s == "":
+        return None
+    t = pd.Timestamp(s)
+    return t.tz_localize("UTC") if t.tzinfo is None else t.tz_convert("UTC")
+
+def _utc(d: Optional[datetime]) -> Optional[datetime]:
+    if d is None:
+        return None
+    return d.replace(tzinfo=timezone.utc) if d.tzinfo is None else d.astimezone(timezone.utc)
+
+def _num(v: Any) -> Optional[float]:
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        return None
+    return f if np.isfinite(f) else None
+
+def payload_rows(payload: Dict[str, Any], ts: pd.Timestamp) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Linha de `forecasts` e linhas de `forecast_hours` de um payload do /forecast."""
+    tempo = payload.get("tempo") or {}
+    ground = payload.get("ground") or {}
+    if hasattr(ground, "model_dump"):
+        ground = ground.model_dump()
+    geo = ground.get("station_geo") or [None, None]
+    val = payload.get("validation") or {}
+    alerts = payload.get("alerts") or {}
+    lat, lon = float(payload["lat"]), float(payload["lon"])
+    head = {
+        "ts_utc": ts,
+        "lat": lat,
+        "lon": lon,
+        "no2_seed": _num(payload.get("no2_seed")),
+        "fallback_used": bool(tempo.get("fallback_used", False)),
+        "collection_id": tempo.get("collection_id"),
+        "granules": len(tempo.get("granules") or []),
+        "risk": payload.get("risk"),
+        "ratio_peak_over_seed": _num(payload.get("ratio_peak_over_seed")),
+        "next_critical_hour": _ts(alerts.get("next_critical_hour")),
+        "ground_aqi": _num(ground.get("aqi")),
+        "ground_station": ground.get("station"),
+        "ground_lat": _num(geo[0]) if len(geo) > 1 else None,
+        "ground_lon": _num(geo[1]) if len(geo) > 1 else None,
+        "ground_bucket": val.get("ground_bucket"),
+        "model_bucket": val.get("model_bucket"),
+        "model_bucket_raw": val.get("model_bucket_raw"),
+        "concordance": val.get("concordance"),
+    }
+    risk_by_hour = {r.get("datetime_utc"): r.get("risk") for r in (alerts.get("hourly_risk") or [])}
+    hours = []
+    for p in payload.get("forecast") or []:
+        valid = _ts(p.get("datetime_utc"))
+        if valid is None:
+            continue
+        hours.append({
+            "ts_utc": ts,
+            "lat": lat,
+            "lon": lon,
+            "valid_utc": valid,
+            "lead_h": int(round((valid - ts).total_seconds() / 3600.0)),
+            "no2_forecast": _num(p.get("no2_forecast")),
+            "o3_forecast": _num(p.get("o3_forecast")),
+            "pm25_forecast": _num(p.get("pm25_forecast")),
+            "risk": risk_by_hour.get(p.get("datetime_utc")),
+        })
+    return head, hours
+
+class HistoryStore:
+    def __init__(self, root: Path, flush_s: float = HISTORY_FLUSH_S, batch: int = HISTORY_BATCH,
+                 max_pending: int = HISTORY_MAX_PENDING):
+        self.root = Path(root)
+        self.flush_s = flush_s
+        self.batch = batch
+        self._pending: Deque[Tuple[float, Dict[str, Any]]] = deque(maxlen=max_pending)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.last_error: Optional[str] = None
+
+    # --- escrita ---
+
+    def record(self, payload: Dict[str, Any]) -> None:
+        """Enfileira o payload; não toca em disco."""
+        with self._lock:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self._pending.append((time.time(), payload))
+            self.recorded += 1
+            full = len(self._pending) >= self.batch
+        if full:
+            self._wake.set()
+
+    def flush(self) -> int:
+        with self._lock:
+            items = list(self._pending)
+            self._pending.clear()
+        if not items:
+            return 0
+        heads, hours = [], []
+        for t, payload in items:
+            try:
+                h, hs = payload_rows(payload, pd.Timestamp(t, unit="s", tz="UTC"))
+            except Exception as e:
+                print(f"[WARN] history: payload ignorado -> {type(e).__name__}: {e}")
+                continue
+            heads.append(h)
+            hours.extend(hs)
+        with self._write_lock:
+            self._write("forecasts", heads)
+            self._write("forecast_hours", hours)
+            self.written += len(heads)
+            self.flushes += 1
+        return len(heads)
+
+    def _write(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        schema = TABLES[table]
+        tbl = pa.Table.from_pylist(rows, schema=schema)
+        dates = pa.array([r["ts_utc"].strftime("%Y-%m-%d") for r in rows], pa.string())
+        tbl = tbl.append_column("date", dates)
+        pds.write_dataset(
+            tbl, self.root / table, format="parquet", partitioning=_PARTITIONING,
+            basename_template=f"part-{int(time.time())}-{uuid.uuid4().hex[:8]}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_s)
+            self._wake.clear()
+            try:
+                self.flush()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"[WARN] history flush -> {self.last_error}")
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="history-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        self.flush()
+
+    # --- leitura ---
+
+    def _dataset(self, table: str) -> Optional[pds.Dataset]:
+        path = self.root / table
+        if not path.exists():
+            return None
+        return pds.dataset(path, format="parquet", partitioning=_PARTITIONING, schema=TABLES[table].append(
+            pa.field("date", pa.string())))
+
+    @staticmethod
+    def _filter(start: Optional[datetime], end: Optional[datetime],
+                bbox: Optional[Tuple[float, float, float, float]]) -> Optional[pds.Expression]:
+        # partições são dias UTC: start/end com outro fuso (ou sem fuso, tomado como UTC) vão para UTC antes
+        start, end = _utc(start), _utc(end)
+        f: Optional[pds.Expression] = None
+        def add(e):
+            nonlocal f
+            f = e if f is None else (f & e)
+        if start is not None:
+            add(pds.field("date") >= start.strftime("%Y-%m-%d"))
+            add(pds.field("ts_utc") >= pa.scalar(start, _TS))
+        if end is not None:
+            add(pds.field("date") <= end.strftime("%Y-%m-%d"))
+            add(pds.field("ts_utc") < pa.scalar(end, _TS))
+        if bbox is not None:
+            add((pds.field("lon") >= bbox[0]) & (pds.field("lon") <= bbox[2])
+                & (pds.field("lat") >= bbox[1]) & (pds.field("lat") <= bbox[3]))
+        return f
+
+    def query(self, table: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+              bbox: Optional[Tuple[float, float, float, float]] = None,
+              columns: Optional[List[str]] = None) -> pd.DataFrame:
+        ds = self._dataset(table)
+        cols = columns or [f.name for f in TABLES[table]]
+        if ds is None:
+            return pd.DataFrame(columns=cols)
+        return ds.to_table(columns=cols, filter=self._filter(start, end, bbox)).to_pandas()
+
+    def skill(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+              bbox: Optional[Tuple[float, float, float, float]] = None,
+              group_by: str = "none", cell_deg: float = 1.0) -> Dict[str, Any]:
+        """
+        Concordância modelo × solo (AQICN) no recorte: contagens, taxa de acerto,
+        matriz de confusão, POD/FAR para "high" e correlação razão de pico × AQI.
+        O acerto usa model_bucket_raw (antes do ajuste pelo solo); linhas sem ele
+        (gravadas antes da coluna existir) não entram no julgamento.
+        group_by: none | day | cell (grade de cell_deg graus).
+        """
+        df = self.query("forecasts", start, end, bbox, columns=[
+            "ts_utc", "lat", "lon", "risk", "ratio_peak_over_seed", "fallback_used",
+            "ground_aqi", "ground_bucket", "model_bucket", "model_bucket_raw", "concordance",
+        ])
+        if group_by == "day":
+            keys = df["ts_utc"].dt.strftime("%Y-%m-%d") if not df.empty else pd.Series(dtype=str)
+        elif group_by == "cell":
+            keys = ((np.floor(df["lat"] / cell_deg) * cell_deg).round(4).astype(str) + ","
+                    + (np.floor(df["lon"] / cell_deg) * cell_deg).round(4).astype(str)) if not df.empty else pd.Series(dtype=str)
+        elif group_by == "none":
+            keys = None
+        else:
+            raise ValueError("group_by must be none, day or cell")
+        out: Dict[str, Any] = {"overall": _skill_stats(df)}
+        if keys is not None:
+            out["groups"] = {str(k): _skill_stats(g) for k, g in df.groupby(keys)}
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "root": str(self.root),
+            "pending": pending,
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "last_error": self.last_error,
+        }
+
+    def compact(self, table: str, before: str) -> int:
+        """
+        Reescreve cada partição date < before num único arquivo; devolve quantas compactou.
+
+        O arquivo compactado é gravado oculto dentro da própria partição, renomeado
+        para o nome final e só então os originais são apagados: a partição nunca
+        some para os leitores, e partes gravadas por outro processo no meio do caminho
+        ficam. Um manifesto (.compact.json) lista os originais; se o processo cair
+        entre o rename e os unlinks, a próxima compactação termina o serviço.
+        """
+        base = self.root / table
+        n = 0
+        with self._write_lock:
+            for part in sorted(base.glob("date=*")):
+                _finish_compact(part)
+                day = part.name.split("=", 1)[1]
+                files = sorted(part.glob("*.parquet"))
+                if day >= before or len(files) <= 1:
+                    continue
+                tbl = pq.read_table(files, schema=TABLES[table])
+                name = f"part-{day}-compact-{uuid.uuid4().hex[:8]}.parquet"
+                tmp = part / f".{name}.tmp"
+                pq.write_table(tbl.sort_by([("ts_utc", "ascending")]), tmp)
+                (part / _COMPACT_MANIFEST).write_text(json.dumps({"compact": name, "sources": [f.name for f in files]}))
+                os.replace(tmp, part / name)
+                _finish_compact(part)
+                n += 1
+        return n
+
+def _finish_compact(part: Path) -> None:
+    """Conclui (ou descarta) uma compactação interrompida da partição."""
+    manifest = part / _COMPACT_MANIFEST
+    if not manifest.exists():
+        return
+    m = json.loads(manifest.read_text())
+    if (part / m["compact"]).exists():
+        # o compactado já está no lugar: faltou só apagar os originais
+        for name in m["sources"]:
+            (part / name).unlink(missing_ok=True)
+    else:
+        # caiu antes do rename: os originais continuam valendo
+        (part / f".{m['compact']}.tmp").unlink(missing_ok=True)
+    manifest.unlink()
+
+def _skill_stats(df: pd.DataFrame) -> Dict[str, Any]:
+    n = int(len(df))
+    conc = df["concordance"].fillna("unknown").value_counts().to_dict() if n else {}
+    judged = df[df["ground_bucket"].notna() & (df["ground_bucket"] != "unknown") & df["model_bucket_raw"].notna()] if n else df
+    m = int(len(judged))
+    agree = int((judged["model_bucket_raw"] == judged["ground_bucket"]).sum()) if m else 0
+    out: Dict[str, Any] = {
+        "forecasts": n,
+        "with_ground": m,
+        "fallback_rate": float(df["fallback_used"].mean()) if n else None,
+        "concordance": {str(k): int(v) for k, v in conc.items()},
+        "agreement_rate": (agree / m) if m else None,
+    }
+    if m:
+        cm = pd.crosstab(judged["model_bucket_raw"], judged["ground_bucket"])
+        out["confusion"] = {str(r): {str(c): int(cm.loc[r, c]) for c in cm.columns} for r in cm.index}
+        obs_hi = judged["ground_bucket"] == "high"
+        fc_hi = judged["model_bucket_raw"] == "high"
+        hits = int((obs_hi & fc_hi).sum())
+        out["high_pod"] = (hits / int(obs_hi.sum())) if obs_hi.any() else None
+        out["high_far"] = (1.0 - hits / int(fc_hi.sum())) if fc_hi.any() else None
+        pair = judged[["ratio_peak_over_seed", "ground_aqi"]].dropna()
+        corr = float(pair.corr().iloc[0, 1]) if len(pair) > 2 else float("nan")
+        out["corr_ratio_vs_aqi"] = corr if np.isfinite(corr) else None
+    return out
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Manutenção do histórico Parquet")
+    ap.add_argument("cmd", choices=["compact"])
+    ap.add_argument("--root", default="./tempo_data/history")
+    ap.add_argument("--before", default=datetime.now(timezone.utc).strftime("%Y-%m-%d"),
+                    help="compacta dias anteriores a esta data (padrão: hoje)")
+    args = ap.parse_args(argv)
+    store = HistoryStore(Path(args.root))
+    for table in TABLES:
+        print(f"{table}: {store.compact(table, args.before)} partições compactadas")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
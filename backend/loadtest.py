@@ -0,0 +1,163 @@
+"""
+Driver de carga: reproduz um mix de tráfego contra a API (idealmente com os
+upstreams apontados para fake_upstreams.py) e reporta vazão e p50/p95/p99.
+
+    python loadtest.py --base http://127.0.0.1:8000 --concurrency 32 --duration 60 \\
+        --mix hot=70,cold=10,summary=5,overlay=15 --out load.json
+"""
+from __future__ import annotations
+import argparse
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+import requests
+
+from benchmark import percentile
+
+# cidades com mais tráfego (usuários se concentram nelas)
+HOT_CITIES: List[Tuple[str, float, float]] = [
+    ("New York", 40.7128, -74.0060),
+    ("Los Angeles", 34.0522, -118.2437),
+    ("Chicago", 41.8781, -87.6298),
+    ("Houston", 29.7604, -95.3698),
+    ("Phoenix", 33.4484, -112.0740),
+    ("Philadelphia", 39.9526, -75.1652),
+    ("Denver", 39.7392, -104.9903),
+    ("Seattle", 47.6062, -122.3321),
+    ("Atlanta", 33.7490, -84.3880),
+    ("Miami", 25.7617, -80.1918),
+]
+
+CONUS = (-125.0, 24.0, -66.0, 50.0)
+
+def _hot_forecast(rng: random.Random) -> Tuple[str, Dict[str, Any]]:
+    _, lat, lon = rng.choice(HOT_CITIES)
+    # usuários espalhados por alguns km em volta do centro
+    return "/forecast", {"lat": round(lat + rng.uniform(-0.05, 0.05), 4), "lon": round(lon + rng.uniform(-0.05, 0.05), 4)}
+
+def _cold_forecast(rng: random.Random) -> Tuple[str, Dict[str, Any]]:
+    lon0, lat0, lon1, lat1 = CONUS
+    return "/forecast", {"lat": round(rng.uniform(lat0, lat1), 4), "lon": round(rng.uniform(lon0, lon1), 4)}
+
+def _states_summary(rng: random.Random) -> Tuple[str, Dict[str, Any]]:
+    return "/states/summary", {"skip_nasa": rng.random() < 0.8}
+
+def _overlay_pan(rng: random.Random) -> Tuple[str, Dict[str, Any]]:
+    # janela de mapa de ~12x8 graus arrastada sobre CONUS, alinhada a 1 grau como o front faz ao soltar o pan
+    w, h = 12, 8
+    lon0 = rng.randint(-125, -66 - w)
+    lat0 = rng.randint(24, 50 - h)
+    return "/tempo/latest_overlay.png", {"bbox": f"{lon0},{lat0},{lon0 + w},{lat0 + h}", "hours": 8}
+
+SCENARIOS: Dict[str, Callable[[random.Random], Tuple[str, Dict[str, Any]]]] = {
+    "hot": _hot_forecast,
+    "cold": _cold_forecast,
+    "summary": _states_summary,
+    "overlay": _overlay_pan,
+}
+
+def _parse_mix(s: str) -> Dict[str, float]:
+    mix: Dict[str, float] = {}
+    for part in filter(None, (p.strip() for p in s.split(","))):
+        k, v = part.split("=", 1)
+        if k not in SCENARIOS:
+            raise SystemExit(f"cenário desconhecido: {k} (use {', '.join(SCENARIOS)})")
+        mix[k] = float(v)
+    if not mix or sum(mix.values()) <= 0:
+        raise SystemExit("mix vazio")
+    return mix
+
+def run(base: str, mix: Dict[str, float], concurrency: int, duration_s: float, timeout_s: float, seed: int) -> Dict[str, Any]:
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    lat: Dict[str, List[float]] = defaultdict(list)
+    status: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration_s
+
+    def worker(i: int):
+        rng = random.Random(seed + i)
+        sess = requests.Session()
+        while time.monotonic() < stop_at:
+            name = rng.choices(names, weights)[0]
+            path, params = SCENARIOS[name](rng)
+            t0 = time.perf_counter()
+            try:
+                r = sess.get(base.rstrip("/") + path, params=params, timeout=timeout_s)
+                code = str(r.status_code)
+                r.content
+            except requests.RequestException as e:
+                code = type(e).__name__
+            dt = time.perf_counter() - t0
+            with lock:
+                lat[name].append(dt)
+                status[name][code] += 1
+
+    t_start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        futures = [ex.submit(worker, i) for i in range(concurrency)]
+    elapsed = time.monotonic() - t_start
+    # worker que morreu por bug do driver (não erro HTTP) reduz a concorrência real: reporta em vez de engolir
+    worker_errors: List[str] = []
+    for i, f in enumerate(futures):
+        exc = f.exception()
+        if exc is not None:
+            worker_errors.append(f"worker {i}: {type(exc).__name__}: {exc}")
+            print(f"[WARN] loadtest: worker {i} morreu -> {type(exc).__name__}: {exc}")
+
+    def summarize(xs: List[float], codes: Dict[str, int]) -> Dict[str, Any]:
+        ok = sum(v for k, v in codes.items() if k.startswith("2"))
+        return {
+            "requests": len(xs),
+            "ok": ok,
+            "errors": len(xs) - ok,
+            "throughput_rps": len(xs) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(xs, 0.50) * 1e3,
+            "p95_ms": percentile(xs, 0.95) * 1e3,
+            "p99_ms": percentile(xs, 0.99) * 1e3,
+            "status": dict(codes),
+        }
+
+    all_lat = [x for xs in lat.values() for x in xs]
+    all_codes: Dict[str, int] = defaultdict(int)
+    for codes in status.values():
+        for k, v in codes.items():
+            all_codes[k] += v
+    return {
+        "base": base,
+        "concurrency": concurrency,
+        "duration_s": elapsed,
+        "mix": mix,
+        "total": summarize(all_lat, all_codes),
+        "scenarios": {n: summarize(lat[n], status[n]) for n in names if lat[n]},
+        "worker_errors": worker_errors,
+    }
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Teste de carga da API TEMPO + Weather")
+    ap.add_argument("--base", default="http://127.0.0.1:8000")
+    ap.add_argument("--mix", default="hot=70,cold=10,summary=5,overlay=15")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--duration", type=float, default=30.0)
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", default=None, help="grava o relatório em JSON")
+    args = ap.parse_args(argv)
+
+    rep = run(args.base, _parse_mix(args.mix), args.concurrency, args.duration, args.timeout, args.seed)
+    print(f"{'scenario':10s} {'reqs':>7s} {'err':>5s} {'rps':>8s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+    for name, s in list(rep["scenarios"].items()) + [("TOTAL", rep["total"])]:
+        print(f"{name:10s} {s['requests']:7d} {s['errors']:5d} {s['throughput_rps']:8.2f} "
+              f"{s['p50_ms']:9.1f} {s['p95_ms']:9.1f} {s['p99_ms']:9.1f}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(rep, f, indent=2)
+    return 1 if rep["worker_errors"] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
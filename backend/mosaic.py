@@ -0,0 +1,354 @@
+"""
+Mosaico temporal de granules TEMPO NO2: junta todos os arquivos de uma janela
+numa grade regular lat/lon do bbox, lendo cada granule em blocos de linhas
+(mirror_step) e acumulando direto na grade. Memória ~ tamanho da grade + um
+bloco, independente de quantos granules a janela tiver.
+
+Métodos (MOSAIC_METHOD):
+  latest  pixel válido mais recente em cada célula
+  mean    média ponderada pelo tempo, peso exp(-(t_mais_recente - t) / MOSAIC_TAU_H)
+
+O resultado fica em cache por (coleção, bbox, conjunto de granules da janela,
+método, resolução): em memória (LRU) e em .npz em disco.
+"""
+from __future__ import annotations
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import xarray as xr
+
+MOSAIC_METHOD = os.getenv("MOSAIC_METHOD", "latest")
+MOSAIC_RES_DEG = float(os.getenv("MOSAIC_RES_DEG", "0.05"))
+# bbox grande (overlay CONUS) engrossa a grade para não passar disso por eixo
+MOSAIC_MAX_CELLS_AXIS = int(os.getenv("MOSAIC_MAX_CELLS_AXIS", "1200"))
+MOSAIC_TAU_H = float(os.getenv("MOSAIC_TAU_H", "3"))
+MOSAIC_CHUNK_ROWS = int(os.getenv("MOSAIC_CHUNK_ROWS", "256"))
+MOSAIC_CACHE_MAX = int(os.getenv("MOSAIC_CACHE_MAX", "64"))
+# cache em disco: LRU por mtime (leitura renova) e idade máxima; cada janela nova gera um .npz
+MOSAIC_DISK_MAX_FILES = int(os.getenv("MOSAIC_DISK_MAX_FILES", "256"))
+MOSAIC_DISK_MAX_AGE_S = float(os.getenv("MOSAIC_DISK_MAX_AGE_S", str(7 * 86400)))
+
+_NO2_VARS = ["vertical_column_troposphere", "vertical_column", "no2", "NO2"]
+
+def _open_group(path: str, group: Optional[str]) -> Optional[xr.Dataset]:
+    # cache=False: fatiar a variável lê só o bloco pedido, sem reter o array inteiro
+    for eng in ("netcdf4", "h5netcdf"):
+        try:
+            return xr.open_dataset(path, engine=eng, group=group, cache=False)
+        except Exception:
+            continue
+    return None
+
+def _to_epoch_s(values: np.ndarray) -> Optional[np.ndarray]:
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype("datetime64[ns]").astype(np.int64) / 1e9
+    return None
+
+def _attr_time(ds: Optional[xr.Dataset], path: str) -> float:
+    s = str(ds.attrs.get("time_coverage_start", "")) if ds is not None else ""
+    if s:
+        try:
+            dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
+            return (dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp()
+        except ValueError:
+            pass
+    return os.path.getmtime(path)
+
+class _Granule:
+    """Acesso preguiçoso a um granule L2 (lat/lon 2D) ou L3 (lat/lon 1D)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._dss: List[xr.Dataset] = []
+        product = self._keep(_open_group(path, "product"))
+        if product is None:
+            raise RuntimeError(f"failed to open {path}")
+        vname = next((v for v in _NO2_VARS if v in product.data_vars), None)
+        if vname is None:
+            raise RuntimeError(f"NO2 variable not found in {path}")
+        z = product[vname]
+        # L3 vem como (time=1, latitude, longitude)
+        z = z.isel({d: 0 for d, n in z.sizes.items() if n == 1 and z.ndim > 2})
+        if z.ndim != 2:
+            raise RuntimeError(f"unexpected NO2 shape {z.shape} in {path}")
+        self.z = z
+        self.nrows = int(z.shape[0])
+        root = self._keep(_open_group(path, None))
+        geo = self._keep(_open_group(path, "geolocation"))
+        if geo is not None and "latitude" in geo and "longitude" in geo and geo["latitude"].ndim == 2:
+            self.lat2d, self.lon2d = geo["latitude"], geo["longitude"]
+            self.lat1d = self.lon1d = None
+        elif root is not None and "latitude" in root and "longitude" in root:
+            self.lat2d = self.lon2d = None
+            self.lat1d = np.asarray(root["latitude"].values, dtype=float)
+            self.lon1d = np.asarray(root["longitude"].values, dtype=float)
+        else:
+            raise RuntimeError(f"geolocation not found in {path}")
+        row_t = None
+        if geo is not None and "time" in geo and geo["time"].ndim == 1 and geo["time"].size == self.nrows:
+            row_t = _to_epoch_s(geo["time"].values)
+        self.row_times = row_t if row_t is not None else np.full(self.nrows, _attr_time(root, path))
+
+    def _keep(self, ds: Optional[xr.Dataset]) -> Optional[xr.Dataset]:
+        if ds is not None:
+            self._dss.append(ds)
+        return ds
+
+    def chunk(self, r0: int, r1: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """(lat, lon, no2, t) achatados das linhas [r0, r1)."""
+        z = np.asarray(self.z[r0:r1].values, dtype=float)
+        if self.lat2d is not None:
+            lat = np.asarray(self.lat2d[r0:r1].values, dtype=float)
+            lon = np.asarray(self.lon2d[r0:r1].values, dtype=float)
+        else:
+            lon, lat = np.meshgrid(self.lon1d, self.lat1d[r0:r1])
+        t = np.repeat(self.row_times[r0:r1], z.shape[1])
+        return lat.ravel(), lon.ravel(), z.ravel(), t
+
+    def close(self) -> None:
+        for ds in self._dss:
+            ds.close()
+
+class Mosaic:
+    def __init__(self, values: np.ndarray, bbox: Tuple[float, float, float, float], res: float,
+                 method: str, granules: int, t_latest: Optional[float]):
+        self.values = values
+        self.bbox = bbox
+        self.res = res
+        self.method = method
+        self.granules = granules
+        self.t_latest = t_latest
+        ny, nx = values.shape
+        self.lat = bbox[1] + (np.arange(ny) + 0.5) * res
+        self.lon = bbox[0] + (np.arange(nx) + 0.5) * res
+
+    @property
+    def coverage(self) -> float:
+        return float(np.isfinite(self.values).mean()) if self.values.size else 0.0
+
+    def seed(self) -> float:
+        """Média das células com dado; NaN se o bbox ficou sem cobertura."""
+        if not np.isfinite(self.values).any():
+            return float("nan")
+        return float(np.nanmean(self.values))
+
+    def crop(self, bbox: Tuple[float, float, float, float]) -> "Mosaic":
+        """Recorte às células com centro dentro do bbox (mesma resolução, sem reler granules)."""
+        iy = np.flatnonzero((self.lat >= bbox[1]) & (self.lat <= bbox[3]))
+        ix = np.flatnonzero((self.lon >= bbox[0]) & (self.lon <= bbox[2]))
+        if not iy.size or not ix.size:
+            return Mosaic(np.full((0, 0), np.nan, dtype=np.float32), bbox, self.res, self.method, self.granules, self.t_latest)
+        sub = self.values[iy[0]:iy[-1] + 1, ix[0]:ix[-1] + 1]
+        origin = (float(self.lon[ix[0]] - self.res / 2), float(self.lat[iy[0]] - self.res / 2),
+                  float(self.lon[ix[-1]] + self.res / 2), float(self.lat[iy[-1]] + self.res / 2))
+        return Mosaic(sub, origin, self.res, self.method, self.granules, self.t_latest)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "method": self.method,
+            "res_deg": self.res,
+            "granules": self.granules,
+            "coverage": round(self.coverage, 4),
+            "latest_utc": (datetime.fromtimestamp(self.t_latest, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+                           if self.t_latest is not None else None),
+        }
+
+def grid_res(bbox: Tuple[float, float, float, float], res: float = MOSAIC_RES_DEG,
+             max_cells_axis: int = MOSAIC_MAX_CELLS_AXIS) -> float:
+    span = max(bbox[2] - bbox[0], bbox[3] - bbox[1])
+    return max(res, span / max_cells_axis)
+
+def build_mosaic(
+    files: Sequence[str],
+    bbox: Tuple[float, float, float, float],
+    method: str = MOSAIC_METHOD,
+    res: Optional[float] = None,
+    tau_h: float = MOSAIC_TAU_H,
+    chunk_rows: int = MOSAIC_CHUNK_ROWS,
+) -> Mosaic:
+    if method not in ("latest", "mean"):
+        raise ValueError(f"método de mosaico inválido: {method}")
+    res = grid_res(bbox) if res is None else res
+    lon0, lat0, lon1, lat1 = bbox
+    ny = max(1, int(math.ceil((lat1 - lat0) / res)))
+    nx = max(1, int(math.ceil((lon1 - lon0) / res)))
+    ncell = ny * nx
+
+    granules: List[_Granule] = []
+    for f in files:
+        try:
+            granules.append(_Granule(f))
+        except Exception as e:
+            print(f"[WARN] mosaic: ignorando {Path(f).name} -> {e}")
+    try:
+        if not granules:
+            raise RuntimeError("no readable granules")
+        t_latest = max(float(np.nanmax(g.row_times)) for g in granules)
+        if method == "mean":
+            acc = np.zeros(ncell)
+            wsum = np.zeros(ncell)
+        else:
+            best_t = np.full(ncell, -np.inf)
+            best_v = np.full(ncell, np.nan, dtype=np.float32)
+
+        for g in granules:
+            for r0 in range(0, g.nrows, chunk_rows):
+                lat, lon, z, t = g.chunk(r0, min(r0 + chunk_rows, g.nrows))
+                iy = np.floor((lat - lat0) / res)
+                ix = np.floor((lon - lon0) / res)
+                ok = np.isfinite(z) & (iy >= 0) & (iy < ny) & (ix >= 0) & (ix < nx)
+                if not ok.any():
+                    continue
+                idx = (iy[ok] * nx + ix[ok]).astype(np.int64)
+                z, t = z[ok], t[ok]
+                if method == "mean":
+                    w = np.exp(-(t_latest - t) / (tau_h * 3600.0))
+                    acc += np.bincount(idx, weights=w * z, minlength=ncell)
+                    wsum += np.bincount(idx, weights=w, minlength=ncell)
+                else:
+                    # último pixel (no tempo) de cada célula dentro do bloco, depois compara com a grade
+                    order = np.lexsort((t, idx))
+                    idx_s = idx[order]
+                    last = np.r_[idx_s[1:] != idx_s[:-1], True]
+                    sel = order[last]
+                    cell = idx[sel]
+                    newer = t[sel] >= best_t[cell]
+                    best_t[cell[newer]] = t[sel][newer]
+                    best_v[cell[newer]] = z[sel][newer]
+    finally:
+        for g in granules:
+            g.close()
+
+    if method == "mean":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values = np.where(wsum > 0, acc / wsum, np.nan).astype(np.float32)
+    else:
+        values = best_v
+    return Mosaic(values.reshape(ny, nx), bbox, res, method, len(granules), t_latest)
+
+class MosaicCache:
+    def __init__(self, disk_dir: Optional[Path] = None, max_entries: int = MOSAIC_CACHE_MAX,
+                 disk_max_files: int = MOSAIC_DISK_MAX_FILES, disk_max_age_s: float = MOSAIC_DISK_MAX_AGE_S):
+        self.disk_dir = disk_dir
+        self.max_entries = max_entries
+        self.disk_max_files = disk_max_files
+        self.disk_max_age_s = disk_max_age_s
+        self._mem: "OrderedDict[str, Mosaic]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.builds = 0
+        self.disk_evictions = 0
+
+    @staticmethod
+    def key(files: Sequence[str], bbox: Tuple[float, float, float, float], collection: str,
+            method: str, res: float) -> str:
+        # a janela entra pelo conjunto de granules que ela devolveu (nome + tamanho)
+        parts = sorted(f"{Path(f).name}:{os.path.getsize(f)}" for f in files)
+        raw = "|".join([collection, method, f"{res:.5f}", ",".join(f"{v:.4f}" for v in bbox), *parts])
+        return hashlib.sha1(raw.encode()).hexdigest()[:20]
+
+    def get(self, files: Sequence[str], bbox: Tuple[float, float, float, float], collection: str,
+            method: str = MOSAIC_METHOD, res: Optional[float] = None) -> Mosaic:
+        res = grid_res(bbox) if res is None else res
+        k = self.key(files, bbox, collection, method, res)
+        with self._lock:
+            m = self._mem.get(k)
+            if m is not None:
+                self._mem.move_to_end(k)
+                self.hits += 1
+                return m
+        m = self._load(k, bbox, res, method)
+        if m is not None:
+            with self._lock:
+                self.disk_hits += 1
+        else:
+            m = build_mosaic(files, bbox, method=method, res=res)
+            with self._lock:
+                self.builds += 1
+            self._save(k, m)
+        with self._lock:
+            self._mem[k] = m
+            self._mem.move_to_end(k)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+        return m
+
+    def _path(self, k: str) -> Optional[Path]:
+        return self.disk_dir / f"{k}.npz" if self.disk_dir else None
+
+    def _load(self, k: str, bbox, res: float, method: str) -> Optional[Mosaic]:
+        p = self._path(k)
+        if p is None or not p.exists():
+            return None
+        try:
+            if time.time() - p.stat().st_mtime > self.disk_max_age_s:
+                self._unlink(p)
+                return None
+            os.utime(p)
+            with np.load(p) as npz:
+                t = float(npz["t_latest"])
+                return Mosaic(npz["values"], bbox, res, method, int(npz["granules"]), None if math.isnan(t) else t)
+        except Exception as e:
+            print(f"[WARN] mosaic: cache em disco ilegível {p.name} -> {e}")
+            return None
+
+    def _save(self, k: str, m: Mosaic) -> None:
+        p = self._path(k)
+        if p is None:
+            return
+        try:
+            p.parent.mkdir(parents=True, exist_ok=True)
+            tmp = p.with_suffix(".tmp.npz")
+            np.savez_compressed(tmp, values=m.values, granules=m.granules,
+                                t_latest=np.nan if m.t_latest is None else m.t_latest)
+            os.replace(tmp, p)
+        except Exception as e:
+            print(f"[WARN] mosaic: falha ao gravar {p.name} -> {e}")
+            return
+        self._prune()
+
+    def _unlink(self, p: Path) -> None:
+        try:
+            p.unlink()
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self.disk_evictions += 1
+
+    def _prune(self) -> None:
+        """Apaga os .npz vencidos e, acima de disk_max_files, os menos usados (mtime mais antigo)."""
+        entries = []
+        for p in self.disk_dir.glob("*.npz"):
+            if p.name.endswith(".tmp.npz"):
+                continue
+            try:
+                entries.append((p.stat().st_mtime, p))
+            except FileNotFoundError:
+                continue
+        entries.sort(reverse=True)
+        cutoff = time.time() - self.disk_max_age_s
+        for i, (mtime, p) in enumerate(entries):
+            if i >= self.disk_max_files or mtime < cutoff:
+                self._unlink(p)
+
+    def clear(self, disk: bool = False) -> None:
+        """Esvazia o LRU em memória; com disk=True apaga também os .npz."""
+        with self._lock:
+            self._mem.clear()
+        if disk and self.disk_dir is not None:
+            for p in self.disk_dir.glob("*.npz"):
+                p.unlink(missing_ok=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._mem), "hits": self.hits, "disk_hits": self.disk_hits, "builds": self.builds,
+                    "disk_evictions": self.disk_evictions}
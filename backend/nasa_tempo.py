@@ -1,28 +1,50 @@
 from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Tuple, List, Optional
+from typing import Any, Callable, Tuple, List, Optional
 from datetime import datetime, timezone
+from urllib.parse import urlparse
 import os
+import time
 
 import numpy as np
+import requests
 import xarray as xr
 from dotenv import load_dotenv
 from harmony import Client, Collection, Request, BBox
+from harmony.client import ProcessingFailedException
 from harmony.config import Environment
 
+from upstream import SCHEDULER, UpstreamFailed, remaining_s
+
 COLL_L2_NRT_NO2 = "C3685668972-LARC_CLOUD"
 COLL_L3_NRT_NO2 = "C3685668637-LARC_CLOUD"
 COLL_L2_STD_NO2 = "C2930725014-LARC_CLOUD"
 
+# Quando definido (ex.: servidor local do fake_upstreams.py), fala direto com a
+# API REST OGC Coverages do Harmony nessa base em vez de usar o harmony-py.
+HARMONY_BASE_URL = os.getenv("HARMONY_BASE_URL", "").rstrip("/")
+HARMONY_TIMEOUT_S = float(os.getenv("HARMONY_TIMEOUT_S", "30"))
+HARMONY_POLL_S = float(os.getenv("HARMONY_POLL_S", "0.5"))
+
+_JOB_RUNNING = ("accepted", "running", "running_with_errors", "previewing")
+_JOB_DONE = ("successful", "complete_with_errors")
+
+# o harmony-py não aceita timeout por chamada: cada etapa roda aqui e quem chama espera no máximo `t`
+_HARMONY_PY_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="harmony-py")
+
 def _client(auth: Optional[tuple[str, str]] = None) -> Client:
+    # sem validate_auth no construtor: ela iria ao EDL fora do agendador; credencial
+    # inválida aparece no submit (401). Downloads com o mesmo timeout das outras etapas.
+    kw = dict(env=Environment.PROD, should_validate_auth=False, download_timeout=HARMONY_TIMEOUT_S)
     if auth:
-        return Client(env=Environment.PROD, auth=auth)
+        return Client(auth=auth, **kw)
     load_dotenv()
     user = os.getenv("EDL_USERNAME")
     pwd = os.getenv("EDL_PASSWORD")
     if user and pwd:
-        return Client(env=Environment.PROD, auth=(user, pwd))
-    return Client(env=Environment.PROD)
+        return Client(auth=(user, pwd), **kw)
+    return Client(**kw)
 
 def _to_dt_utc(s: str) -> datetime:
     s = s.strip()
@@ -30,6 +52,97 @@ def _to_dt_utc(s: str) -> datetime:
         s = s[:-1] + "+00:00"
     return datetime.fromisoformat(s).astimezone(timezone.utc)
 
+def _rest_auth() -> Optional[tuple[str, str]]:
+    user = os.getenv("EDL_USERNAME")
+    pwd = os.getenv("EDL_PASSWORD")
+    return (user, pwd) if user and pwd else None
+
+def _download(session: requests.Session, url: str, out_dir: Path) -> str:
+    name = Path(urlparse(url).path).name or "granule.nc"
+    dest = out_dir / name
+    if dest.exists() and dest.stat().st_size > 0:
+        return str(dest)
+    tmp = dest.with_suffix(dest.suffix + ".part")
+    def _get(timeout: float) -> None:
+        with session.get(url, stream=True, timeout=timeout) as r:
+            r.raise_for_status()
+            with open(tmp, "wb") as f:
+                for chunk in r.iter_content(chunk_size=1 << 20):
+                    f.write(chunk)
+    SCHEDULER.fetch("harmony", _get, HARMONY_TIMEOUT_S)
+    os.replace(tmp, dest)
+    return str(dest)
+
+def _rest_submit_and_download(
+    base_url: str,
+    coll_id: str,
+    t_start: datetime,
+    t_end: datetime,
+    bbox: Tuple[float, float, float, float],
+    out_dir: Path,
+    auth: Optional[tuple[str, str]] = None,
+) -> List[str]:
+    session = requests.Session()
+    session.auth = auth or _rest_auth()
+    url = f"{base_url}/{coll_id}/ogc-api-coverages/1.0.0/collections/all/coverage/rangeset"
+    fmt = "%Y-%m-%dT%H:%M:%SZ"
+    params = [
+        ("subset", f"lon({bbox[0]}:{bbox[2]})"),
+        ("subset", f"lat({bbox[1]}:{bbox[3]})"),
+        ("subset", f'time("{t_start.strftime(fmt)}":"{t_end.strftime(fmt)}")'),
+        ("forceAsync", "true"),
+    ]
+    def _get_json(u: str, timeout: float, **kw) -> dict:
+        r = session.get(u, timeout=timeout, **kw)
+        r.raise_for_status()
+        return r.json()
+    job = SCHEDULER.fetch("harmony", lambda t: _get_json(url, t, params=params), HARMONY_TIMEOUT_S)
+    # o polling respeita o prazo do request que pediu (se houver), não só HARMONY_TIMEOUT_S
+    deadline = time.monotonic() + remaining_s(HARMONY_TIMEOUT_S)
+    while job.get("status") in _JOB_RUNNING:
+        if time.monotonic() + HARMONY_POLL_S > deadline:
+            raise TimeoutError(f"Harmony job {job.get('jobID')} não terminou no prazo")
+        time.sleep(HARMONY_POLL_S)
+        job_url = f"{base_url}/jobs/{job['jobID']}"
+        job = SCHEDULER.fetch("harmony", lambda t: _get_json(job_url, t), HARMONY_TIMEOUT_S)
+    if job.get("status") not in _JOB_DONE:
+        raise RuntimeError(f"Harmony job {job.get('jobID')} terminou com status {job.get('status')}")
+    links = [l["href"] for l in job.get("links", []) if l.get("rel") == "data"]
+    return [_download(session, href, out_dir) for href in links]
+
+def _bounded(fn: Callable[[], Any], t: float) -> Any:
+    """fn() do harmony-py esperando no máximo t s; job 'failed' vira UpstreamFailed (conta no breaker)."""
+    try:
+        return _HARMONY_PY_POOL.submit(fn).result(timeout=t)
+    except ProcessingFailedException as e:
+        raise UpstreamFailed(str(e)) from e
+
+def _harmony_py_status(cl: Client, job_id: str) -> str:
+    st = cl.status(job_id)
+    if st.get("status") == "failed":
+        raise UpstreamFailed(f"Harmony job {job_id} falhou: {st.get('message')}")
+    return st.get("status")
+
+def _harmony_py_submit_and_download(cl: Client, coll_id: str, temporal: dict, bbox, out_dir: Path) -> List[str]:
+    # polling próprio em vez de cl.wait_for_processing (sem prazo): cada consulta de status
+    # passa pelo agendador e o laço para no prazo do request, como no caminho REST
+    req = Request(collection=Collection(id=coll_id), temporal=temporal, spatial=BBox(*bbox))
+    job_id = SCHEDULER.fetch("harmony", lambda t: _bounded(lambda: cl.submit(req), t), HARMONY_TIMEOUT_S)
+    deadline = time.monotonic() + remaining_s(HARMONY_TIMEOUT_S)
+    status = SCHEDULER.fetch("harmony", lambda t: _bounded(lambda: _harmony_py_status(cl, job_id), t), HARMONY_TIMEOUT_S)
+    while status in _JOB_RUNNING:
+        if time.monotonic() + HARMONY_POLL_S > deadline:
+            raise TimeoutError(f"Harmony job {job_id} não terminou no prazo")
+        time.sleep(HARMONY_POLL_S)
+        status = SCHEDULER.fetch("harmony", lambda t: _bounded(lambda: _harmony_py_status(cl, job_id), t), HARMONY_TIMEOUT_S)
+    if status not in _JOB_DONE:
+        raise RuntimeError(f"Harmony job {job_id} terminou com status {status}")
+    return SCHEDULER.fetch(
+        "harmony",
+        lambda t: _bounded(lambda: [f.result(timeout=t) for f in cl.download_all(job_id, directory=str(out_dir))], t),
+        HARMONY_TIMEOUT_S,
+    )
+
 def fetch_tempo_no2_by_time_bbox(
     out_dir: Path,
     start_iso: str,
@@ -39,22 +152,20 @@ def fetch_tempo_no2_by_time_bbox(
     auth: Optional[tuple[str, str]] = None,
 ) -> List[str]:
     out_dir.mkdir(parents=True, exist_ok=True)
-    cl = _client(auth)
     t_start = _to_dt_utc(start_iso)
     t_end = _to_dt_utc(end_iso)
-    temporal = {"start": t_start, "end": t_end}
     coll_id = COLL_L3_NRT_NO2 if prefer_l3 else COLL_L2_NRT_NO2
-    req = Request(collection=Collection(id=coll_id), temporal=temporal, spatial=BBox(*bbox))
-    job_id = cl.submit(req)
-    cl.wait_for_processing(job_id, show_progress=False)
-    futures = cl.download_all(job_id, directory=str(out_dir))
-    files = [f.result() for f in futures]
+    if HARMONY_BASE_URL:
+        files = _rest_submit_and_download(HARMONY_BASE_URL, coll_id, t_start, t_end, bbox, out_dir, auth)
+        if not files and prefer_l3:
+            files = _rest_submit_and_download(HARMONY_BASE_URL, COLL_L2_STD_NO2, t_start, t_end, bbox, out_dir, auth)
+        return files
+    # construir o Client não faz chamada de rede: fica fora do agendador (sem token nem vaga no breaker)
+    cl = _client(auth)
+    temporal = {"start": t_start, "end": t_end}
+    files = _harmony_py_submit_and_download(cl, coll_id, temporal, bbox, out_dir)
     if not files and prefer_l3:
-        req2 = Request(collection=Collection(id=COLL_L2_STD_NO2), temporal=temporal, spatial=BBox(*bbox))
-        job2 = cl.submit(req2)
-        cl.wait_for_processing(job2, show_progress=False)
-        futures2 = cl.download_all(job2, directory=str(out_dir))
-        files = [f.result() for f in futures2]
+        files = _harmony_py_submit_and_download(cl, COLL_L2_STD_NO2, temporal, bbox, out_dir)
     return files
 
 def open_no2_dataset(nc_path: str):
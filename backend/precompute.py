@@ -0,0 +1,344 @@
+"""
+Pré-cálculo em lote, offline: roda o pipeline do /forecast (app._assemble_payload)
+para uma lista de locais e grava os resultados em Parquet, nas mesmas tabelas
+do histórico (forecasts + forecast_hours, ver history.py) com uma coluna site_id.
+
+Tudo sai de arquivos locais, sem credenciais nem rede:
+  --sites         CSV/Parquet com lat, lon e (opcional) id/site_id
+  --granules-dir  .nc TEMPO já baixados; o mosaico do bbox que cobre todos os
+                  locais é montado uma vez no processo pai, no cache em disco
+                  do MosaicCache, e cada worker só recorta o bbox de cada local
+  --weather       clima gravado: CSV horário (formato weather_hourly_denver.csv)
+                  ou JSON do /data/2.5/forecast do OpenWeather; um arquivo para
+                  todos os locais ou um diretório com <id>.csv/<id>.json
+                  (default.csv/default.json como reserva)
+  --ground        (opcional) JSON do AQICN /map/bounds para a amostra de solo
+
+Os locais são divididos em shards de --shard-size e distribuídos num pool de
+processos. Cada shard grava suas partes e por último, se nenhum local falhou,
+um marcador em <out>/_shards/; numa nova execução os shards com marcador são
+pulados e os demais (inclusive os com locais em erro) refeitos. O nome do shard
+inclui a impressão digital das entradas (granules, clima, solo) e dos ids do
+shard, então trocar os insumos recalcula em vez de reaproveitar; partes e
+marcadores de shards que não pertencem à execução atual são apagados antes.
+
+    python precompute.py --sites sites.csv --granules-dir ./tempo_data \\
+        --weather weather_hourly_denver.csv --out ./tempo_data/precompute --workers 4
+"""
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from history import FORECASTS_SCHEMA, HOURS_SCHEMA, payload_rows
+from mosaic import Mosaic, MosaicCache, _attr_time, _open_group
+
+PRECOMPUTE_SHARD_SIZE = int(os.getenv("PRECOMPUTE_SHARD_SIZE", "200"))
+# margem do mosaico compartilhado em volta dos locais: o bbox de cada local é ±1.5 lon / ±1.2 lat
+_PAD_LON, _PAD_LAT = 1.5, 1.2
+
+def _with_site(schema: pa.Schema) -> pa.Schema:
+    return schema.insert(0, pa.field("site_id", pa.string()))
+
+TABLES = {"forecasts": _with_site(FORECASTS_SCHEMA), "forecast_hours": _with_site(HOURS_SCHEMA)}
+
+# --- entradas ---
+
+def read_sites(path: Path) -> pd.DataFrame:
+    df = pd.read_parquet(path) if path.suffix.lower() in (".parquet", ".pq") else pd.read_csv(path)
+    cols = {c.lower(): c for c in df.columns}
+    lat = cols.get("lat") or cols.get("latitude")
+    lon = cols.get("lon") or cols.get("lng") or cols.get("longitude")
+    if not lat or not lon:
+        raise ValueError(f"{path.name}: colunas lat/lon não encontradas")
+    sid = cols.get("site_id") or cols.get("id")
+    out = pd.DataFrame({
+        "site_id": df[sid].astype(str) if sid else pd.Series(range(len(df))).astype(str),
+        "lat": pd.to_numeric(df[lat], errors="coerce"),
+        "lon": pd.to_numeric(df[lon], errors="coerce"),
+    })
+    bad = out["lat"].isna() | out["lon"].isna()
+    if bad.any():
+        print(f"[WARN] precompute: {int(bad.sum())} locais sem lat/lon válidos ignorados")
+    return out[~bad].reset_index(drop=True)
+
+def list_granules(granules_dir: Optional[Path]) -> List[str]:
+    if granules_dir is None:
+        return []
+    return sorted(str(p) for p in granules_dir.rglob("*.nc"))
+
+def _granule_window(files: Sequence[str]) -> Tuple[str, str]:
+    times = []
+    for f in files:
+        ds = _open_group(f, None)
+        try:
+            times.append(_attr_time(ds, f))
+        finally:
+            if ds is not None:
+                ds.close()
+    if not times:
+        return "", ""
+    fmt = lambda t: datetime.fromtimestamp(t, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return fmt(min(times)), fmt(max(times))
+
+def _sites_bbox(sites: pd.DataFrame) -> Tuple[float, float, float, float]:
+    return (float(sites["lon"].min()) - _PAD_LON, float(sites["lat"].min()) - _PAD_LAT,
+            float(sites["lon"].max()) + _PAD_LON, float(sites["lat"].max()) + _PAD_LAT)
+
+def _weather_candidates(weather: Path, site_id: str) -> List[Path]:
+    if weather.is_file():
+        return [weather]
+    return [weather / f"{name}.{ext}" for name in (site_id, "default") for ext in ("csv", "json")]
+
+@lru_cache(maxsize=256)
+def load_weather(path: str) -> pd.DataFrame:
+    """Frame horário de um arquivo gravado; memoizado por processo (vários locais costumam dividir o arquivo)."""
+    from weather_openweather import forecast_to_hourly, to_hourly
+    p = Path(path)
+    if p.suffix.lower() == ".json":
+        return forecast_to_hourly(json.loads(p.read_text()))
+    df = pd.read_csv(p)
+    df["datetime_utc"] = pd.to_datetime(df["datetime_utc"], utc=True)
+    # CSV com passos de 3h (só rain_3h/snow_3h) passa pela mesma conversão do fetch ao vivo
+    if "rain_1h_est" not in df.columns or df["datetime_utc"].diff().dropna().gt(pd.Timedelta("1h")).any():
+        df = to_hourly(df)
+    return df
+
+def _fingerprint(paths: Sequence[Path], extra: str = "") -> str:
+    h = hashlib.sha1(extra.encode())
+    for p in paths:
+        for f in ([p] if p.is_file() else sorted(x for x in p.rglob("*") if x.is_file())):
+            st = f.stat()
+            h.update(f"{f.name}:{st.st_size}:{int(st.st_mtime)}".encode())
+    return h.hexdigest()[:12]
+
+# --- worker ---
+
+_W: Dict[str, Any] = {}
+
+def _init_worker(cfg: Dict[str, Any]) -> None:
+    # app só é importado nos workers: é ele que define o pipeline do /forecast
+    import app as app_mod
+    from aqicn_client import parse_bounds_station
+    from ground_stations import GroundLayer
+
+    _W["app"] = app_mod
+    _W["cfg"] = cfg
+    mos = None
+    if cfg["files"]:
+        try:
+            # mesmo cache em disco em que o pai acabou de montar o mosaico: aqui é só leitura do .npz
+            mos = MosaicCache(Path(cfg["mosaic_dir"])).get(cfg["files"], tuple(cfg["bbox"]), cfg["collection"])
+        except Exception as e:
+            print(f"[WARN] precompute: mosaico indisponível no worker -> {type(e).__name__}: {e}")
+    _W["mosaic"] = mos
+    ground = None
+    if cfg["ground"]:
+        js = json.loads(Path(cfg["ground"]).read_text())
+        ground = GroundLayer(max_age_s=float("inf"))
+        ground.load_stations([parse_bounds_station(s) for s in (js.get("data") or [])])
+    _W["ground"] = ground
+
+def _site_seed(lat: float, lon: float) -> Tuple[float, Optional[Dict[str, Any]], bool]:
+    app_mod = _W["app"]
+    mos: Optional[Mosaic] = _W["mosaic"]
+    if mos is not None:
+        sub = mos.crop(app_mod._bbox_default(lat, lon))
+        seed = sub.seed()
+        if np.isfinite(seed):
+            return seed, sub.info(), False
+    return app_mod.NO2_SEED_FALLBACK, None, True
+
+def _issued_at(wx: pd.DataFrame) -> pd.Timestamp:
+    # emissão = primeira hora do clima gravado: lead_h e next_critical_hour ficam relativos à rodada reproduzida
+    if wx.empty:
+        return pd.Timestamp.now(tz="UTC")
+    return pd.Timestamp(wx["datetime_utc"].iloc[0])
+
+def _site_payload(lat: float, lon: float, site_id: str) -> Tuple[pd.Timestamp, Dict[str, Any]]:
+    app_mod = _W["app"]
+    cfg = _W["cfg"]
+    weather = Path(cfg["weather"])
+    path = next((p for p in _weather_candidates(weather, site_id) if p.exists()), None)
+    if path is None:
+        raise FileNotFoundError(f"sem clima gravado para {site_id} em {weather}")
+    wx = load_weather(str(path))
+    seed, info, fallback_used = _site_seed(lat, lon)
+    # offline: só o AQI agregado do /map/bounds, sem os poluentes do feed de cada estação
+    ground = _W["ground"].nearest(lat, lon, pollutants=False) if _W["ground"] is not None else None
+    issued = _issued_at(wx)
+    return issued, app_mod._assemble_payload(
+        lat, lon, wx, seed, ground,
+        files=[] if fallback_used else cfg["files"],
+        start_iso=cfg["start_iso"], end_iso=cfg["end_iso"],
+        bbox_tuple=app_mod._bbox_default(lat, lon),
+        prefer_used=cfg["prefer_l3"], mosaic_info=info, fallback_used=fallback_used, mode="offline",
+        issued=issued,
+    )
+
+def _write_part(path: Path, rows: List[Dict[str, Any]], schema: pa.Schema) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    pq.write_table(pa.Table.from_pylist(rows, schema=schema), tmp, compression="zstd")
+    os.replace(tmp, path)
+
+def run_shard(name: str, sites: List[Tuple[str, float, float]]) -> Dict[str, Any]:
+    out = Path(_W["cfg"]["out"])
+    t0 = time.perf_counter()
+    heads: List[Dict[str, Any]] = []
+    hours: List[Dict[str, Any]] = []
+    errors: List[Dict[str, str]] = []
+    for site_id, lat, lon in sites:
+        try:
+            issued, payload = _site_payload(lat, lon, site_id)
+            head, hrs = payload_rows(payload, issued)
+        except Exception as e:
+            errors.append({"site_id": site_id, "error": f"{type(e).__name__}: {e}"})
+            continue
+        heads.append({"site_id": site_id, **head})
+        hours.extend({"site_id": site_id, **h} for h in hrs)
+    _write_part(out / "forecasts" / f"{name}.parquet", heads, TABLES["forecasts"])
+    _write_part(out / "forecast_hours" / f"{name}.parquet", hours, TABLES["forecast_hours"])
+    summary = {"shard": name, "sites": len(sites), "ok": len(heads), "errors": errors,
+               "seconds": round(time.perf_counter() - t0, 3)}
+    # o marcador vem por último e só sem erros: shard sem marcador é refeito por inteiro na próxima execução
+    if not errors:
+        marker = out / "_shards" / f"{name}.json"
+        marker.parent.mkdir(parents=True, exist_ok=True)
+        marker.write_text(json.dumps(summary))
+    return summary
+
+# --- orquestração ---
+
+_OUTPUT_DIRS = (("forecasts", ".parquet"), ("forecast_hours", ".parquet"), ("_shards", ".json"))
+
+def prune_stale_shards(out: Path, current: Sequence[str]) -> int:
+    """Apaga partes/marcadores de shards fora de `current` (insumos ou locais mudaram) e .tmp de execuções interrompidas."""
+    keep = set(current)
+    removed = 0
+    for sub, ext in _OUTPUT_DIRS:
+        d = out / sub
+        if not d.is_dir():
+            continue
+        for p in d.iterdir():
+            if p.name.startswith("shard-") and (p.suffix == ".tmp" or (p.suffix == ext and p.stem not in keep)):
+                p.unlink(missing_ok=True)
+                removed += 1
+    return removed
+
+def shard_names(sites: pd.DataFrame, shard_size: int, fingerprint: str) -> List[Tuple[str, List[Tuple[str, float, float]]]]:
+    shards = []
+    for i, start in enumerate(range(0, len(sites), shard_size)):
+        part = sites.iloc[start:start + shard_size]
+        rows = [(str(s), float(a), float(b)) for s, a, b in part[["site_id", "lat", "lon"]].itertuples(index=False)]
+        h = hashlib.sha1((fingerprint + "|" + ",".join(f"{s}:{a:.5f}:{b:.5f}" for s, a, b in rows)).encode())
+        shards.append((f"shard-{i:05d}-{h.hexdigest()[:10]}", rows))
+    return shards
+
+def run(
+    sites_path: Path,
+    out: Path,
+    weather: Path,
+    granules_dir: Optional[Path] = None,
+    ground: Optional[Path] = None,
+    workers: int = max(1, (os.cpu_count() or 2) - 1),
+    shard_size: int = PRECOMPUTE_SHARD_SIZE,
+) -> Dict[str, Any]:
+    from nasa_tempo import COLL_L2_NRT_NO2, COLL_L3_NRT_NO2
+
+    t0 = time.perf_counter()
+    sites = read_sites(sites_path)
+    if sites.empty:
+        raise ValueError("nenhum local para calcular")
+    files = list_granules(granules_dir)
+    prefer_l3 = bool(files) and all("L3" in Path(f).name for f in files)
+    collection = COLL_L3_NRT_NO2 if prefer_l3 else COLL_L2_NRT_NO2
+    bbox = _sites_bbox(sites)
+    mosaic_dir = (granules_dir or out) / "mosaics"
+    start_iso, end_iso = _granule_window(files)
+    if files:
+        # monta (ou acha em disco) o mosaico compartilhado antes do fork: os workers só leem o .npz
+        t_m = time.perf_counter()
+        try:
+            mos = MosaicCache(mosaic_dir).get(files, bbox, collection)
+            print(f"mosaico: {len(files)} granules, cobertura {mos.coverage:.1%}, {time.perf_counter() - t_m:.1f}s")
+        except Exception as e:
+            print(f"[WARN] precompute: mosaico -> {type(e).__name__}: {e} (seed de reserva)")
+    inputs = [Path(f) for f in files] + [weather] + ([ground] if ground else [])
+    fp = _fingerprint(inputs, extra=",".join(f"{v:.4f}" for v in bbox))
+    shards = shard_names(sites, shard_size, fp)
+    pruned = prune_stale_shards(out, [n for n, _ in shards])
+    if pruned:
+        print(f"{pruned} arquivos de shards de execuções anteriores (outras entradas) removidos")
+    done = {p.stem for p in (out / "_shards").glob("*.json")} if (out / "_shards").exists() else set()
+    todo = [(n, rows) for n, rows in shards if n not in done]
+    print(f"{len(sites)} locais, {len(shards)} shards ({len(shards) - len(todo)} já prontos), {workers} workers")
+
+    cfg = {
+        "out": str(out), "weather": str(weather), "ground": str(ground) if ground else None,
+        "files": files, "bbox": list(bbox), "collection": collection, "prefer_l3": prefer_l3,
+        "mosaic_dir": str(mosaic_dir), "start_iso": start_iso, "end_iso": end_iso,
+    }
+    out.mkdir(parents=True, exist_ok=True)
+    ok = err = 0
+    failed_shards: List[str] = []
+    incomplete_shards: List[str] = []
+    if todo:
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(todo))), initializer=_init_worker, initargs=(cfg,)) as ex:
+            futs = {ex.submit(run_shard, n, rows): n for n, rows in todo}
+            for fut in as_completed(futs):
+                try:
+                    s = fut.result()
+                except Exception as e:
+                    failed_shards.append(futs[fut])
+                    print(f"[WARN] precompute: {futs[fut]} -> {type(e).__name__}: {e}")
+                    continue
+                ok += s["ok"]
+                err += len(s["errors"])
+                if s["errors"]:
+                    incomplete_shards.append(s["shard"])
+                print(f"{s['shard']}: {s['ok']}/{s['sites']} em {s['seconds']}s")
+    summary = {
+        "sites": len(sites), "shards": len(shards), "skipped_shards": len(shards) - len(todo),
+        "computed_ok": ok, "site_errors": err, "failed_shards": failed_shards,
+        "incomplete_shards": incomplete_shards, "pruned_files": pruned,
+        "seconds": round(time.perf_counter() - t0, 2),
+    }
+    (out / "_run.json").write_text(json.dumps({**summary, "config": {k: v for k, v in cfg.items() if k != "files"},
+                                              "granules": [Path(f).name for f in files]}, indent=2))
+    return summary
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Pré-cálculo offline do /forecast para uma lista de locais (Parquet)")
+    ap.add_argument("--sites", required=True, help="CSV/Parquet com lat, lon e id/site_id")
+    ap.add_argument("--weather", required=True, help="CSV/JSON gravado ou diretório com <id>.csv|json")
+    ap.add_argument("--out", default="./tempo_data/precompute")
+    ap.add_argument("--granules-dir", default=None, help="diretório com os .nc TEMPO (sem ele: seed de reserva)")
+    ap.add_argument("--ground", default=None, help="JSON do AQICN /map/bounds")
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    ap.add_argument("--shard-size", type=int, default=PRECOMPUTE_SHARD_SIZE)
+    args = ap.parse_args(argv)
+
+    summary = run(
+        Path(args.sites), Path(args.out), Path(args.weather),
+        granules_dir=Path(args.granules_dir) if args.granules_dir else None,
+        ground=Path(args.ground) if args.ground else None,
+        workers=args.workers, shard_size=args.shard_size,
+    )
+    print(json.dumps(summary, indent=2))
+    return 1 if summary["failed_shards"] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
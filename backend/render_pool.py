@@ -0,0 +1,264 @@
+"""
+Renderização de PNGs (overlay TEMPO do mosaico, camadas do produto em grade)
+num pool de processos. pcolormesh + encode PNG seguram o GIL, então várias
+requisições de overlay em threads do FastAPI acabam em fila; em processos
+separados a vazão cresce com o número de núcleos.
+
+Os arrays não passam por pickle: o processo da API grava cada um como .npy
+em RENDER_SHM_DIR (tmpfs, /dev/shm por padrão) e o worker abre com
+np.load(mmap_mode="r"). Pelo pipe só vão os caminhos e as opções, e na volta
+os bytes do PNG. Cada job tem prazo (RENDER_TIMEOUT_S, contando a espera por
+um worker livre); o worker que estoura é morto e substituído numa thread à parte,
+sem segurar o request nem afetar os outros.
+
+Os workers usam Figure + FigureCanvasAgg, nunca o estado global do pyplot.
+RENDER_WORKERS=0 renderiza no próprio processo (mesmo código).
+"""
+from __future__ import annotations
+import multiprocessing as mp
+import os
+import queue
+import tempfile
+import threading
+import time
+import uuid
+from io import BytesIO
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) - 1)))))
+RENDER_TIMEOUT_S = float(os.getenv("RENDER_TIMEOUT_S", "20"))
+RENDER_SHM_DIR = Path(os.getenv("RENDER_SHM_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()))
+
+# cmap: nome do matplotlib ou lista de cores (vira ListedColormap no worker)
+CmapSpec = Any
+
+class RenderTimeout(RuntimeError):
+    pass
+
+class RenderError(RuntimeError):
+    pass
+
+# --- desenho (roda no worker, ou no processo da API com RENDER_WORKERS=0) ---
+
+def draw_png(lon: np.ndarray, lat: np.ndarray, z: np.ndarray, bbox: Tuple[float, float, float, float],
+             cmap: CmapSpec = "plasma", vmin: Optional[float] = None, vmax: Optional[float] = None) -> bytes:
+    """pcolormesh transparente, sem eixos, recortado no bbox; lon/lat 1D (grade) ou 2D (swath)."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.colors import ListedColormap
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(7.2, 4.2), dpi=150)
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    ax.set_xlim([bbox[0], bbox[2]])
+    ax.set_ylim([bbox[1], bbox[3]])
+    ax.set_xticks([])
+    ax.set_yticks([])
+    ax.set_facecolor((0, 0, 0, 0))
+    ax.pcolormesh(lon, lat, np.ma.masked_invalid(z), shading="auto",
+                  cmap=ListedColormap(list(cmap)) if isinstance(cmap, (list, tuple)) else cmap, vmin=vmin, vmax=vmax)
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    buf = BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight", pad_inches=0, transparent=True)
+    return buf.getvalue()
+
+def _worker_main(conn: Connection) -> None:
+    # import pesado uma vez por worker, antes do primeiro job
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure  # noqa: F401
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        if job is None:
+            return
+        paths, opts = job
+        try:
+            arrays = {k: np.load(p, mmap_mode="r") for k, p in paths.items()}
+            conn.send((True, draw_png(arrays["lon"], arrays["lat"], arrays["z"], **opts)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+# --- pool ---
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.proc = ctx.Process(target=_worker_main, args=(child,), name="render-worker", daemon=True)
+        self.proc.start()
+        child.close()
+        self.jobs = 0
+
+    def kill(self) -> None:
+        try:
+            self.proc.kill()
+            self.proc.join(timeout=1.0)
+        finally:
+            self.conn.close()
+
+class RenderPool:
+    def __init__(self, workers: int = RENDER_WORKERS, timeout_s: float = RENDER_TIMEOUT_S, shm_dir: Path = RENDER_SHM_DIR):
+        self.workers = workers
+        self.timeout_s = timeout_s
+        self.shm_dir = shm_dir
+        # spawn: o processo da API tem threads (snapshot AQICN, histórico, alertas); fork herdaria locks presos
+        self._ctx = mp.get_context("spawn")
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._all: List[_Worker] = []
+        self._lock = threading.Lock()
+        self._started = False
+        # incrementa a cada stop(): respawn em andamento de um pool parado é descartado
+        self._gen = 0
+        self.jobs = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.respawns = 0
+        self.render_s = 0.0
+
+    def start(self) -> None:
+        with self._lock:
+            if self._started or self.workers <= 0:
+                return
+            self.shm_dir.mkdir(parents=True, exist_ok=True)
+            for _ in range(self.workers):
+                w = _Worker(self._ctx)
+                self._all.append(w)
+                self._idle.put(w)
+            self._started = True
+
+    def stop(self) -> None:
+        with self._lock:
+            workers, self._all = self._all, []
+            self._started = False
+            self._gen += 1
+            self._idle = queue.Queue()
+        for w in workers:
+            try:
+                w.conn.send(None)
+            except Exception:
+                pass
+            w.proc.join(timeout=2.0)
+            if w.proc.is_alive():
+                w.kill()
+
+    def _replace(self, w: _Worker, gen: int) -> None:
+        with self._lock:
+            if w in self._all:
+                self._all.remove(w)
+        # kill/join e o spawn (segundos, com import do matplotlib) fora do lock e fora da thread do request
+        threading.Thread(target=self._respawn, args=(w, gen), name="render-respawn", daemon=True).start()
+
+    def _respawn(self, w: _Worker, gen: int) -> None:
+        w.kill()
+        with self._lock:
+            if not self._started or gen != self._gen:
+                return
+        try:
+            nw = _Worker(self._ctx)
+        except Exception as e:
+            print(f"[WARN] render: falha ao recriar worker -> {type(e).__name__}: {e}")
+            return
+        with self._lock:
+            # stop() entre o spawn e aqui: o worker novo não pertence a este pool
+            keep = self._started and gen == self._gen
+            if keep:
+                self._all.append(nw)
+                self.respawns += 1
+                self._idle.put(nw)
+        if not keep:
+            nw.kill()
+
+    def _share(self, arrays: Dict[str, np.ndarray]) -> Dict[str, str]:
+        paths = {}
+        tag = uuid.uuid4().hex
+        for k, a in arrays.items():
+            p = self.shm_dir / f"render-{tag}-{k}.npy"
+            np.save(p, np.ascontiguousarray(a))
+            paths[k] = str(p)
+        return paths
+
+    def render(self, lon: np.ndarray, lat: np.ndarray, z: np.ndarray, bbox: Tuple[float, float, float, float],
+               cmap: CmapSpec = "plasma", vmin: Optional[float] = None, vmax: Optional[float] = None,
+               timeout_s: Optional[float] = None) -> bytes:
+        """PNG do campo; bloqueia a thread chamadora (use de dentro do threadpool)."""
+        opts = {"bbox": tuple(float(v) for v in bbox), "cmap": cmap,
+                "vmin": None if vmin is None else float(vmin), "vmax": None if vmax is None else float(vmax)}
+        t0 = time.perf_counter()
+        if self.workers <= 0:
+            png = draw_png(lon, lat, z, **opts)
+            with self._lock:
+                self.jobs += 1
+                self.render_s += time.perf_counter() - t0
+            return png
+        self.start()
+        deadline = time.monotonic() + (self.timeout_s if timeout_s is None else timeout_s)
+        paths = self._share({"lon": lon, "lat": lat, "z": z})
+        try:
+            with self._lock:
+                gen, idle = self._gen, self._idle
+            try:
+                w = idle.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                with self._lock:
+                    self.timeouts += 1
+                raise RenderTimeout("no render worker free before the deadline")
+            healthy = False
+            try:
+                w.conn.send((paths, opts))
+                if not w.conn.poll(max(0.0, deadline - time.monotonic())):
+                    with self._lock:
+                        self.timeouts += 1
+                    raise RenderTimeout("render job exceeded its deadline")
+                ok, out = w.conn.recv()
+                healthy = True
+            except (EOFError, OSError, BrokenPipeError) as e:
+                with self._lock:
+                    self.errors += 1
+                raise RenderError(f"render worker died: {type(e).__name__}") from e
+            finally:
+                if healthy:
+                    w.jobs += 1
+                    # stop()/start() durante o job: o worker é do pool antigo, não volta pro _idle novo
+                    with self._lock:
+                        keep = self._started and gen == self._gen
+                        if keep:
+                            self._idle.put(w)
+                    if not keep:
+                        w.kill()
+                else:
+                    # worker travado/morto: mata e põe outro no lugar, os demais seguem
+                    self._replace(w, gen)
+            if not ok:
+                with self._lock:
+                    self.errors += 1
+                raise RenderError(out)
+            with self._lock:
+                self.jobs += 1
+                self.render_s += time.perf_counter() - t0
+            return out
+        finally:
+            for p in paths.values():
+                try:
+                    os.unlink(p)
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "alive": sum(1 for w in self._all if w.proc.is_alive()),
+                "idle": self._idle.qsize(),
+                "jobs": self.jobs,
+                "timeouts": self.timeouts,
+                "errors": self.errors,
+                "respawns": self.respawns,
+                "avg_ms": round(1e3 * self.render_s / self.jobs, 2) if self.jobs else None,
+            }
@@ -0,0 +1,47 @@
+"""Fixtures offline dos testes: as mesmas gravações e granules sintéticos do benchmark."""
+from __future__ import annotations
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import bench_fixtures  # noqa: E402
+
+# granules pequenos: o layout é o do L2, o tamanho não importa para os testes
+SMALL_SHAPE = (48, 64)
+DENVER_BBOX = (-105.5, 39.2, -104.5, 40.2)
+
+@pytest.fixture(scope="session")
+def denver():
+    return bench_fixtures.DENVER
+
+@pytest.fixture(scope="session")
+def denver_bbox():
+    return DENVER_BBOX
+
+@pytest.fixture(scope="session")
+def owm_forecast():
+    return bench_fixtures.load_owm_forecast()
+
+@pytest.fixture(scope="session")
+def aqicn_feed():
+    return bench_fixtures.load_aqicn_feed()
+
+@pytest.fixture(scope="session")
+def aqicn_bounds():
+    return bench_fixtures.load_aqicn_bounds()
+
+@pytest.fixture(scope="session")
+def ground_sample(aqicn_feed):
+    return bench_fixtures.aqicn_feed_to_sample(aqicn_feed)
+
+@pytest.fixture
+def weather_csv():
+    return bench_fixtures.load_weather_csv()
+
+@pytest.fixture(scope="session")
+def granules(tmp_path_factory):
+    out = tmp_path_factory.mktemp("granules")
+    return bench_fixtures.write_synthetic_granules(out, DENVER_BBOX, n=2, shape=SMALL_SHAPE)
@@ -0,0 +1,152 @@
+import asyncio
+import time
+
+import pandas as pd
+
+from alerts import AlertHub, Subscriber, diff_states
+
+def _state(risk="moderate", hours=(("2026-10-19T12:00:00Z", "low"), ("2026-10-19T13:00:00Z", "moderate"))):
+    return {
+        "risk": risk,
+        "ratio_peak_over_seed": 1.1,
+        "next_critical_hour": None,
+        "ground": {"aqi": 40},
+        "validation": {"concordance": "agree"},
+        "hourly_risk": [{"datetime_utc": t, "risk": r} for t, r in hours],
+    }
+
+def test_no_change_is_empty():
+    assert diff_states(_state(), _state()) == {}
+
+def test_changed_fields_only():
+    d = diff_states(_state(), _state(risk="high"))
+    assert d == {"changes": {"risk": "high"}}
+
+def test_hourly_set_and_removed():
+    prev = _state()
+    cur = _state(hours=(("2026-10-19T13:00:00Z", "high"), ("2026-10-19T14:00:00Z", "low")))
+    d = diff_states(prev, cur)
+    assert "changes" not in d
+    assert d["hourly_risk"]["set"] == {"2026-10-19T13:00:00Z": "high", "2026-10-19T14:00:00Z": "low"}
+    assert d["hourly_risk"]["removed"] == ["2026-10-19T12:00:00Z"]
+
+def test_first_state_reports_everything():
+    d = diff_states({}, _state())
+    assert set(d["changes"]) == {"risk", "ratio_peak_over_seed", "ground", "validation"}
+    assert len(d["hourly_risk"]["set"]) == 2
+
+def _hub(weather, calls):
+    def inputs(lat, lon, fetch):
+        calls.append(fetch)
+        wx = weather["df"]
+        if wx is None and fetch:
+            wx = weather["fetched"]
+        return wx, 5e15, None
+    def compute(lat, lon, wx, seed, ground):
+        return {"risk": wx["risk"].iloc[0], "ratio_peak_over_seed": 1.0, "no2_seed": seed, "ground": None,
+                "validation": None, "hourly_risk": [{"datetime_utc": "2026-10-19T12:00:00Z", "risk": wx["risk"].iloc[0]}]}
+    return AlertHub(inputs, compute, lambda hr: None)
+
+def _frame(risk):
+    return pd.DataFrame({"risk": [risk]})
+
+def test_only_first_snapshot_may_fetch():
+    loop = asyncio.new_event_loop()
+    try:
+        calls = []
+        weather = {"df": None, "fetched": _frame("low")}
+        hub = _hub(weather, calls)
+        sub = Subscriber(loop)
+        snap = hub.subscribe(sub, "a", 39.74, -104.99)
+        assert snap["risk"] == "low" and calls == [True]
+        # célula saiu do cache: o tick não busca e mantém o estado
+        hub.tick()
+        assert calls == [True, False] and hub.recomputes == 1 and hub.unchanged == 1
+        weather["df"] = _frame("high")
+        hub.tick()
+        assert hub.recomputes == 2
+        loop.run_until_complete(asyncio.sleep(0))
+        assert sub.queue.get_nowait()["changes"]["risk"] == "high"
+    finally:
+        loop.close()
+
+def test_overflow_marks_dirty_and_resyncs():
+    loop = asyncio.new_event_loop()
+    try:
+        weather = {"df": _frame("low"), "fetched": None}
+        hub = _hub(weather, [])
+        sub = Subscriber(loop)
+        sub.queue = asyncio.Queue(maxsize=1)
+        hub.subscribe(sub, "a", 39.74, -104.99)
+        for risk in ("moderate", "high", "low"):
+            weather["df"] = _frame(risk)
+            hub.tick()
+        loop.run_until_complete(asyncio.sleep(0))
+        assert sub.dirty and sub.dropped == 2
+        assert sub.queue.get_nowait()["changes"]["risk"] == "moderate"
+        snaps = hub.resync(sub)
+        assert not sub.dirty
+        assert [(m["type"], m["id"], m["risk"]) for m in snaps] == [("snapshot", "a", "low")]
+    finally:
+        loop.close()
+
+def test_app_inputs_use_caches_only(weather_csv, monkeypatch):
+    import app
+    monkeypatch.setattr(app, "WX_CACHE", app.WeatherGridCache(shadow_grids=[]))
+    monkeypatch.setattr(app, "_SEEDS", {})
+    monkeypatch.setattr(app.GRID, "current", lambda: None)
+    def no_fetch(lat, lon):
+        raise AssertionError("alert inputs must not go upstream")
+    monkeypatch.setattr(app, "_fetch_weather_hourly", no_fetch)
+    wx, seed, _ = app._alert_inputs(39.74, -104.99)
+    assert wx is None and seed == app.NO2_SEED_FALLBACK
+    app.WX_CACHE.get(39.7392, -104.9903, lambda lat, lon: weather_csv)
+    # seed de um /forecast feito em outro ponto da mesma célula
+    app._remember_seed(39.7392, -104.9903, 7.5e15)
+    wx, seed, _ = app._alert_inputs(39.74, -104.99)
+    assert wx is weather_csv and seed == 7.5e15
+
+def test_ws_rejects_invalid_locations():
+    from fastapi.testclient import TestClient
+    import app
+    with TestClient(app.app).websocket_connect("/ws/alerts") as ws:
+        ws.send_json({"op": "subscribe", "locations": [{"id": "x", "lat": "abc", "lon": 1}, {"lat": 200, "lon": 0}, 5]})
+        errors = [ws.receive_json() for _ in range(3)]
+        assert [e["type"] for e in errors] == ["error"] * 3
+        assert errors[0]["id"] == "x" and "lat" in errors[0]["detail"]
+        assert "less than or equal to 90" in errors[1]["detail"]
+        ws.send_json({"op": "subscribe", "locations": {"id": "y"}})
+        assert ws.receive_json()["detail"] == "locations must be a list"
+
+def test_tick_refreshes_expired_cell(weather_csv, monkeypatch):
+    import app
+    import upstream
+    import weather_cache
+    monkeypatch.setattr(app, "WX_CACHE", app.WeatherGridCache(shadow_grids=[], ttl_s=600))
+    monkeypatch.setattr(app, "_SEEDS", {})
+    monkeypatch.setattr(app.GRID, "current", lambda: None)
+    priorities = []
+    def fetch(lat, lon):
+        priorities.append(upstream.current_priority())
+        return frames.pop(0)
+    later = weather_csv.copy()
+    later["datetime_utc"] = later["datetime_utc"] + pd.Timedelta(hours=6)
+    frames = [weather_csv, later]
+    monkeypatch.setattr(app, "_fetch_weather_hourly", fetch)
+    loop = asyncio.new_event_loop()
+    try:
+        hub = AlertHub(app._alert_inputs, app._alert_compute, lambda hr: None)
+        sub = Subscriber(loop)
+        hub.subscribe(sub, "a", 39.74, -104.99)
+        hub.tick()
+        assert hub.unchanged == 1 and len(priorities) == 1
+        # nenhum /forecast renova a célula: passado o TTL, o próprio tick busca em BACKGROUND
+        now = time.time() + 601
+        monkeypatch.setattr(weather_cache.time, "time", lambda: now)
+        hub.tick()
+        assert priorities[1] == upstream.BACKGROUND and hub.recomputes == 2
+        loop.run_until_complete(asyncio.sleep(0))
+        delta = sub.queue.get_nowait()
+        assert delta["type"] == "delta" and delta["hourly_risk"]["set"]
+    finally:
+        loop.close()
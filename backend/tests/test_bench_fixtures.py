@@ -0,0 +1,20 @@
+import math
+
+import xarray as xr
+
+from nasa_tempo import compute_no2_seed
+
+def test_synthetic_granules_have_l2_layout(granules, denver_bbox):
+    assert len(granules) == 2
+    with xr.open_dataset(granules[0], group="product") as ds:
+        assert "vertical_column_troposphere" in ds.data_vars
+    with xr.open_dataset(granules[0], group="geolocation") as geo:
+        lon, lat = geo["longitude"].values, geo["latitude"].values
+    assert denver_bbox[0] <= lon.mean() <= denver_bbox[2] and denver_bbox[1] <= lat.mean() <= denver_bbox[3]
+    assert math.isfinite(compute_no2_seed(granules[0]))
+
+def test_recorded_payloads(owm_forecast, aqicn_bounds, ground_sample, weather_csv):
+    assert len(owm_forecast["list"]) > 8
+    assert aqicn_bounds["status"] == "ok" and len(aqicn_bounds["data"]) > 10
+    assert ground_sample["aqi"] is not None
+    assert str(weather_csv["datetime_utc"].dt.tz) == "UTC" and len(weather_csv) >= 24
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+import app
+import forecast
+from forecast import RISK_LABELS, ensemble_np, forecast_no2_24h
+from weather_openweather import forecast_to_hourly
+
+SEED = 5e15
+
+@pytest.fixture(params=["owm", "csv"])
+def wx(request, owm_forecast, weather_csv):
+    return forecast_to_hourly(owm_forecast) if request.param == "owm" else weather_csv
+
+def _median_label(probs):
+    acc = 0.0
+    for lab in RISK_LABELS:
+        acc += probs[lab]
+        if acc >= 0.5:
+            return lab
+
+def test_median_label_matches_deterministic(wx):
+    base = forecast_no2_24h(wx, SEED)
+    label, ratio = app._compute_risk(SEED, app.adjust_no2_with_meteo(base, wx))
+    ens = app.build_ensemble(base, wx, SEED)
+    assert _median_label(ens["risk_probabilities"]) == label
+    assert ens["ratio_peak_over_seed"]["p10"] <= ratio <= ens["ratio_peak_over_seed"]["p90"]
+
+def test_seed_spread_does_not_move_risk(wx, monkeypatch):
+    base = forecast_no2_24h(wx, SEED)
+    with_seed = app.build_ensemble(base, wx, SEED)
+    monkeypatch.setattr(forecast, "ENSEMBLE_SEED_SIGMA", 0.0)
+    without = app.build_ensemble(base, wx, SEED)
+    # incerteza do seed alarga os quantis de NO2, não a distribuição do rótulo
+    assert with_seed["risk_probabilities"] == without["risk_probabilities"]
+    spread = lambda e: np.subtract(e["hourly"]["no2_p90"], e["hourly"]["no2_p10"]).mean()
+    assert spread(with_seed) > spread(without)
+
+def test_ensemble_shape_and_determinism(wx):
+    base = forecast_no2_24h(wx, SEED)
+    a = app.build_ensemble(base, wx, SEED, members=50)
+    b = app.build_ensemble(base, wx, SEED, members=50)
+    assert a == b
+    n = len(a["hourly"]["datetime_utc"])
+    assert n == len(base)
+    assert all(len(a["hourly"][k]) == n for k in ("no2_p10", "no2_p50", "no2_p90", "p_high"))
+    assert np.all(np.diff([a["hourly"]["no2_p10"], a["hourly"]["no2_p50"], a["hourly"]["no2_p90"]], axis=0) >= 0)
+    assert sum(a["risk_probabilities"].values()) == pytest.approx(1.0)
+    assert app.build_ensemble(base, wx, SEED, members=1) is None
+
+def test_ensemble_np_seed_factor_has_unit_mean():
+    rng = np.random.default_rng(0)
+    h = 24
+    no2, seed_k = ensemble_np(np.full(h, SEED), np.full(h, 3.0), np.full(h, 40.0), np.zeros(h), 4000, rng)
+    assert no2.shape == (4000, h) and seed_k.shape == (4000, 1)
+    assert seed_k.mean() == pytest.approx(1.0, abs=0.02)
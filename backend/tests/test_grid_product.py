@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from grid_product import _WX_FIELDS, GridProduct, _frame_to_hours, build_grid_product
+
+def _hours(df, n):
+    t0 = int(df["datetime_utc"].iloc[0].timestamp())
+    return t0 + 3600 * np.arange(n, dtype=np.int64)
+
+def test_frame_to_hours_follows_the_frame(weather_csv):
+    times = _hours(weather_csv, 48)
+    wx = _frame_to_hours(weather_csv, times)
+    ref = weather_csv[list(_WX_FIELDS)].to_numpy(dtype=float)[:48]
+    np.testing.assert_allclose(wx, ref)
+    # o frame vem em µs; tratar como ns deixava todo nó constante
+    assert np.ptp(wx[:, _WX_FIELDS.index("temp")]) > 1.0
+    assert np.ptp(wx[:, _WX_FIELDS.index("wind_speed")]) > 1.0
+
+def test_frame_to_hours_clamps_edges(weather_csv):
+    times = _hours(weather_csv, 1)[0] + 3600 * np.array([-2, 0, len(weather_csv) + 5])
+    wx = _frame_to_hours(weather_csv, times)
+    assert np.isfinite(wx).all()
+    np.testing.assert_allclose(wx[0], wx[1])
+
+def test_build_varies_over_time(weather_csv, granules, denver_bbox, tmp_path):
+    start = weather_csv["datetime_utc"].iloc[0].to_pydatetime()
+    out = tmp_path / "grid.npz"
+    meta = build_grid_product(out, lambda lat, lon: weather_csv, granules, seed_fallback=5e15,
+                              bbox=denver_bbox, res=0.25, weather_res=0.5, hours=24, workers=2, start=start)
+    assert meta["weather_nodes_ok"] == meta["weather_nodes"]
+    assert not meta["tempo_fallback"]
+    g = GridProduct(out)
+    no2 = g.fields["no2"]
+    assert no2.shape == (24, 4, 4)
+    assert (np.ptp(no2, axis=0) > 0).all()
+    p = g.point(39.74, -104.99)
+    assert p["forecast"][0]["datetime_utc"] == pd.Timestamp(start).strftime("%Y-%m-%dT%H:%M:%SZ")
+    assert p["ratio_peak_over_seed"] == pytest.approx(max(h["no2_forecast"] for h in p["forecast"]) / p["no2_seed"], rel=1e-5)
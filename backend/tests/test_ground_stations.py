@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from aqicn_client import parse_bounds_station
+from ground_stations import GroundLayer
+
+@pytest.fixture
+def layer(aqicn_bounds):
+    g = GroundLayer(max_age_s=3600)
+    g.load_stations([parse_bounds_station(s) for s in aqicn_bounds["data"]])
+    return g
+
+def _settle(layer):
+    for _ in range(200):
+        if not layer.stats()["station_feed_pending"]:
+            return
+        time.sleep(0.01)
+    pytest.fail("station feed still pending")
+
+def test_pollutants_are_filled_in_background(layer, denver, ground_sample):
+    calls = []
+    release = threading.Event()
+    def feed(uid):
+        calls.append(uid)
+        release.wait(5)
+        return ground_sample
+    layer.fetch_station = feed
+    # feed lento não segura o request: sai com o AQI do snapshot e poluentes vazios
+    t0 = time.monotonic()
+    a = layer.nearest(*denver)
+    assert time.monotonic() - t0 < 0.5
+    assert a["aqi"] is not None and a["no2"] is None
+    layer.nearest(*denver)
+    release.set()
+    _settle(layer)
+    assert len(calls) == 1
+    b = layer.nearest(*denver)
+    for k in ("no2", "o3", "pm25", "pm10"):
+        assert b[k] == ground_sample[k]
+    assert len(calls) == 1
+    # leitura nova da estação: busca o feed de novo
+    uid = calls[0]
+    st = next(s for s in layer._snap.stations if s["uid"] == uid)
+    st["time_local"] = "later"
+    assert layer.nearest(*denver)["no2"] is None
+    _settle(layer)
+    assert calls == [uid, uid]
+
+def test_failed_feed_keeps_aqi_and_backs_off(layer, denver):
+    calls = []
+    def down(uid):
+        calls.append(uid)
+        raise RuntimeError("down")
+    layer.fetch_station = down
+    s = layer.nearest(*denver)
+    _settle(layer)
+    assert s["aqi"] is not None and s["no2"] is None
+    assert layer.nearest(*denver)["no2"] is None
+    _settle(layer)
+    assert len(calls) == 1 and layer.stats()["station_feed_errors"] == 1
+
+def test_without_pollutants_no_fetch(layer, denver):
+    layer.fetch_station = lambda uid: pytest.fail("no feed expected")
+    s = layer.nearest(*denver, pollutants=False)
+    assert s["station"] and s["no2"] is None
+
+def test_out_of_range_and_stale(layer):
+    assert layer.nearest(0.0, 0.0) is None
+    layer.load_stations(layer._snap.stations, fetched_at=time.time() - 7200)
+    assert layer.nearest(39.74, -104.99) is None
+
+def test_forecast_falls_back_to_live_feed(layer, monkeypatch, ground_sample):
+    import app
+    monkeypatch.setattr(app, "GROUND", layer)
+    calls = []
+    def live(lat, lon):
+        calls.append((lat, lon))
+        return dict(ground_sample)
+    monkeypatch.setattr(app, "aqicn_fetch", live)
+    captured = {}
+    def assemble(lat, lon, wx, seed, g, **kw):
+        captured["g"] = g
+        return {}
+    monkeypatch.setattr(app, "_assemble_payload", assemble)
+    monkeypatch.setattr(app, "HISTORY_ENABLED", False)
+    monkeypatch.setattr(app.WX_CACHE, "get", lambda lat, lon, f: pd.DataFrame({"x": [1]}))
+    app._forecast(0.5, 0.5, None, None, None, "auto", False, True)
+    assert calls == [(0.5, 0.5)] and captured["g"]["no2"] == ground_sample["no2"]
+
+def test_failed_region_keeps_previous_stations(monkeypatch):
+    import ground_stations
+    west, east = (30.0, -110.0, 40.0, -100.0), (30.0, -90.0, 40.0, -80.0)
+    up = {west: True, east: True}
+    def fetch(region):
+        if not up[region]:
+            raise RuntimeError("502")
+        return [{"uid": f"{region[1]}", "lat": region[0] + 1, "lon": region[1] + 1, "aqi": 40, "station": str(region)}]
+    monkeypatch.setattr(ground_stations, "_fetch_region", fetch)
+    g = GroundLayer(regions=[west, east], max_age_s=3600)
+    assert g.refresh() == 2
+    up[east] = False
+    # uma região fora não derruba o snapshot: a outra é atualizada e a que falhou mantém as estações
+    assert g.refresh() == 2
+    st = g.stats()
+    assert st["regions_failed"] == 1 and st["region_failures"] == 1 and st["fresh"]
+    assert g.nearest(31.0, -89.0, pollutants=False)["station"] == str(east)
+    up[west] = False
+    with pytest.raises(RuntimeError):
+        g.refresh()
+    assert g.stats()["region_failures"] == 3
@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+import pytest
+
+from history import HistoryStore, payload_rows
+
+def _payload(lat, lon, risk, ground_bucket, concordance, aqi, ratio, raw="same"):
+    t0 = pd.Timestamp("2026-10-19T12:00:00Z")
+    hours = [(t0 + pd.Timedelta(hours=h)).strftime("%Y-%m-%dT%H:%M:%SZ") for h in range(3)]
+    return {
+        "lat": lat,
+        "lon": lon,
+        "no2_seed": 5e15,
+        "risk": risk,
+        "ratio_peak_over_seed": ratio,
+        "tempo": {"fallback_used": False, "collection_id": "C1", "granules": ["a.nc", "b.nc"]},
+        "ground": {"aqi": aqi, "station": "Denver", "station_geo": [39.7, -105.0]},
+        "forecast": [{"datetime_utc": h, "no2_forecast": 5e15, "o3_forecast": 40.0, "pm25_forecast": 8.0} for h in hours],
+        "alerts": {"hourly_risk": [{"datetime_utc": h, "risk": risk} for h in hours], "next_critical_hour": None},
+        "validation": {"ground_bucket": ground_bucket, "model_bucket": risk,
+                       "model_bucket_raw": risk if raw == "same" else raw, "concordance": concordance},
+    }
+
+def test_payload_rows_lead_hours():
+    head, hours = payload_rows(_payload(39.7, -105.0, "high", "high", "agree", 120, 1.3),
+                               pd.Timestamp("2026-10-19T12:00:00Z"))
+    assert head["granules"] == 2 and head["ground_lat"] == 39.7
+    assert [h["lead_h"] for h in hours] == [0, 1, 2]
+    assert all(h["risk"] == "high" for h in hours)
+
+@pytest.fixture
+def store(tmp_path):
+    s = HistoryStore(tmp_path)
+    for p in (
+        _payload(39.7, -105.0, "high", "high", "agree", 160, 1.4),
+        # o ajuste pelo solo subiu o risco servido; o skill julga o bruto
+        _payload(39.8, -104.9, "moderate", "high", "model_lower", 120, 1.1, raw="low"),
+        _payload(39.95, -105.2, "low", "low", "agree", 30, 0.9),
+        _payload(34.0, -118.2, "low", "moderate", "model_lower", 70, 0.95),
+        # gravado antes de model_bucket_raw existir
+        _payload(34.1, -118.3, "high", "high", "agree", 160, 1.3, raw=None),
+    ):
+        s.record(p)
+    assert s.flush() == 5
+    return s
+
+def test_round_trip(store):
+    df = store.query("forecasts")
+    assert len(df) == 5
+    assert set(df["risk"]) == {"high", "moderate", "low"}
+    assert str(df["ts_utc"].dt.tz) == "UTC"
+    hours = store.query("forecast_hours")
+    assert len(hours) == 15
+    denver = store.query("forecasts", bbox=(-106.0, 39.0, -104.0, 41.0))
+    assert len(denver) == 3
+    now = datetime.now(timezone.utc)
+    assert store.query("forecasts", start=now + timedelta(days=1)).empty
+
+def test_skill(store):
+    sk = store.skill()["overall"]
+    assert sk["forecasts"] == 5 and sk["with_ground"] == 4
+    assert sk["agreement_rate"] == pytest.approx(0.5)
+    assert sk["confusion"]["low"]["high"] == 1
+    assert "moderate" not in sk["confusion"]
+    assert sk["high_pod"] == pytest.approx(0.5)
+    assert sk["high_far"] == pytest.approx(0.0)
+    cells = store.skill(group_by="cell", cell_deg=10.0)["groups"]
+    assert sorted(g["forecasts"] for g in cells.values()) == [2, 3]
+
+def test_filter_uses_utc_days(store):
+    now = datetime.now(timezone.utc)
+    # em UTC+14 / UTC-10 a data local de start/end cai em outro dia; a partição é o dia UTC
+    start = (now - timedelta(minutes=5)).astimezone(timezone(timedelta(hours=14)))
+    end = (now + timedelta(minutes=5)).astimezone(timezone(timedelta(hours=-10)))
+    assert len(store.query("forecasts", start=start, end=end)) == 5
+    naive = (now - timedelta(minutes=5)).replace(tzinfo=None)
+    assert len(store.query("forecasts", start=naive)) == 5
+
+def test_compact_merges_parts(tmp_path):
+    s = HistoryStore(tmp_path)
+    for _ in range(2):
+        s.record(_payload(39.7, -105.0, "low", "low", "agree", 30, 0.9))
+        s.flush()
+    day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    assert len(list((tmp_path / "forecasts" / f"date={day}").glob("*.parquet"))) == 2
+    assert s.compact("forecasts", "9999-12-31") == 1
+    assert len(list((tmp_path / "forecasts" / f"date={day}").glob("*.parquet"))) == 1
+    assert len(s.query("forecasts")) == 2
+
+def _two_parts(tmp_path):
+    s = HistoryStore(tmp_path)
+    for _ in range(2):
+        s.record(_payload(39.7, -105.0, "low", "low", "agree", 30, 0.9))
+        s.flush()
+    part = tmp_path / "forecasts" / f"date={datetime.now(timezone.utc).strftime('%Y-%m-%d')}"
+    return s, part
+
+def test_compact_keeps_parts_written_meanwhile(tmp_path, monkeypatch):
+    import history
+    s, part = _two_parts(tmp_path)
+    real = history.pq.read_table
+    def read_then_flush(files, **kw):
+        tbl = real(files, **kw)
+        # outro processo grava na partição enquanto a compactação roda
+        other = HistoryStore(tmp_path)
+        other.record(_payload(39.7, -105.0, "high", "high", "agree", 160, 1.4))
+        other.flush()
+        return tbl
+    monkeypatch.setattr(history.pq, "read_table", read_then_flush)
+    assert s.compact("forecasts", "9999-12-31") == 1
+    monkeypatch.undo()
+    assert len(list(part.glob("*.parquet"))) == 2
+    assert sorted(s.query("forecasts")["risk"]) == ["high", "low", "low"]
+
+def test_interrupted_compact_is_finished(tmp_path, monkeypatch):
+    import history
+    s, part = _two_parts(tmp_path)
+    monkeypatch.setattr(history, "_finish_compact", lambda p: None)
+    s.compact("forecasts", "9999-12-31")
+    monkeypatch.undo()
+    # caiu entre o rename e os unlinks: o compactado convive com os originais até a próxima rodada
+    assert (part / ".compact.json").exists() and len(list(part.glob("*.parquet"))) == 3
+    assert s.compact("forecasts", "9999-12-31") == 0
+    assert not (part / ".compact.json").exists() and len(list(part.glob("*.parquet"))) == 1
+    assert len(s.query("forecasts")) == 2
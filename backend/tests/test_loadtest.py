@@ -0,0 +1,21 @@
+import math
+
+import pytest
+
+import loadtest
+from benchmark import percentile
+
+def test_percentile_interpolates():
+    xs = [4.0, 1.0, 3.0, 2.0]
+    assert percentile(xs, 0.0) == 1.0 and percentile(xs, 1.0) == 4.0
+    assert percentile(xs, 0.5) == pytest.approx(2.5)
+    assert math.isnan(percentile([], 0.5))
+
+def test_dead_workers_are_reported(monkeypatch):
+    def broken(rng):
+        raise KeyError("lat")
+    monkeypatch.setitem(loadtest.SCENARIOS, "broken", broken)
+    rep = loadtest.run("http://127.0.0.1:9", {"broken": 1.0}, concurrency=3, duration_s=0.2, timeout_s=0.1, seed=1)
+    assert len(rep["worker_errors"]) == 3
+    assert rep["worker_errors"][0] == "worker 0: KeyError: 'lat'"
+    assert rep["total"]["requests"] == 0
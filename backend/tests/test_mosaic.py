@@ -0,0 +1,79 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from mosaic import MosaicCache, build_mosaic
+
+RES = 0.05
+
+def test_latest_keeps_newest_granule(granules, denver_bbox):
+    both = build_mosaic(granules, denver_bbox, method="latest", res=RES)
+    newest = build_mosaic(granules[-1:], denver_bbox, method="latest", res=RES)
+    assert both.values.shape == (20, 20)
+    assert both.granules == 2
+    ok = np.isfinite(newest.values)
+    assert ok.any()
+    np.testing.assert_array_equal(both.values[ok], newest.values[ok])
+    # células sem dado no mais novo vêm do anterior
+    assert np.isfinite(both.values).sum() >= ok.sum()
+
+def test_mean_stays_within_granule_range(granules, denver_bbox):
+    latest = [build_mosaic([f], denver_bbox, method="latest", res=RES).values for f in granules]
+    mean = build_mosaic(granules, denver_bbox, method="mean", res=RES)
+    assert mean.method == "mean"
+    assert np.isfinite(mean.values).sum() >= np.isfinite(latest[-1]).sum()
+    assert 1e15 < mean.seed() < 1e17
+    assert mean.coverage > 0.5
+
+def test_crop_keeps_resolution(granules, denver_bbox):
+    m = build_mosaic(granules, denver_bbox, method="latest", res=RES)
+    sub = m.crop((-105.0, 39.7, -104.8, 39.9))
+    assert sub.res == m.res
+    assert sub.values.shape == (4, 4)
+    np.testing.assert_allclose(sub.lat, m.lat[10:14])
+
+def test_invalid_method(granules, denver_bbox):
+    with pytest.raises(ValueError):
+        build_mosaic(granules, denver_bbox, method="median")
+
+def test_cache_memory_and_disk(granules, denver_bbox, tmp_path):
+    cache = MosaicCache(tmp_path)
+    a = cache.get(granules, denver_bbox, "C1", method="latest", res=RES)
+    assert cache.get(granules, denver_bbox, "C1", method="latest", res=RES) is a
+    assert len(list(tmp_path.glob("*.npz"))) == 1
+    cache.clear()
+    b = cache.get(granules, denver_bbox, "C1", method="latest", res=RES)
+    np.testing.assert_array_equal(a.values, b.values)
+    assert b.t_latest == pytest.approx(a.t_latest)
+    assert cache.stats() == {"entries": 1, "hits": 1, "disk_hits": 1, "builds": 1, "disk_evictions": 0}
+    cache.clear(disk=True)
+    assert not list(tmp_path.glob("*.npz"))
+    cache.get(granules, denver_bbox, "C1", method="latest", res=RES)
+    assert cache.stats()["builds"] == 2
+
+def test_disk_cache_is_bounded(granules, denver_bbox, tmp_path):
+    cache = MosaicCache(tmp_path, disk_max_files=2)
+    for res in (0.05, 0.1):
+        cache.get(granules, denver_bbox, "C1", method="latest", res=res)
+    first = tmp_path / f"{cache.key(granules, denver_bbox, 'C1', 'latest', 0.05)}.npz"
+    os.utime(first, (time.time() - 60, time.time() - 60))
+    # leitura do disco renova o mtime: o menos usado passa a ser o de res 0.1
+    cache.clear()
+    cache.get(granules, denver_bbox, "C1", method="latest", res=0.05)
+    assert time.time() - first.stat().st_mtime < 30
+    cache.get(granules, denver_bbox, "C1", method="latest", res=0.2)
+    names = {p.name for p in tmp_path.glob("*.npz")}
+    assert len(names) == 2 and first.name in names
+    assert cache.stats()["disk_evictions"] == 1
+
+def test_disk_cache_expires_old_files(granules, denver_bbox, tmp_path):
+    cache = MosaicCache(tmp_path, disk_max_age_s=3600)
+    cache.get(granules, denver_bbox, "C1", method="latest", res=RES)
+    (p,) = tmp_path.glob("*.npz")
+    os.utime(p, (time.time() - 7200, time.time() - 7200))
+    cache.clear()
+    cache.get(granules, denver_bbox, "C1", method="latest", res=RES)
+    assert cache.stats()["builds"] == 2 and cache.stats()["disk_hits"] == 0
+    assert time.time() - p.stat().st_mtime < 30
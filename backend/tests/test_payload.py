@@ -0,0 +1,27 @@
+import pandas as pd
+
+import app
+
+HOURS = [{"datetime_utc": "2026-01-10T0%d:00:00Z" % h, "risk": r} for h, r in enumerate(("low", "high", "moderate", "high"))]
+
+def test_next_critical_hour_uses_reference_time():
+    assert app.next_critical_hour(HOURS, pd.Timestamp("2026-01-10T00:30:00Z")) == "2026-01-10T01:00:00Z"
+    assert app.next_critical_hour(HOURS, pd.Timestamp("2026-01-10T02:00:00")) == "2026-01-10T03:00:00Z"
+    # sem referência vale o relógio: horas de janeiro de 2026 já passaram
+    assert app.next_critical_hour(HOURS) is None
+
+def _payload(wx, **kw):
+    return app._assemble_payload(
+        39.74, -104.99, wx, 5e15, None, files=[], start_iso="", end_iso="",
+        bbox_tuple=app._bbox_default(39.74, -104.99), prefer_used=True, mosaic_info=None,
+        fallback_used=True, mode="offline", **kw,
+    )
+
+def test_replay_finds_critical_hour_from_issue_time(weather_csv, monkeypatch):
+    real = app.build_hourly_risk
+    monkeypatch.setattr(app, "build_hourly_risk", lambda seed, fc: [{**r, "risk": "high"} for r in real(seed, fc)])
+    issued = pd.Timestamp(weather_csv["datetime_utc"].iloc[2])
+    payload = _payload(weather_csv, issued=issued)
+    assert payload["alerts"]["next_critical_hour"] == issued.strftime("%Y-%m-%dT%H:%M:%SZ")
+    # clima gravado está no passado: contra o relógio nenhuma hora seria crítica
+    assert _payload(weather_csv)["alerts"]["next_critical_hour"] is None
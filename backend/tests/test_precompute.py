@@ -0,0 +1,65 @@
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+import bench_fixtures
+import precompute
+
+SITES = [("den", 39.7392, -104.9903), ("bou", 40.0150, -105.2705)]
+
+@pytest.fixture
+def inputs(tmp_path, granules):
+    sites = tmp_path / "sites.csv"
+    pd.DataFrame(SITES, columns=["id", "latitude", "lng"]).to_csv(sites, index=False)
+    weather = tmp_path / "weather"
+    weather.mkdir()
+    shutil.copy(bench_fixtures.WEATHER_CSV, weather / "default.csv")
+    gran = tmp_path / "granules"
+    gran.mkdir()
+    for f in granules:
+        shutil.copy(f, gran)
+    return {"sites_path": sites, "weather": weather, "granules_dir": gran,
+            "ground": bench_fixtures.FIXTURES_DIR / "aqicn_bounds_conus.json"}
+
+def _parts(out, table):
+    return sorted(p.name for p in (out / table).glob("*.parquet"))
+
+def test_read_sites_normalizes_columns(inputs):
+    df = precompute.read_sites(inputs["sites_path"])
+    assert list(df.columns) == ["site_id", "lat", "lon"] and list(df["site_id"]) == ["den", "bou"]
+
+def test_rerun_skips_done_shards_and_replaces_stale_ones(inputs, tmp_path):
+    out = tmp_path / "out"
+    first = precompute.run(out=out, workers=1, **inputs)
+    assert first["computed_ok"] == 2 and first["skipped_shards"] == 0 and not first["incomplete_shards"]
+    df = pd.read_parquet(out / "forecasts")
+    assert sorted(df["site_id"]) == ["bou", "den"]
+    assert df["ground_station"].notna().all()
+    hours = pd.read_parquet(out / "forecast_hours")
+    assert hours.groupby("site_id")["lead_h"].min().eq(0).all()
+
+    again = precompute.run(out=out, workers=1, **inputs)
+    assert again["skipped_shards"] == 1 and again["computed_ok"] == 0
+    assert len(pd.read_parquet(out / "forecasts")) == 2
+
+    # clima novo muda a impressão digital: as partes antigas saem, sem linhas duplicadas
+    old = _parts(out, "forecasts")
+    w = pd.read_csv(inputs["weather"] / "default.csv").iloc[:48]
+    w.to_csv(inputs["weather"] / "default.csv", index=False)
+    third = precompute.run(out=out, workers=1, **inputs)
+    assert third["pruned_files"] == 3 and third["skipped_shards"] == 0
+    assert _parts(out, "forecasts") != old and len(_parts(out, "forecasts")) == 1
+    assert len(pd.read_parquet(out / "forecasts")) == 2
+    assert len(list((out / "_shards").glob("*.json"))) == 1
+
+def test_shard_with_site_errors_is_retried(inputs, tmp_path):
+    out = tmp_path / "out"
+    (inputs["weather"] / "default.csv").rename(inputs["weather"] / "den.csv")
+    first = precompute.run(out=out, workers=1, **inputs)
+    assert first["site_errors"] == 1 and len(first["incomplete_shards"]) == 1
+    assert not list((out / "_shards").glob("*.json"))
+    again = precompute.run(out=out, workers=1, **inputs)
+    assert again["skipped_shards"] == 0 and again["computed_ok"] == 1
+    assert list(pd.read_parquet(out / "forecasts")["site_id"]) == ["den"]
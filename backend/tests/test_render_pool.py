@@ -0,0 +1,94 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+import render_pool
+from render_pool import RenderError, RenderPool, RenderTimeout
+
+def _field():
+    lon = np.linspace(-105.5, -104.5, 8)
+    lat = np.linspace(39.2, 40.2, 6)
+    return lon, lat, np.arange(48, dtype=float).reshape(6, 8)
+
+class _SlowWorker(render_pool._Worker):
+    def __init__(self, ctx):
+        time.sleep(1.0)
+        super().__init__(ctx)
+
+def test_timed_out_worker_is_replaced_off_the_request_thread(tmp_path, monkeypatch):
+    pool = RenderPool(workers=1, timeout_s=0.001, shm_dir=tmp_path)
+    try:
+        pool.start()
+        # spawn lento (host carregado): não pode segurar o request nem o lock
+        monkeypatch.setattr(render_pool, "_Worker", _SlowWorker)
+        lon, lat, z = _field()
+        t0 = time.monotonic()
+        with pytest.raises(RenderTimeout):
+            pool.render(lon, lat, z, (-105.5, 39.2, -104.5, 40.2))
+        # kill + spawn do substituto não contam no tempo do request
+        assert time.monotonic() - t0 < 0.5
+        assert pool.stats()["workers"] == 1
+        for _ in range(200):
+            if pool.stats()["respawns"] == 1 and pool.stats()["idle"] == 1:
+                break
+            time.sleep(0.05)
+        st = pool.stats()
+        assert st["respawns"] == 1 and st["alive"] == 1 and st["idle"] == 1
+        assert pool.render(lon, lat, z, (-105.5, 39.2, -104.5, 40.2), timeout_s=30.0)[:8] == b"\x89PNG\r\n\x1a\n"
+    finally:
+        pool.stop()
+
+def _slow_draw(*args, **kwargs):
+    time.sleep(1.0)
+    return b"png"
+
+def test_worker_busy_across_restart_does_not_rejoin_new_pool(tmp_path, monkeypatch):
+    # o fork herda o draw_png lento: o job segura o worker enquanto o pool reinicia
+    monkeypatch.setattr(render_pool, "draw_png", _slow_draw)
+    pool = RenderPool(workers=1, timeout_s=30.0, shm_dir=tmp_path)
+    try:
+        pool.start()
+        old = list(pool._all)
+        lon, lat, z = _field()
+        th = threading.Thread(target=pool.render, args=(lon, lat, z, (-105.5, 39.2, -104.5, 40.2)))
+        th.start()
+        time.sleep(0.3)
+        pool.stop()
+        pool.start()
+        th.join(timeout=10.0)
+        st = pool.stats()
+        assert st["workers"] == 1 and st["idle"] == 1
+        assert old[0] not in list(pool._idle.queue)
+        assert not old[0].proc.is_alive()
+    finally:
+        pool.stop()
+
+def _render_fails(*args, **kwargs):
+    raise RenderError("ValueError: bad field")
+
+def test_grid_layer_maps_render_error_to_503(monkeypatch):
+    lon, lat, z = _field()
+    prod = SimpleNamespace(times=np.zeros(1), png={}, fields={"no2": z[None]}, seed=z, lon=lon, lat=lat,
+                           bbox=(-105.5, 39.2, -104.5, 40.2), layer=lambda field, hour: z)
+    monkeypatch.setattr(app.GRID, "current", lambda: prod)
+    monkeypatch.setattr(app, "_render_grid_png", _render_fails)
+    r = TestClient(app.app).get("/grid/layer.png", params={"field": "no2"})
+    assert r.status_code == 503 and "render failed" in r.json()["detail"]
+
+def test_overlay_maps_render_error_to_503(monkeypatch, granules, tmp_path):
+    calls = []
+    def fetch(*args, **kwargs):
+        calls.append(kwargs["prefer_l3"])
+        return granules
+    monkeypatch.setattr(app, "fetch_tempo_no2_by_time_bbox", fetch)
+    monkeypatch.setattr(app, "MOSAICS", app.MosaicCache(tmp_path))
+    monkeypatch.setattr(app, "_render_grid_png", _render_fails)
+    r = TestClient(app.app).get("/tempo/latest_overlay.png", params={"bbox": "-105.5,39.2,-104.5,40.2", "hours": 3})
+    assert r.status_code == 503 and "render failed" in r.json()["detail"]
+    # a outra coleção não é tentada: o erro é do render, não dos granules
+    assert calls == [True]
@@ -0,0 +1,108 @@
+import time
+
+import pytest
+import requests
+
+from upstream import (
+    BACKGROUND, CircuitBreaker, TokenBucket, UpstreamDropped, UpstreamFailed, UpstreamScheduler, UpstreamUnavailable,
+    request_context,
+)
+
+def test_bucket_refill_is_capped_at_burst():
+    b = TokenBucket(rate=2.0, burst=4.0)
+    b.tokens = 0.0
+    b.refill(b.updated + 1.0)
+    assert b.tokens == pytest.approx(2.0)
+    b.refill(b.updated + 10.0)
+    assert b.tokens == 4.0
+
+def test_bucket_wait_for_respects_reserve():
+    b = TokenBucket(rate=2.0, burst=10.0)
+    b.tokens = 3.0
+    assert b.wait_for(0.0) == 0.0
+    # reserva de 5 tokens: faltam 3 para sobrar 1 acima dela
+    assert b.wait_for(5.0) == pytest.approx(1.5)
+
+def test_breaker_opens_after_threshold_and_probes_once():
+    br = CircuitBreaker(failures=2, open_s=0.05)
+    br.failure()
+    assert br.allow()
+    br.failure()
+    assert br.state == CircuitBreaker.OPEN and not br.allow()
+    time.sleep(0.06)
+    assert br.allow()
+    assert br.state == CircuitBreaker.HALF_OPEN
+    assert not br.allow()
+    br.success()
+    assert br.state == CircuitBreaker.CLOSED and br.trips == 1
+
+def test_fetch_fails_fast_when_breaker_open():
+    s = UpstreamScheduler(limits={"x": (1000.0, 1000.0)}, hedges={})
+    calls = []
+    def boom(timeout):
+        calls.append(timeout)
+        raise requests.ConnectionError("down")
+    for _ in range(5):
+        with pytest.raises(requests.ConnectionError):
+            s.fetch("x", boom, 1.0)
+    with pytest.raises(UpstreamUnavailable):
+        s.fetch("x", boom, 1.0)
+    assert len(calls) == 5
+    assert s.stats()["x"]["breaker"]["fast_failed"] == 1
+
+def test_client_errors_do_not_trip_breaker():
+    s = UpstreamScheduler(limits={"x": (1000.0, 1000.0)}, hedges={})
+    def bad(timeout):
+        raise ValueError("bad input")
+    for _ in range(10):
+        with pytest.raises(ValueError):
+            s.fetch("x", bad, 1.0)
+    assert s.stats()["x"]["breaker"]["state"] == CircuitBreaker.CLOSED
+
+def test_fetch_timeout_is_bounded_by_request_deadline():
+    s = UpstreamScheduler(limits={"x": (1000.0, 1000.0)}, hedges={})
+    with request_context(deadline_s=0.5):
+        t = s.fetch("x", lambda timeout: timeout, 30.0)
+    assert 0 < t <= 0.5
+
+def test_queue_drops_when_deadline_passes():
+    s = UpstreamScheduler(limits={"x": (0.01, 1.0)}, hedges={})
+    s.fetch("x", lambda timeout: None, 1.0)
+    with request_context(priority=BACKGROUND, deadline_s=0.05):
+        with pytest.raises(UpstreamDropped):
+            s.fetch("x", lambda timeout: None, 1.0)
+    assert s.stats()["x"]["dropped"]["background"] == 1
+
+def test_failed_upstream_job_trips_breaker():
+    s = UpstreamScheduler(limits={"x": (1000.0, 1000.0)}, hedges={})
+    def failed(timeout):
+        raise UpstreamFailed("job failed")
+    for _ in range(5):
+        with pytest.raises(UpstreamFailed):
+            s.fetch("x", failed, 1.0)
+    assert s.stats()["x"]["breaker"]["state"] == CircuitBreaker.OPEN
+
+def test_deadline_spent_in_queue_releases_half_open_probe():
+    s = UpstreamScheduler(limits={"x": (1000.0, 1000.0)}, hedges={})
+    br = s._provider("x").breaker
+    br.state, br.opened_at = CircuitBreaker.OPEN, time.monotonic() - br.open_s
+    # token concedido só depois do prazo do request
+    s.acquire = lambda provider: time.sleep(0.05)
+    with request_context(deadline_s=0.01):
+        with pytest.raises(UpstreamDropped):
+            s.fetch("x", lambda timeout: None, 1.0)
+    assert br.state == CircuitBreaker.HALF_OPEN and not br.probing
+    del s.acquire
+    assert s.fetch("x", lambda timeout: "ok", 1.0) == "ok"
+    assert br.state == CircuitBreaker.CLOSED
+
+def test_default_openweather_quota_covers_a_cold_states_summary():
+    import app
+    from upstream import BATCH, UPSTREAM_LIMITS, parse_limits
+    s = UpstreamScheduler(limits=parse_limits(UPSTREAM_LIMITS), hedges={})
+    now_ok = 0
+    while s.try_acquire("openweather", priority=BATCH):
+        now_ok += 1
+    rate = s.stats()["openweather"]["rate_per_s"]
+    # um /states/summary frio é uma chamada OpenWeather por estado, em BATCH, dentro de FORECAST_DEADLINE_S
+    assert now_ok + rate * app.FORECAST_DEADLINE_S >= len(app.US_STATES_CENTROIDS)
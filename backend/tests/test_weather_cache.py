@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from weather_cache import WeatherGridCache, cell_of, geohash_center, geohash_encode
+
+def test_cells_share_center():
+    a = cell_of(39.74, -104.99, "0.25")
+    b = cell_of(39.70, -104.80, "0.25")
+    assert a == b
+    gh = geohash_encode(39.7392, -104.9903, 5)
+    lat, lon = geohash_center(gh)
+    assert abs(lat - 39.7392) < 0.03 and abs(lon + 104.9903) < 0.03
+
+def test_concurrent_misses_fetch_once(weather_csv):
+    cache = WeatherGridCache(grid="0.25", shadow_grids=[])
+    calls = []
+    gate = threading.Event()
+    def fetch(lat, lon):
+        calls.append((lat, lon))
+        gate.wait(1.0)
+        return weather_csv
+    out = []
+    threads = [threading.Thread(target=lambda: out.append(cache.get(39.74, -104.99, fetch))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    gate.set()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert len(out) == 8 and all(df is weather_csv for df in out)
+    st = cache.stats()
+    assert st["fetches"] == 1 and st["cells"] == 1
+
+def test_stale_frame_served_when_fetch_fails(weather_csv):
+    cache = WeatherGridCache(grid="0.25", ttl_s=0.01, serve_stale_s=60, shadow_grids=[])
+    assert cache.get(39.74, -104.99, lambda lat, lon: weather_csv) is weather_csv
+    time.sleep(0.02)
+    def down(lat, lon):
+        raise RuntimeError("upstream down")
+    assert cache.get(39.74, -104.99, down) is weather_csv
+    assert cache.stats()["stale_served"] == 1
+    cache.clear()
+    with pytest.raises(RuntimeError):
+        cache.get(39.74, -104.99, down)
+
+def test_shadow_grid_hit_rate():
+    cache = WeatherGridCache(grid="0.25", shadow_grids=["0.5"])
+    frame = pd.DataFrame()
+    cache.get(39.74, -104.99, lambda lat, lon: frame)
+    cache.get(39.90, -104.60, lambda lat, lon: frame)
+    by = cache.stats()["by_grid"]
+    assert by["0.5"]["hits"] == 1
+    assert by["0.25"]["misses"] == 2
+
+@pytest.mark.parametrize("has_stale", [True, False])
+def test_follower_waits_only_its_own_deadline(weather_csv, has_stale):
+    from upstream import BACKGROUND, request_context
+    cache = WeatherGridCache(grid="0.25", ttl_s=0.01, serve_stale_s=60, shadow_grids=[])
+    old = weather_csv.iloc[:10]
+    if has_stale:
+        cache.get(39.74, -104.99, lambda lat, lon: old)
+        time.sleep(0.02)
+    gate = threading.Event()
+    def stuck(lat, lon):
+        gate.wait(5.0)
+        return weather_csv
+    def leader():
+        with request_context(priority=BACKGROUND):
+            cache.get(39.74, -104.99, stuck)
+    t = threading.Thread(target=leader)
+    t.start()
+    time.sleep(0.05)
+    try:
+        # /forecast interativo não herda a espera do líder de fundo
+        t0 = time.monotonic()
+        with request_context(deadline_s=0.1):
+            df = cache.get(39.74, -104.99, lambda lat, lon: weather_csv.iloc[:5])
+        assert time.monotonic() - t0 < 1.0
+        assert len(df) == (10 if has_stale else 5)
+        assert cache.stats()["follower_timeouts"] == 1
+    finally:
+        gate.set()
+        t.join()
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from weather_openweather import (
+    HOURLY_FIELDS, forecast_to_arrays, forecast_to_df, forecast_to_hourly, interp_hours, stack_hourly, to_hourly,
+)
+
+def test_forecast_to_hourly_matches_pandas_path(owm_forecast):
+    fast = forecast_to_hourly(owm_forecast)
+    ref = to_hourly(forecast_to_df(owm_forecast))
+    pd.testing.assert_frame_equal(fast, ref)
+    assert list(fast.columns) == ["datetime_utc", *HOURLY_FIELDS]
+    assert (fast["datetime_utc"].diff().dropna() == pd.Timedelta(hours=1)).all()
+
+def test_interp_hours_clamp():
+    t = np.array([0.0, 3600.0 * 3])
+    X = np.array([[0.0], [3.0]])
+    out = interp_hours(t, X, np.array([-3600.0, 3600.0, 3600.0 * 5]), clamp=True)
+    np.testing.assert_allclose(out[:, 0], [0.0, 1.0, 3.0])
+    # sem clamp: NaN antes do primeiro slot, constante depois do último
+    out = interp_hours(t, X, np.array([-3600.0, 3600.0 * 5]))
+    assert np.isnan(out[0, 0]) and out[1, 0] == 3.0
+
+def test_interp_hours_repeated_and_unsorted_times(owm_forecast):
+    t = np.array([3600.0 * 3, 0.0, 3600.0 * 3, 3600.0 * 6])
+    X = np.array([[2.0, np.nan], [0.0, 1.0], [3.0, 4.0], [6.0, 7.0]])
+    out = interp_hours(t, X, 3600.0 * np.arange(7))
+    assert np.isfinite(out).all()
+    # no instante repetido vale a última leitura
+    np.testing.assert_allclose(out[:, 0], [0, 1, 2, 3, 4, 5, 6])
+    np.testing.assert_allclose(out[:, 1], [1, 2, 3, 4, 5, 6, 7])
+    js = {"list": owm_forecast["list"][:4] + owm_forecast["list"][3:]}
+    assert np.isfinite(forecast_to_hourly(js)[["temp", "humidity", "pressure"]].to_numpy()).all()
+    assert forecast_to_hourly(js).equals(forecast_to_hourly(owm_forecast))
+
+def test_stack_hourly_shares_time_axis(owm_forecast):
+    t, _ = forecast_to_arrays(owm_forecast)
+    t_out = np.arange(t[0], t[0] + 24 * 3600, 3600, dtype=float)
+    t_h, A = stack_hourly([owm_forecast, None], t_out=t_out)
+    assert A.shape == (2, 24, len(HOURLY_FIELDS))
+    np.testing.assert_allclose(A[0], forecast_to_hourly(owm_forecast)[list(HOURLY_FIELDS)].to_numpy()[:24])
+    assert np.isnan(A[1]).all()
@@ -0,0 +1,386 @@
+"""
+Agendador central das chamadas externas (OpenWeather, AQICN, Harmony).
+
+Cada provedor tem um token bucket (taxa/burst) e uma fila por prioridade:
+INTERACTIVE (/forecast do usuário) > BATCH (mapa, /states/summary) >
+BACKGROUND (prefetch, snapshots). Quem está na fila espera o próprio token na
+ordem de prioridade; se o prazo vence antes, a chamada é descartada com
+UpstreamDropped em vez de ser disparada atrasada. Prioridades mais baixas não
+conseguem consumir a reserva do bucket, que fica para o tráfego interativo.
+
+Cada provedor também tem um circuit breaker (fechado/aberto/meio-aberto): com o
+upstream fora do ar as chamadas falham na hora com UpstreamUnavailable em vez
+de esperar o timeout inteiro. O timeout de cada chamada é o menor entre o do
+cliente e o que resta do prazo do request. Para upstreams HTTP baratos dá para
+ligar hedging: se a resposta demora mais que UPSTREAM_HEDGE_AFTER_S, dispara uma
+segunda tentativa (só com token sobrando) e fica com a primeira que responder.
+
+    with request_context(priority=BATCH, deadline_s=8):
+        ...                                # tudo que rodar aqui herda prioridade e prazo
+    js = SCHEDULER.fetch("openweather", lambda timeout: get_json(url, timeout), OWM_TIMEOUT_S)
+"""
+from __future__ import annotations
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import requests
+
+INTERACTIVE, BATCH, BACKGROUND = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch", BACKGROUND: "background"}
+
+# provedor=taxa_por_s:burst; OpenWeather free = 60 chamadas/min sem limite por segundo (burst de um minuto)
+UPSTREAM_LIMITS = os.getenv("UPSTREAM_LIMITS", "openweather=1:60,aqicn=10:20,harmony=1:5")
+# fração do burst que só o tráfego interativo pode usar
+UPSTREAM_RESERVE = {
+    INTERACTIVE: 0.0,
+    BATCH: float(os.getenv("UPSTREAM_RESERVE_BATCH", "0.2")),
+    BACKGROUND: float(os.getenv("UPSTREAM_RESERVE_BACKGROUND", "0.5")),
+}
+# tempo máximo na fila quando o contexto não define prazo
+UPSTREAM_QUEUE_MAX_S = {
+    INTERACTIVE: float(os.getenv("UPSTREAM_QUEUE_MAX_S_INTERACTIVE", "5")),
+    BATCH: float(os.getenv("UPSTREAM_QUEUE_MAX_S_BATCH", "20")),
+    BACKGROUND: float(os.getenv("UPSTREAM_QUEUE_MAX_S_BACKGROUND", "120")),
+}
+
+# falhas seguidas que abrem o breaker e quanto tempo ele fica aberto antes de testar de novo
+UPSTREAM_BREAKER_FAILURES = int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5"))
+UPSTREAM_BREAKER_OPEN_S = float(os.getenv("UPSTREAM_BREAKER_OPEN_S", "30"))
+# provedor=segundos até disparar a tentativa de hedge (vazio desliga)
+UPSTREAM_HEDGE_AFTER_S = os.getenv("UPSTREAM_HEDGE_AFTER_S", "openweather=2.0,aqicn=1.5")
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("upstream_priority", default=INTERACTIVE)
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("upstream_deadline", default=None)
+
+class UpstreamDropped(RuntimeError):
+    """A chamada ficou na fila além do prazo e foi descartada sem ir ao upstream."""
+
+class UpstreamUnavailable(RuntimeError):
+    """Circuit breaker aberto: o upstream está falhando e a chamada nem foi feita."""
+
+class UpstreamFailed(RuntimeError):
+    """O upstream respondeu, mas com falha do lado dele (ex.: job Harmony 'failed'); conta para o breaker."""
+
+@contextmanager
+def request_context(priority: Optional[int] = None, deadline_s: Optional[float] = None) -> Iterator[None]:
+    """Define prioridade e/ou prazo (segundos a partir de agora) para as chamadas feitas neste contexto."""
+    tokens = []
+    if priority is not None:
+        tokens.append((_priority, _priority.set(priority)))
+    if deadline_s is not None:
+        dl = time.monotonic() + deadline_s
+        cur = _deadline.get()
+        tokens.append((_deadline, _deadline.set(dl if cur is None else min(cur, dl))))
+    try:
+        yield
+    finally:
+        for var, tok in reversed(tokens):
+            var.reset(tok)
+
+def current_priority() -> int:
+    return _priority.get()
+
+def current_deadline() -> Optional[float]:
+    """Prazo absoluto (time.monotonic) do contexto atual, se houver."""
+    return _deadline.get()
+
+def remaining_s(default: float) -> float:
+    """Quanto esperar por algo: `default`, limitado pelo que resta do prazo do contexto (>= 0)."""
+    dl = _deadline.get()
+    if dl is None:
+        return default
+    return max(0.0, min(default, dl - time.monotonic()))
+
+def submit_in_context(executor, fn: Callable[..., Any], *args, **kwargs):
+    """executor.submit preservando prioridade/prazo do chamador na thread do pool."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, floor: float) -> float:
+        """Segundos até haver 1 token acima de `floor`."""
+        missing = (floor + 1.0) - self.tokens
+        return 0.0 if missing <= 0 else missing / self.rate
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failures: int = UPSTREAM_BREAKER_FAILURES, open_s: float = UPSTREAM_BREAKER_OPEN_S):
+        self.threshold = failures
+        self.open_s = open_s
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.open_s:
+                    return False
+                self.state = self.HALF_OPEN
+                self.probing = False
+            # meio-aberto: deixa passar uma única chamada de teste
+            if self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def release_probe(self) -> None:
+        with self._lock:
+            self.probing = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+def is_upstream_failure(e: BaseException) -> bool:
+    """Erros que indicam upstream doente (contam para o breaker); 4xx de uso/credencial não contam."""
+    if isinstance(e, requests.HTTPError):
+        code = e.response.status_code if e.response is not None else 0
+        return code >= 500 or code == 429
+    return isinstance(e, (requests.RequestException, OSError, TimeoutError, UpstreamFailed))
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "deadline", "dropped")
+
+    def __init__(self, priority: int, seq: int, deadline: float):
+        self.priority = priority
+        self.seq = seq
+        self.deadline = deadline
+        self.dropped = False
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class _Provider:
+    def __init__(self, name: str, rate: float, burst: float):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.cond = threading.Condition()
+        self.queue: List[_Waiter] = []
+        self.granted = {p: 0 for p in PRIORITY_NAMES}
+        self.dropped = {p: 0 for p in PRIORITY_NAMES}
+        self.wait_s = {p: 0.0 for p in PRIORITY_NAMES}
+        self.breaker = CircuitBreaker()
+        self.fast_failed = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def _purge_expired(self, now: float) -> None:
+        live = []
+        for w in self.queue:
+            if w.deadline <= now:
+                w.dropped = True
+                self.dropped[w.priority] += 1
+            else:
+                live.append(w)
+        if len(live) != len(self.queue):
+            heapq.heapify(live)
+            self.queue = live
+
+def parse_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    out: Dict[str, Tuple[float, float]] = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, rb = part.split("=", 1)
+        rate, _, burst = rb.partition(":")
+        out[name.strip()] = (float(rate), float(burst or rate))
+    return out
+
+def parse_hedges(spec: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, v = part.split("=", 1)
+        out[name.strip()] = float(v)
+    return out
+
+class UpstreamScheduler:
+    def __init__(
+        self,
+        limits: Optional[Dict[str, Tuple[float, float]]] = None,
+        hedges: Optional[Dict[str, float]] = None,
+    ):
+        self._providers: Dict[str, _Provider] = {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self.hedges = parse_hedges(UPSTREAM_HEDGE_AFTER_S) if hedges is None else hedges
+        self._hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="upstream-hedge")
+        for name, (rate, burst) in (limits or parse_limits(UPSTREAM_LIMITS)).items():
+            self._providers[name] = _Provider(name, rate, burst)
+
+    def _provider(self, name: str) -> _Provider:
+        with self._lock:
+            p = self._providers.get(name)
+            if p is None:
+                # provedor sem limite configurado: praticamente ilimitado
+                p = self._providers[name] = _Provider(name, 1e6, 1e6)
+            return p
+
+    def acquire(self, provider: str, priority: Optional[int] = None, deadline: Optional[float] = None) -> None:
+        """
+        Bloqueia até haver token para `provider` na vez desta prioridade.
+        `deadline` é absoluto (time.monotonic); por padrão vem do contexto ou do
+        limite de fila da prioridade. Levanta UpstreamDropped se vencer na fila.
+        """
+        prio = current_priority() if priority is None else priority
+        now = t0 = time.monotonic()
+        dl = deadline if deadline is not None else current_deadline()
+        dl = min(dl, now + UPSTREAM_QUEUE_MAX_S[prio]) if dl is not None else now + UPSTREAM_QUEUE_MAX_S[prio]
+        p = self._provider(provider)
+        me = _Waiter(prio, next(self._seq), dl)
+        with p.cond:
+            heapq.heappush(p.queue, me)
+            while True:
+                now = time.monotonic()
+                p._purge_expired(now)
+                if me.dropped:
+                    p.cond.notify_all()
+                    raise UpstreamDropped(f"{provider}: prazo vencido na fila ({PRIORITY_NAMES[prio]})")
+                p.bucket.refill(now)
+                floor = UPSTREAM_RESERVE[prio] * p.bucket.burst
+                if p.queue[0] is me and p.bucket.tokens >= floor + 1.0:
+                    heapq.heappop(p.queue)
+                    p.bucket.tokens -= 1.0
+                    p.granted[prio] += 1
+                    p.wait_s[prio] += now - t0
+                    p.cond.notify_all()
+                    return
+                timeout = me.deadline - now
+                if p.queue[0] is me:
+                    timeout = min(timeout, p.bucket.wait_for(floor))
+                p.cond.wait(max(0.001, timeout))
+
+    def try_acquire(self, provider: str, priority: int = BACKGROUND) -> bool:
+        """Pega um token só se houver sobrando agora (fila vazia e acima da reserva da prioridade)."""
+        p = self._provider(provider)
+        with p.cond:
+            p.bucket.refill(time.monotonic())
+            if p.queue or p.bucket.tokens < UPSTREAM_RESERVE[priority] * p.bucket.burst + 1.0:
+                return False
+            p.bucket.tokens -= 1.0
+            p.granted[priority] += 1
+            return True
+
+    def _attempt(self, p: _Provider, fn: Callable[[float], Any], timeout: float) -> Any:
+        try:
+            out = fn(timeout)
+        except Exception as e:
+            if is_upstream_failure(e):
+                p.breaker.failure()
+            else:
+                p.breaker.success()
+            raise
+        p.breaker.success()
+        return out
+
+    def fetch(self, provider: str, fn: Callable[[float], Any], timeout_s: float, hedge_after_s: Optional[float] = None) -> Any:
+        """
+        Executa fn(timeout) contra `provider`: breaker -> fila/token -> chamada com o
+        timeout efetivo (timeout_s limitado pelo prazo do contexto). Com hedge ligado
+        para o provedor, fn pode rodar duas vezes em paralelo — deve ser idempotente.
+        """
+        p = self._provider(provider)
+        if not p.breaker.allow():
+            # contadores do provedor mudam sob p.cond, o mesmo lock que stats() usa para lê-los
+            with p.cond:
+                p.fast_failed += 1
+            raise UpstreamUnavailable(f"{provider}: circuit breaker aberto")
+        try:
+            self.acquire(provider)
+        except UpstreamDropped:
+            # não chegou a chamar: libera a sonda do meio-aberto sem julgar o upstream
+            p.breaker.release_probe()
+            raise
+        timeout = remaining_s(timeout_s)
+        if timeout <= 0:
+            p.breaker.release_probe()
+            raise UpstreamDropped(f"{provider}: prazo do request esgotado")
+        hedge = self.hedges.get(provider) if hedge_after_s is None else hedge_after_s
+        if not hedge or hedge >= timeout or p.breaker.state != CircuitBreaker.CLOSED:
+            return self._attempt(p, fn, timeout)
+
+        primary = self._hedge_pool.submit(self._attempt, p, fn, timeout)
+        done, _ = wait([primary], timeout=hedge)
+        if done or not self.try_acquire(provider):
+            return primary.result()
+        with p.cond:
+            p.hedged += 1
+        second = self._hedge_pool.submit(self._attempt, p, fn, max(0.05, timeout - hedge))
+        pending = {primary, second}
+        err: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    if f is second:
+                        with p.cond:
+                            p.hedge_wins += 1
+                    return f.result()
+                err = f.exception()
+        raise err
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        with self._lock:
+            providers = list(self._providers.values())
+        for p in providers:
+            with p.cond:
+                p.bucket.refill(time.monotonic())
+                depth = {n: 0 for n in PRIORITY_NAMES.values()}
+                for w in p.queue:
+                    depth[PRIORITY_NAMES[w.priority]] += 1
+                out[p.name] = {
+                    "rate_per_s": p.bucket.rate,
+                    "burst": p.bucket.burst,
+                    "tokens": round(p.bucket.tokens, 2),
+                    "queued": depth,
+                    "granted": {PRIORITY_NAMES[k]: v for k, v in p.granted.items()},
+                    "dropped": {PRIORITY_NAMES[k]: v for k, v in p.dropped.items()},
+                    "breaker": {
+                        "state": p.breaker.state,
+                        "consecutive_failures": p.breaker.failures,
+                        "trips": p.breaker.trips,
+                        "fast_failed": p.fast_failed,
+                    },
+                    "hedged": p.hedged,
+                    "hedge_wins": p.hedge_wins,
+                    "avg_wait_ms": {
+                        PRIORITY_NAMES[k]: round(1e3 * p.wait_s[k] / p.granted[k], 2) if p.granted[k] else None
+                        for k in PRIORITY_NAMES
+                    },
+                }
+        return out
+
+SCHEDULER = UpstreamScheduler()
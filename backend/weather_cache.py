@@ -0,0 +1,232 @@
+"""
+Cache de clima por célula de grade. A previsão 5 dias/3h do OpenWeather é
+grosseira, então todos os pedidos dentro da mesma célula (0.1°, 0.25°… ou um
+geohash) compartilham um único fetch + to_hourly, feito no centro da célula.
+
+Grade configurável por WEATHER_GRID: "0.25" (graus) ou "geohash:5".
+WEATHER_GRID_SHADOW lista grades candidatas cujo hit-rate é só simulado,
+para escolher o tamanho a partir do tráfego real.
+"""
+from __future__ import annotations
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from upstream import remaining_s
+
+WEATHER_GRID = os.getenv("WEATHER_GRID", "0.25")
+WEATHER_GRID_SHADOW = os.getenv("WEATHER_GRID_SHADOW", "0.1,0.5,geohash:4,geohash:5")
+WEATHER_CACHE_TTL_S = float(os.getenv("WEATHER_CACHE_TTL_S", "1800"))
+WEATHER_CACHE_MAX_CELLS = int(os.getenv("WEATHER_CACHE_MAX_CELLS", "5000"))
+# por quanto tempo além do TTL um frame vencido ainda serve se o fetch falhar
+WEATHER_CACHE_SERVE_STALE_S = float(os.getenv("WEATHER_CACHE_SERVE_STALE_S", "10800"))
+
+_GH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+def geohash_encode(lat: float, lon: float, precision: int) -> str:
+    lat_lo, lat_hi, lon_lo, lon_hi = -90.0, 90.0, -180.0, 180.0
+    out, bits, ch, even = [], 0, 0, True
+    while len(out) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            ch = (ch << 1) | (lon >= mid)
+            lon_lo, lon_hi = (mid, lon_hi) if lon >= mid else (lon_lo, mid)
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            ch = (ch << 1) | (lat >= mid)
+            lat_lo, lat_hi = (mid, lat_hi) if lat >= mid else (lat_lo, mid)
+        even = not even
+        bits += 1
+        if bits == 5:
+            out.append(_GH_ALPHABET[ch])
+            bits, ch = 0, 0
+    return "".join(out)
+
+def geohash_center(gh: str) -> Tuple[float, float]:
+    lat_lo, lat_hi, lon_lo, lon_hi = -90.0, 90.0, -180.0, 180.0
+    even = True
+    for c in gh:
+        v = _GH_ALPHABET.index(c)
+        for shift in range(4, -1, -1):
+            bit = (v >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                lon_lo, lon_hi = (mid, lon_hi) if bit else (lon_lo, mid)
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                lat_lo, lat_hi = (mid, lat_hi) if bit else (lat_lo, mid)
+            even = not even
+    return ((lat_lo + lat_hi) / 2, (lon_lo + lon_hi) / 2)
+
+def cell_of(lat: float, lon: float, grid: str) -> Tuple[str, float, float]:
+    """(chave da célula, lat do centro, lon do centro) para a grade dada."""
+    if grid.startswith("geohash:"):
+        gh = geohash_encode(lat, lon, int(grid.split(":", 1)[1]))
+        clat, clon = geohash_center(gh)
+        return gh, round(clat, 4), round(clon, 4)
+    step = float(grid)
+    i, j = math.floor(lat / step), math.floor(lon / step)
+    return f"{i}:{j}", round((i + 0.5) * step, 4), round((j + 0.5) * step, 4)
+
+class _GridStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": (self.hits / total) if total else None}
+
+class WeatherGridCache:
+    def __init__(
+        self,
+        grid: str = WEATHER_GRID,
+        ttl_s: float = WEATHER_CACHE_TTL_S,
+        max_cells: int = WEATHER_CACHE_MAX_CELLS,
+        shadow_grids: Optional[List[str]] = None,
+        serve_stale_s: float = WEATHER_CACHE_SERVE_STALE_S,
+    ):
+        self.grid = grid
+        self.ttl_s = ttl_s
+        self.serve_stale_s = serve_stale_s
+        self.max_cells = max_cells
+        if shadow_grids is None:
+            shadow_grids = [g.strip() for g in WEATHER_GRID_SHADOW.split(",") if g.strip()]
+        self.shadow_grids = [g for g in shadow_grids if g != grid]
+        self._entries: "OrderedDict[str, Tuple[float, pd.DataFrame]]" = OrderedDict()
+        self._inflight: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.fetches = 0
+        self.fetch_errors = 0
+        self.stale_served = 0
+        self.follower_timeouts = 0
+        self._stats: Dict[str, _GridStats] = {g: _GridStats() for g in [grid] + self.shadow_grids}
+        # grades-sombra só guardam o instante do "fetch" simulado de cada célula
+        self._shadow: Dict[str, "OrderedDict[str, float]"] = {g: OrderedDict() for g in self.shadow_grids}
+
+    def _fresh(self, key: str, now: float) -> Optional[pd.DataFrame]:
+        ent = self._entries.get(key)
+        if ent and (now - ent[0]) < self.ttl_s:
+            self._entries.move_to_end(key)
+            return ent[1]
+        return None
+
+    def _record_shadow(self, lat: float, lon: float, now: float) -> None:
+        for g, seen in self._shadow.items():
+            key = cell_of(lat, lon, g)[0]
+            ts = seen.get(key)
+            if ts is not None and (now - ts) < self.ttl_s:
+                self._stats[g].hits += 1
+            else:
+                self._stats[g].misses += 1
+                seen[key] = now
+            seen.move_to_end(key)
+            while len(seen) > self.max_cells:
+                seen.popitem(last=False)
+
+    def get(self, lat: float, lon: float, fetch_hourly: Callable[[float, float], pd.DataFrame]) -> pd.DataFrame:
+        """
+        Devolve o frame horário da célula de (lat, lon); em miss chama
+        fetch_hourly(lat_centro, lon_centro) uma única vez por célula, mesmo com
+        pedidos concorrentes. Se o fetch falhar e a célula tiver um frame vencido
+        há menos de serve_stale_s, devolve esse. O frame é compartilhado: não modificar.
+
+        Quem espera o fetch de outro pedido espera no máximo o próprio prazo
+        (upstream.remaining_s): o líder pode ser BACKGROUND/BATCH preso na fila do
+        scheduler. Estourado o prazo, serve o frame vencido ou busca por conta própria.
+        """
+        key, clat, clon = cell_of(lat, lon, self.grid)
+        now = time.time()
+        with self._lock:
+            self._record_shadow(lat, lon, now)
+            df = self._fresh(key, now)
+            if df is not None:
+                self._stats[self.grid].hits += 1
+                return df
+            self._stats[self.grid].misses += 1
+            flight = self._inflight.setdefault(key, threading.Lock())
+        wait_s = remaining_s(math.inf)
+        if not flight.acquire(timeout=-1 if math.isinf(wait_s) else wait_s):
+            with self._lock:
+                self.follower_timeouts += 1
+                stale = self._stale(key)
+                if stale is not None:
+                    self.stale_served += 1
+                    return stale
+            # sem frame para servir: fetch independente, com a prioridade e o prazo deste pedido
+            return self._fetch(key, clat, clon, fetch_hourly)
+        try:
+            with self._lock:
+                df = self._fresh(key, time.time())
+            if df is not None:
+                return df
+            return self._fetch(key, clat, clon, fetch_hourly)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.release()
+
+    def _stale(self, key: str) -> Optional[pd.DataFrame]:
+        ent = self._entries.get(key)
+        if ent is not None and self.serve_stale_s and (time.time() - ent[0]) < self.ttl_s + self.serve_stale_s:
+            return ent[1]
+        return None
+
+    def _fetch(self, key: str, clat: float, clon: float, fetch_hourly: Callable[[float, float], pd.DataFrame]) -> pd.DataFrame:
+        try:
+            with self._lock:
+                self.fetches += 1
+            df = fetch_hourly(clat, clon)
+        except Exception:
+            with self._lock:
+                self.fetch_errors += 1
+                stale = self._stale(key)
+                if stale is not None:
+                    # upstream fora: melhor um frame um pouco velho do que um 503
+                    self.stale_served += 1
+                    return stale
+            raise
+        with self._lock:
+            self._entries[key] = (time.time(), df)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_cells:
+                self._entries.popitem(last=False)
+        return df
+
+    def peek(self, lat: float, lon: float) -> Optional[pd.DataFrame]:
+        """Último frame da célula, mesmo vencido; None se nunca buscado. Não chama o upstream nem conta hit/miss."""
+        key = cell_of(lat, lon, self.grid)[0]
+        with self._lock:
+            ent = self._entries.get(key)
+        return ent[1] if ent else None
+
+    def is_fresh(self, lat: float, lon: float) -> bool:
+        """A célula tem frame dentro do TTL; não chama o upstream nem conta hit/miss."""
+        key = cell_of(lat, lon, self.grid)[0]
+        with self._lock:
+            ent = self._entries.get(key)
+        return ent is not None and (time.time() - ent[0]) < self.ttl_s
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            for seen in self._shadow.values():
+                seen.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "grid": self.grid,
+                "ttl_s": self.ttl_s,
+                "cells": len(self._entries),
+                "fetches": self.fetches,
+                "fetch_errors": self.fetch_errors,
+                "stale_served": self.stale_served,
+                "follower_timeouts": self.follower_timeouts,
+                "by_grid": {g: s.as_dict() for g, s in self._stats.items()},
+            }
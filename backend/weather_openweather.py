@@ -1,8 +1,15 @@
 from __future__ import annotations
-import os, datetime as dt, requests, pandas as pd
+import os, datetime as dt, requests, numpy as np, pandas as pd
+from typing import Optional, Sequence, Tuple
+from upstream import SCHEDULER
 
 OWM_KEY = os.getenv("OPENWEATHER_API_KEY", "")
 OWM_TIMEOUT_S = float(os.getenv("OPENWEATHER_TIMEOUT_S", "8"))
+OWM_BASE_URL = os.getenv("OPENWEATHER_BASE_URL", "https://api.openweathermap.org").rstrip("/")
+
+# colunas numéricas de forecast_to_df / to_hourly, nesta ordem
+FIELDS = ("temp", "humidity", "pressure", "wind_speed", "wind_deg", "clouds", "rain_3h", "snow_3h")
+HOURLY_FIELDS = FIELDS + ("rain_1h_est", "snow_1h_est")
 
 def _raise_if_no_key():
     if not OWM_KEY:
@@ -10,11 +17,13 @@ def _raise_if_no_key():
 
 def fetch_forecast(lat: float, lon: float, units: str = "metric") -> dict:
     _raise_if_no_key()
-    url = "https://api.openweathermap.org/data/2.5/forecast"
+    url = f"{OWM_BASE_URL}/data/2.5/forecast"
     params = {"lat": lat, "lon": lon, "appid": OWM_KEY, "units": units}
-    r = requests.get(url, params=params, timeout=OWM_TIMEOUT_S)
-    r.raise_for_status()
-    return r.json()
+    def _get(timeout: float) -> dict:
+        r = requests.get(url, params=params, timeout=timeout)
+        r.raise_for_status()
+        return r.json()
+    return SCHEDULER.fetch("openweather", _get, OWM_TIMEOUT_S)
 
 def forecast_to_df(js: dict) -> pd.DataFrame:
     rows = []
@@ -75,3 +84,118 @@ def to_hourly(df3h: pd.DataFrame) -> pd.DataFrame:
 
     return df.reset_index()
 
+
+# --- caminho vetorizado: JSON -> arrays NumPy, sem DataFrame intermediário ---
+
+def _slot(it: dict) -> tuple:
+    main = it.get("main") or {}
+    wind = it.get("wind") or {}
+    return (
+        it["dt"],
+        main.get("temp"), main.get("humidity"), main.get("pressure"),
+        wind.get("speed"), wind.get("deg"),
+        (it.get("clouds") or {}).get("all"),
+        (it.get("rain") or {}).get("3h"),
+        (it.get("snow") or {}).get("3h"),
+    )
+
+def forecast_to_arrays(js: dict) -> Tuple[np.ndarray, np.ndarray]:
+    """(t epoch s int64 (n,), X float (n, len(FIELDS))) ordenados por t; ausentes viram NaN."""
+    slots = [_slot(it) for it in js.get("list", [])]
+    if not slots:
+        return np.empty(0, dtype=np.int64), np.empty((0, len(FIELDS)))
+    # None -> NaN na conversão para float
+    a = np.array(slots, dtype=float)
+    order = np.argsort(a[:, 0], kind="stable")
+    return a[order, 0].astype(np.int64), a[order, 1:]
+
+def interp_hours(t: np.ndarray, X: np.ndarray, t_out: np.ndarray, clamp: bool = False) -> np.ndarray:
+    """
+    Interpolação linear no tempo de todas as colunas de X para t_out. Cada
+    coluna usa só os seus pontos válidos; depois do último fica constante e
+    antes do primeiro fica NaN (como interpolate(method="time") + ffill), a
+    menos que clamp=True, que repete o primeiro valor. t fora de ordem ou com
+    instantes repetidos (dt duplicado na lista do OWM) é ordenado e fica a
+    última leitura de cada instante.
+    """
+    out = np.full((t_out.size, X.shape[1]), np.nan)
+    if t.size == 0:
+        return out
+    if t.size > 1 and not (np.diff(t) > 0).all():
+        # passo zero daria divisão por zero nos pesos (linhas NaN/inf)
+        order = np.argsort(t, kind="stable")
+        t, X = t[order], X[order]
+        last = np.append(t[1:] != t[:-1], True)
+        t, X = t[last], X[last]
+    ok = np.isfinite(X)
+    full = ok.all(axis=0)
+    if full.any():
+        # colunas completas: um único searchsorted e pesos para todas de uma vez
+        tf = t.astype(float)
+        i = np.clip(np.searchsorted(tf, t_out, side="right"), 1, max(tf.size - 1, 1))
+        if tf.size == 1:
+            out[:, full] = X[0, full]
+        else:
+            w = np.clip((t_out - tf[i - 1]) / (tf[i] - tf[i - 1]), 0.0, 1.0)[:, None]
+            out[:, full] = X[i - 1][:, full] * (1.0 - w) + X[i][:, full] * w
+        if not clamp:
+            out[t_out < tf[0], :] = np.where(full, np.nan, out[t_out < tf[0], :])
+    for j in np.flatnonzero(~full):
+        m = ok[:, j]
+        if not m.any():
+            continue
+        tj = t[m]
+        out[:, j] = np.interp(t_out, tj, X[m, j])
+        if not clamp:
+            out[t_out < tj[0], j] = np.nan
+    return out
+
+def hourly_arrays(t: np.ndarray, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Série horária do primeiro ao último slot: (t_h (h,), H (h, len(HOURLY_FIELDS)))."""
+    if t.size == 0:
+        return t, np.empty((0, len(HOURLY_FIELDS)))
+    t_h = np.arange(t[0], t[-1] + 1, 3600, dtype=np.int64)
+    H = np.empty((t_h.size, len(HOURLY_FIELDS)))
+    H[:, :len(FIELDS)] = interp_hours(t, X, t_h)
+    # estimativas 1h a partir dos acumulados 3h
+    H[:, len(FIELDS):] = np.nan_to_num(H[:, [FIELDS.index("rain_3h"), FIELDS.index("snow_3h")]], nan=0.0) / 3.0
+    return t_h, H
+
+def hourly_frame(t_h: np.ndarray, H: np.ndarray) -> pd.DataFrame:
+    """Mesmo formato de to_hourly(forecast_to_df(js))."""
+    df = pd.DataFrame(H, columns=list(HOURLY_FIELDS))
+    # em µs, como o frame vindo de datetime.datetime em forecast_to_df
+    df.insert(0, "datetime_utc", pd.to_datetime(t_h * 10**6, unit="us", utc=True))
+    return df
+
+def forecast_to_hourly(js: dict) -> pd.DataFrame:
+    """Equivalente a to_hourly(forecast_to_df(js)), direto em NumPy."""
+    return hourly_frame(*hourly_arrays(*forecast_to_arrays(js)))
+
+def stack_hourly(
+    payloads: Sequence[Optional[dict]],
+    t_out: Optional[np.ndarray] = None,
+    fields: Sequence[str] = HOURLY_FIELDS,
+    clamp: bool = False,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vários locais de uma vez: (t_out, A[locais, horas, campos]). Sem t_out, o
+    eixo vai da primeira à última hora de todos os locais. Payload ausente
+    (None, fetch falhou) vira uma linha toda NaN.
+    """
+    parsed = [forecast_to_arrays(js) if js else None for js in payloads]
+    if t_out is None:
+        t0 = [p[0][0] for p in parsed if p is not None and p[0].size]
+        t1 = [p[0][-1] for p in parsed if p is not None and p[0].size]
+        t_out = np.arange(min(t0), max(t1) + 1, 3600, dtype=np.int64) if t0 else np.empty(0, dtype=np.int64)
+    cols = [HOURLY_FIELDS.index(f) for f in fields]
+    A = np.full((len(parsed), t_out.size, len(cols)), np.nan)
+    for k, p in enumerate(parsed):
+        if p is None or p[0].size == 0:
+            continue
+        t, X = p
+        H = np.empty((t_out.size, len(HOURLY_FIELDS)))
+        H[:, :len(FIELDS)] = interp_hours(t, X, t_out, clamp=clamp)
+        H[:, len(FIELDS):] = np.nan_to_num(H[:, [FIELDS.index("rain_3h"), FIELDS.index("snow_3h")]], nan=0.0) / 3.0
+        A[k] = H[:, cols]
+    return t_out, A
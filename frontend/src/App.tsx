@@ -169,6 +169,8 @@ export default function App() {
   const modelRisk = (data?.risk as Risk) || "low";
   const apiRisk = apiIndexToRisk(apiIndexValue);
   const displayRisk = worstRisk(modelRisk, apiRisk);
+  // o ensemble só vê o modelo; o rótulo pode ter vindo do AQI de solo (override) ou do índice
+  const ensembleModelOnly = !!data?.ensemble && displayRisk !== (data?.validation?.model_bucket_raw ?? data?.risk);
   const riskColor = displayRisk === "high" ? "#ef4444" : displayRisk === "moderate" ? "#f59e0b" : "#10b981";
 
   return (
@@ -248,6 +250,15 @@ export default function App() {
                 <span style={{ background: riskColor, color: "#fff", padding: "4px 10px", borderRadius: 8 }}>
                   {displayRisk.toUpperCase()}
                 </span>
+                {data.ensemble && (
+                  <span
+                    style={{ marginLeft: 10, fontSize: 13, color: "#9ca3af" }}
+                    title="Share of forecast-model ensemble members reaching high; ground AQI is not included"
+                  >
+                    P(high, model only) {Math.round(data.ensemble.risk_probabilities.high * 100)}% · {data.ensemble.members} members
+                    {ensembleModelOnly && " · headline risk set by ground/index data"}
+                  </span>
+                )}
               </div>
 
               <div style={{ display: "flex", gap: 8, flexWrap: "wrap", marginTop: 12 }}>
@@ -281,7 +292,7 @@ export default function App() {
                   <h3>Alerts</h3>
                   <AlertBadge risk={displayRisk as any} nextCritical={data.alerts.next_critical_hour as any} />
                   <div style={{ marginTop: 8 }}>
-                    <NotifyOptIn nextCritical={data.alerts.next_critical_hour as any} />
+                    <NotifyOptIn nextCritical={data.alerts.next_critical_hour as any} lat={data.lat} lon={data.lon} />
                   </div>
                 </div>
               )}
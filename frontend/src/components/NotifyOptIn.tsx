@@ -1,4 +1,5 @@
 import { useEffect, useRef, useState } from "react";
+import { getAlertsSocketUrl, type AlertMessage } from "../lib/api";
 
 function parseIso(s?: string | null): Date | null {
   if (!s) return null;
@@ -6,9 +7,54 @@ function parseIso(s?: string | null): Date | null {
   return Number.isFinite(t) ? new Date(t) : null;
 }
 
-export default function NotifyOptIn({ nextCritical, title = "Risco alto de NO₂ chegando" }: { nextCritical?: string | null; title?: string }) {
+type Props = { nextCritical?: string | null; lat?: number; lon?: number; title?: string };
+
+// com notificações ativas, assina /ws/alerts para o local e segue os deltas do servidor
+function useLiveNextCritical(enabled: boolean, lat?: number, lon?: number): string | null | undefined {
+  const [live, setLive] = useState<string | null | undefined>(undefined);
+
+  useEffect(() => {
+    setLive(undefined);
+    if (!enabled || lat === undefined || lon === undefined || typeof WebSocket === "undefined") return;
+    let ws: WebSocket | null = null;
+    let retry: number | null = null;
+    let attempt = 0;
+    let closed = false;
+
+    const connect = () => {
+      ws = new WebSocket(getAlertsSocketUrl());
+      ws.onopen = () => {
+        attempt = 0;
+        ws?.send(JSON.stringify({ op: "subscribe", locations: [{ id: "current", lat, lon }] }));
+      };
+      ws.onmessage = (ev) => {
+        let msg: AlertMessage;
+        try { msg = JSON.parse(ev.data); } catch { return; }
+        if (msg.type === "snapshot") setLive(msg.next_critical_hour);
+        else if (msg.type === "delta" && msg.changes && "next_critical_hour" in msg.changes) setLive(msg.changes.next_critical_hour ?? null);
+      };
+      ws.onclose = () => {
+        if (closed) return;
+        // reconecta com backoff (1s, 2s, 4s… até 60s); o snapshot da reassinatura repõe o estado
+        retry = window.setTimeout(connect, Math.min(60000, 1000 * 2 ** attempt++));
+      };
+    };
+    connect();
+    return () => {
+      closed = true;
+      if (retry) window.clearTimeout(retry);
+      ws?.close();
+    };
+  }, [enabled, lat, lon]);
+
+  return live;
+}
+
+export default function NotifyOptIn({ nextCritical: fromForecast, lat, lon, title = "Risco alto de NO₂ chegando" }: Props) {
   const [perm, setPerm] = useState<NotificationPermission>(typeof Notification !== "undefined" ? Notification.permission : "denied");
   const timerRef = useRef<number | null>(null);
+  const live = useLiveNextCritical(perm === "granted", lat, lon);
+  const nextCritical = live !== undefined ? live : fromForecast;
 
   function request() {
     if (typeof Notification === "undefined") return;
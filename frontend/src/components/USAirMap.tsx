@@ -2,7 +2,7 @@ import React, { useEffect, useMemo, useRef, useState } from "react";
 import { geoAlbersUsa, geoPath } from "d3-geo";
 import * as topojson from "topojson-client";
 import type { Topology, Objects } from "topojson-specification";
-import { getBase } from "../lib/api";
+import { streamStatesSummary } from "../lib/api";
 
 type Props = { onSelect: (s: { name: string; lat: number; lon: number }) => void; useNASA?: boolean };
 type Risk = "low" | "moderate" | "high" | "unknown";
@@ -38,23 +38,27 @@ export default function USAirMap({ onSelect, useNASA = false }: Props) {
     };
   }, []);
 
-  async function loadSummary(useNasaFlag: boolean) {
+  async function loadSummary(useNasaFlag: boolean, signal: AbortSignal) {
     setLoadingMap(true);
+    setRiskMap({});
     try {
-      const res = await fetch(`${getBase()}/states/summary?skip_nasa=${useNasaFlag ? "false" : "true"}`);
-      const js = await res.json();
-      const map: Record<string, Risk> = {};
-      for (const it of js.items as any[]) map[it.state] = (it.risk || "unknown") as Risk;
-      setRiskMap(map);
+      // pinta cada estado assim que chega, sem esperar o mais lento
+      await streamStatesSummary(
+        (it) => setRiskMap((prev) => ({ ...prev, [it.state]: (it.risk || "unknown") as Risk })),
+        !useNasaFlag,
+        signal
+      );
     } catch (e) {
-      console.error(e);
+      if (!signal.aborted) console.error(e);
     } finally {
-      setLoadingMap(false);
+      if (!signal.aborted) setLoadingMap(false);
     }
   }
 
   useEffect(() => {
-    loadSummary(useNASA);
+    const ctrl = new AbortController();
+    loadSummary(useNASA, ctrl.signal);
+    return () => ctrl.abort();
   }, [useNASA]);
 
   const features = useMemo(() => {
@@ -87,7 +91,7 @@ export default function USAirMap({ onSelect, useNASA = false }: Props) {
     <div style={{ position: "relative" }}>
       <div style={{ padding: 8, display: "flex", justifyContent: "space-between", alignItems: "center" }}>
         <div style={{ fontSize: 14, color: "#9ca3af" }}>{loadingMap ? "Updating map..." : "Click a state to view details"}</div>
-        <div style={{ fontSize: 12, color: "#9ca3af" }}>Risk source: /states/summary</div>
+        <div style={{ fontSize: 12, color: "#9ca3af" }}>Risk source: /states/summary/stream</div>
       </div>
       <svg ref={svgRef} width={width} height={height} style={{ display: "block", height: "auto" }}>
         <rect x={0} y={0} width={width} height={height} fill="#0b0f19" />
@@ -27,6 +27,14 @@ export type GroundSample = {
   attribution?: string | null;
   fetched_utc?: string | null;
 };
+export type EnsembleSummary = {
+  members: number;
+  quantiles: number[];
+  // colunar, alinhado com forecast: no2_p10/no2_p50/no2_p90 e p_high por hora
+  hourly: { datetime_utc: string[]; p_high: number[]; [k: string]: Array<number | string> };
+  risk_probabilities: { low: number; moderate: number; high: number };
+  ratio_peak_over_seed: Record<string, number>;
+};
 export type ForecastPayload = {
   lat: number;
   lon: number;
@@ -38,7 +46,8 @@ export type ForecastPayload = {
   tempo: Record<string, any>;
   ground?: GroundSample | null;
   alerts?: { hourly_risk?: Array<{ datetime_utc: string; risk: string }>; next_critical_hour?: string | null } | null;
-  validation?: { ground_bucket?: string; model_bucket?: string; concordance?: string } | null;
+  validation?: { ground_bucket?: string; model_bucket?: string; model_bucket_raw?: string; concordance?: string } | null;
+  ensemble?: EnsembleSummary | null;
   o3_forecast?: ForecastPoint[] | null;
   hcho_forecast?: ForecastPoint[] | null;
   pm25_forecast?: ForecastPoint[] | null;
@@ -101,6 +110,55 @@ export async function getStatesSummary(skip_nasa = true): Promise<StatesSummaryI
   return Array.isArray(js?.items) ? (js.items as StatesSummaryItem[]) : [];
 }
 
+// NDJSON: chama onItem para cada estado assim que o backend o libera (cache primeiro)
+export async function streamStatesSummary(
+  onItem: (it: StatesSummaryItem) => void,
+  skip_nasa = true,
+  signal?: AbortSignal
+): Promise<void> {
+  const url = buildUrl("/states/summary/stream", { skip_nasa });
+  const r = await fetch(url, { signal });
+  if (!r.ok || !r.body) {
+    const text = await r.text().catch(() => "");
+    throw new Error(`API ${r.status}: ${text || r.statusText}`);
+  }
+  const reader = r.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = "";
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (value) buf += decoder.decode(value, { stream: true });
+    let nl: number;
+    while ((nl = buf.indexOf("\n")) >= 0) {
+      const line = buf.slice(0, nl).trim();
+      buf = buf.slice(nl + 1);
+      if (line) onItem(JSON.parse(line) as StatesSummaryItem);
+    }
+    if (done) break;
+  }
+  if (buf.trim()) onItem(JSON.parse(buf) as StatesSummaryItem);
+}
+
+export type AlertSnapshot = {
+  type: "snapshot";
+  id: string;
+  risk: string;
+  next_critical_hour: string | null;
+  hourly_risk: Array<{ datetime_utc: string; risk: string }>;
+  ground?: { aqi?: number | string | null; station?: string | null; time_local?: string | null } | null;
+};
+export type AlertDelta = {
+  type: "delta";
+  id: string;
+  changes?: Partial<Omit<AlertSnapshot, "type" | "id" | "hourly_risk">>;
+  hourly_risk?: { set: Record<string, string>; removed: string[] };
+};
+export type AlertMessage = AlertSnapshot | AlertDelta | { type: "error"; id: string | null; detail: string };
+
+export function getAlertsSocketUrl() {
+  return new URL("/ws/alerts", BASE).toString().replace(/^http/, "ws");
+}
+
 export function getTempoOverlayUrl(bbox = "-125,24,-66,50", prefer_l3 = true, hours = 8) {
   return buildUrl("/tempo/latest_overlay.png", { bbox, prefer_l3, hours });
 }